@@ -356,19 +356,20 @@ def format_message(msg: dict) -> str:
     if sender_type == 'atendente' and content.startswith('*'):
         content = re.sub(r'^\*[^:]+:\*\s*\n?', '', content)
     
-    # Detectar tipo de conteúdo
+    # Detectar tipo de conteúdo (attachment_type vem normalizado do sync)
     content_type = msg.get('content_type', 'text')
+    attachment_type = msg.get('attachment_type')
     
-    if content_type == 'audio' or '"file_type":"audio"' in content:
+    if content_type == 'audio' or attachment_type == 'audio':
         # Usar transcrição se disponível
         transcription = msg.get('transcription')
         if transcription:
             content = f'[🎤 ÁUDIO TRANSCRITO]: "{transcription}"'
         else:
             content = '[🎤 ÁUDIO - sem transcrição]'
-    elif content_type == 'image' or '"file_type":"image"' in content:
+    elif content_type == 'image' or attachment_type == 'image':
         content = '[📷 IMAGEM ENVIADA]'
-    elif content_type == 'document' or '"file_type":"file"' in content:
+    elif content_type == 'document' or attachment_type == 'file':
         content = '[📄 DOCUMENTO/PDF ENVIADO]'
     
     # Limitar tamanho
@@ -477,7 +478,7 @@ def analyze_conversation(conversation_id: str) -> Dict[str, Any]:
         }
     
     # 3b. Buscar transcrições dos áudios
-    audio_msg_ids = [m['id'] for m in messages if m.get('content_type') == 'audio']
+    audio_msg_ids = [m['id'] for m in messages if m.get('content_type') == 'audio' or m.get('attachment_type') == 'audio']
     transcriptions = {}
     
     if audio_msg_ids:
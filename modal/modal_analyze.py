@@ -41,6 +41,10 @@ SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_KEY", "")
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+# attachment_type que aparecem como documento no contexto da IA (os demais,
+# como location/contact/sticker, seguem com o texto da mensagem)
+DOCUMENT_ATTACHMENT_TYPES = ('file', 'document')
+
 # ============================================
 # ROTEIROS DE VENDAS
 # ============================================
@@ -254,22 +258,26 @@ def format_message(msg: dict) -> str:
     content = msg.get('content') or ''
     content_type = msg.get('content_type') or ''
     
+    attachment_type = msg.get('attachment_type')
+    
     # Áudio
-    if content_type == 'audio' or (content.startswith('{') and 'audio' in content.lower()):
+    if content_type == 'audio' or attachment_type == 'audio':
         metadata = msg.get('metadata') or {}
         transcription = metadata.get('transcricao') or metadata.get('transcription')
         text = f"[ÁUDIO] {transcription}" if transcription else "[ÁUDIO - sem transcrição]"
     # Imagem
-    elif content.startswith('{') and 'image' in content.lower():
+    elif attachment_type == 'image':
         text = "[IMAGEM ENVIADA]"
     # Vídeo
-    elif content.startswith('{') and 'video' in content.lower():
+    elif attachment_type == 'video':
         text = "[VÍDEO ENVIADO]"
     # Documento
-    elif content.startswith('{') and ('file' in content.lower() or 'document' in content.lower()):
+    elif attachment_type in DOCUMENT_ATTACHMENT_TYPES:
         text = "[DOCUMENTO ENVIADO]"
-    # Texto
+    # Texto (e anexos sem rótulo próprio: o texto já extraído pelo sync, se houver)
     else:
+        if attachment_type and msg.get('text_content') is not None:
+            content = msg['text_content']
         text = remove_agent_prefix(content) if sender_type == 'atendente' else content
     
     return f"{timestamp} | [{sender_type.upper()}] {sender_name}: {text}"
@@ -358,7 +366,7 @@ def analyze_conversation(conversation_id: str) -> Dict[str, Any]:
     # 3. Buscar mensagens
     print("   📨 Buscando mensagens...")
     resp = requests.get(
-        f"{base_url}/messages?conversation_id=eq.{conversation_id}&select=id,content,content_type,sender_type,from_me,sent_at,metadata&order=sent_at.asc",
+        f"{base_url}/messages?conversation_id=eq.{conversation_id}&select=id,content,content_type,attachment_type,text_content,sender_type,from_me,sent_at,metadata&order=sent_at.asc",
         headers=headers
     )
     resp.raise_for_status()
@@ -107,7 +107,7 @@ def transcribe_audio(message_id: str) -> Dict[str, Any]:
     
     # 1. Buscar mensagem
     resp = requests.get(
-        f"{base_url}/messages?id=eq.{message_id}&select=id,content,content_type,conversation_id,sent_at",
+        f"{base_url}/messages?id=eq.{message_id}&select=id,content,content_type,attachment_url,conversation_id,sent_at",
         headers=headers
     )
     messages = resp.json() if resp.status_code == 200 else []
@@ -128,8 +128,8 @@ def transcribe_audio(message_id: str) -> Dict[str, Any]:
         print(f"   ⏭️ Já transcrito")
         return {"status": "already_transcribed", "message_id": message_id}
     
-    # 3. Extrair URL do áudio
-    audio_url = extract_audio_url(message.get('content'))
+    # 3. URL do áudio (normalizada no sync; content JSON só para linhas antigas)
+    audio_url = message.get('attachment_url') or extract_audio_url(message.get('content'))
     
     if not audio_url:
         return {"error": "URL de áudio não encontrada", "message_id": message_id}
@@ -285,7 +285,7 @@ def transcribe_batch(limit: int = 50, days: int = 7) -> Dict[str, Any]:
     since = (datetime.now() - timedelta(days=days)).isoformat()
     
     resp = requests.get(
-        f"{base_url}/messages?content_type=eq.audio&sent_at=gte.{since}&select=id,content&limit={limit * 2}",
+        f"{base_url}/messages?attachment_type=eq.audio&sent_at=gte.{since}&select=id&limit={limit * 2}",
         headers=headers
     )
     messages = resp.json() if resp.status_code == 200 else []
@@ -377,7 +377,7 @@ def run_single(message_id: str = None):
         
         since = (datetime.now() - timedelta(days=5)).isoformat()
         resp = requests.get(
-            f"{SUPABASE_URL}/rest/v1/messages?content_type=eq.audio&sent_at=gte.{since}&select=id&limit=1",
+            f"{SUPABASE_URL}/rest/v1/messages?attachment_type=eq.audio&sent_at=gte.{since}&select=id&limit=1",
             headers=headers
         )
         messages = resp.json() if resp.status_code == 200 else []
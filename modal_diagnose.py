@@ -8,46 +8,47 @@ from datetime import datetime
 
 app = modal.App("indaia-debug")
 
+# Imagem com dependências (+ sync/utils montado como pacote `utils`)
 image = modal.Image.debian_slim(python_version="3.11").pip_install(
     "psycopg2-binary",
     "supabase",
     "httpx",
+).add_local_dir(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sync", "utils"),
+    remote_path="/root/utils",
 )
 
 secrets = modal.Secret.from_name("indaia-secrets")
 
 
-@app.function(image=image, secrets=[secrets], timeout=300)
-def diagnose():
+@app.cls(image=image, secrets=[secrets], timeout=300, scaledown_window=5 * 60)
+class Diagnoser:
+    """Conexões criadas uma vez por container; diagnósticos seguidos reaproveitam."""
+    
+    @modal.enter()
+    def setup(self):
+        from utils.runtime import ContainerRuntime
+        self.runtime = ContainerRuntime(pool_max=1)
+    
+    @modal.method()
+    def diagnose(self) -> dict:
+        self.runtime.start_run()
+        with self.runtime.neon.connection() as neon:
+            return run_diagnosis(neon, self.runtime.supabase, self.runtime.tenant_id)
+    
+    @modal.exit()
+    def teardown(self):
+        self.runtime.close()
+
+
+def run_diagnosis(neon, supabase, tenant_id: str) -> dict:
     """Diagnóstico completo."""
-    import psycopg2
-    from psycopg2.extras import RealDictCursor
-    from supabase import create_client
     import httpx
-    import json
     
     print("=" * 60)
     print("🔍 DIAGNÓSTICO INDAIÁ")
     print("=" * 60)
     
-    # Conectar
-    neon = psycopg2.connect(
-        host=os.environ['NEON_HOST'],
-        database=os.environ['NEON_DATABASE'],
-        user=os.environ['NEON_USER'],
-        password=os.environ['NEON_PASSWORD'],
-        sslmode='require',
-        cursor_factory=RealDictCursor
-    )
-    
-    supabase = create_client(
-        os.environ['SUPABASE_URL'],
-        os.environ['SUPABASE_SERVICE_KEY']
-    )
-    
-    tenant = supabase.table('tenants').select('id').eq('slug', 'indaia').single().execute()
-    tenant_id = tenant.data['id']
-    
     print(f"\n✅ Conectado ao tenant: {tenant_id[:8]}...")
     
     # ============================================================
@@ -124,37 +125,32 @@ def diagnose():
     
     # Buscar um áudio do Supabase
     audio_msg = supabase.table('messages')\
-        .select('id,external_id,content')\
+        .select('id,external_id,attachment_url')\
         .eq('tenant_id', tenant_id)\
-        .like('content', '%"file_type":"audio"%')\
+        .eq('attachment_type', 'audio')\
         .limit(1)\
         .execute()
     
     if audio_msg.data:
         msg = audio_msg.data[0]
-        content = msg.get('content', '')
+        url = msg.get('attachment_url') or ''
         
         try:
-            data = json.loads(content)
-            attachments = data.get('attachments', [])
-            for att in attachments:
-                if att.get('file_type') == 'audio':
-                    url = att.get('data_url', '')
-                    print(f"   URL encontrada: {url[:100]}...")
-                    
-                    # Testar acesso
-                    with httpx.Client(timeout=10) as client:
-                        resp = client.head(url)
-                        print(f"   Status HEAD: {resp.status_code}")
-                        
-                        if resp.status_code == 403:
-                            print("   ⚠️  ERRO 403 = URL protegida/expirada")
-                            print("   💡 Possíveis soluções:")
-                            print("      1. URLs são signed URLs que expiram")
-                            print("      2. Precisa autenticação do Chatwoot")
-                            print("      3. Precisa gerar nova URL via API")
+            print(f"   URL encontrada: {url[:100]}...")
+            
+            # Testar acesso
+            with httpx.Client(timeout=10) as client:
+                resp = client.head(url)
+                print(f"   Status HEAD: {resp.status_code}")
+                
+                if resp.status_code == 403:
+                    print("   ⚠️  ERRO 403 = URL protegida/expirada")
+                    print("   💡 Possíveis soluções:")
+                    print("      1. URLs são signed URLs que expiram")
+                    print("      2. Precisa autenticação do Chatwoot")
+                    print("      3. Precisa gerar nova URL via API")
         except Exception as e:
-            print(f"   Erro ao parsear: {e}")
+            print(f"   Erro ao testar URL: {e}")
     
     # ============================================================
     # 4. VERIFICAR SE TEM ÁUDIOS COM TRANSCRIÇÃO NO NEON
@@ -212,8 +208,6 @@ def diagnose():
     3. Se precisa auth → conseguir credenciais de acesso
     """)
     
-    neon.close()
-    
     return {
         "last_external_id": last_external_id,
         "max_neon_id": max_neon_id,
@@ -223,5 +217,5 @@ def diagnose():
 
 @app.local_entrypoint()
 def main():
-    result = diagnose.remote()
+    result = Diagnoser().diagnose.remote()
     print(f"\n\nResultado: {result}")
\ No newline at end of file
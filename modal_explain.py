@@ -0,0 +1,272 @@
+"""
+Profiler de queries - EXPLAIN (ANALYZE, BUFFERS) das queries do sync
+
+Roda cada formato de query que o sync usa no Neon e no Supabase com
+parâmetros representativos (tenant real, cursor das últimas 24h, ids
+recentes) e aponta seq scans e índices que faltam. Os planos ficam no Volume
+com timestamp (/cache/explain/plans_<data>.json) e cada execução é comparada
+com a anterior: depois de uma mudança de schema, a regressão aparece aqui.
+
+O Supabase só entra com SUPABASE_DB_URL no secret (o PostgREST não expõe
+EXPLAIN).
+
+USO:
+  modal run modal_explain.py
+  modal run modal_explain.py --only neon
+"""
+
+import modal
+import os
+
+app = modal.App("indaia-explain")
+
+# Imagem com dependências (+ sync/utils montado como pacote `utils`)
+image = modal.Image.debian_slim(python_version="3.11").pip_install(
+    "psycopg2-binary",
+    "supabase",
+).add_local_dir(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sync", "utils"),
+    remote_path="/root/utils",
+)
+
+secrets = modal.Secret.from_name("indaia-secrets")
+
+# Mesmo Volume do sync: os relatórios ficam ao lado do cache de IDs
+cache_volume = modal.Volume.from_name("indaia-sync-cache", create_if_missing=True)
+PLANS_DIR = "/cache/explain"
+
+
+def query_shapes() -> list:
+    """Formatos de query do sync, com os parâmetros tirados do contexto."""
+    from utils.explain import QueryShape
+
+    return [
+        # ---------------- Neon ----------------
+        QueryShape(
+            "neon.agents.keyset", "neon",
+            """SELECT id FROM users WHERE active = true AND (updated_at, id) > (%s, %s)
+               ORDER BY updated_at, id LIMIT 1000""",
+            lambda c: [c['since'], 0],
+            "sync_worker.sync_agents",
+        ),
+        QueryShape(
+            "neon.contacts.keyset", "neon",
+            """SELECT id FROM leads WHERE tenant_id = %s AND (updated_at, id) > (%s, %s)
+               ORDER BY updated_at, id LIMIT 1000""",
+            lambda c: [c['neon_tenant_id'], c['since'], 0],
+            "sync_worker.sync_contacts",
+        ),
+        QueryShape(
+            "neon.conversations.keyset", "neon",
+            """SELECT c.id FROM conversations c WHERE c.tenant_id = %s AND (c.updated_at, c.id) > (%s, %s)
+               ORDER BY c.updated_at, c.id LIMIT 500""",
+            lambda c: [c['neon_tenant_id'], c['since'], 0],
+            "sync_worker.sync_conversations",
+        ),
+        QueryShape(
+            "neon.messages.keyset", "neon",
+            """SELECT m.id FROM messages m WHERE m.tenant_id = %s AND (m.created_at, m.id) > (%s, %s)
+               ORDER BY m.created_at, m.id LIMIT 2000""",
+            lambda c: [c['neon_tenant_id'], c['since'], 0],
+            "sync_worker.sync_messages",
+        ),
+        QueryShape(
+            "neon.messages.after_id", "neon",
+            """SELECT id FROM messages WHERE tenant_id = %s AND id > %s ORDER BY id LIMIT 1000""",
+            lambda c: [c['neon_tenant_id'], c['recent_message_id']],
+            "modal_jobs.sync_new_messages",
+        ),
+        QueryShape(
+            "neon.messages.backfill_range", "neon",
+            """SELECT id FROM messages WHERE tenant_id = %s AND id > %s AND id <= %s AND created_at >= %s
+               ORDER BY id LIMIT 5000""",
+            lambda c: [c['neon_tenant_id'], c['recent_message_id'], c['max_message_id'], c['since']],
+            "backfill.py (keyset por faixa)",
+        ),
+        QueryShape(
+            "neon.conversations.by_ids", "neon",
+            """SELECT id FROM conversations WHERE id = ANY(%s) AND tenant_id = %s""",
+            lambda c: [c['recent_conversation_ids'], c['neon_tenant_id']],
+            "fill_missing_parents / ensure_message_parents",
+        ),
+        # ---------------- Supabase ----------------
+        QueryShape(
+            "supabase.messages.tenant_sent_at", "supabase",
+            """SELECT id FROM messages WHERE tenant_id = %s AND sent_at >= %s
+               ORDER BY sent_at DESC LIMIT 1000""",
+            lambda c: [c['tenant_id'], c['since']],
+            "análises / dashboard",
+        ),
+        QueryShape(
+            "supabase.messages.audio_queue", "supabase",
+            """SELECT id, attachment_url FROM messages WHERE tenant_id = %s AND attachment_type = 'audio'
+                 AND metadata->>'transcricao' IS NULL AND attachment_url IS NOT NULL
+               ORDER BY sent_at DESC LIMIT 10""",
+            lambda c: [c['tenant_id']],
+            "modal_jobs.transcribe_pending_audios",
+        ),
+        QueryShape(
+            "supabase.conversations.id_map_refresh", "supabase",
+            """SELECT id, external_id, synced_at, created_at FROM conversations
+               WHERE tenant_id = %s AND (synced_at >= %s OR created_at >= %s)
+               ORDER BY id LIMIT 1000""",
+            lambda c: [c['tenant_id'], c['since'], c['since']],
+            "utils.id_cache.IdMapCache.refresh",
+        ),
+        QueryShape(
+            "supabase.conversations.lookup", "supabase",
+            """SELECT id, external_id FROM conversations WHERE tenant_id = %s AND external_id = ANY(%s)""",
+            # external_id é text no Supabase: o IdResolver manda os ids como string
+            lambda c: [c['tenant_id'], [str(i) for i in c['recent_conversation_ids']]],
+            "IdResolver / utils.supabase.lookup_ids",
+        ),
+        QueryShape(
+            "supabase.sync_state.cursor", "supabase",
+            """SELECT cursor_value, cursor_id FROM sync_state WHERE tenant_id = %s AND entity_type = %s
+               LIMIT 1""",
+            lambda c: [c['tenant_id'], 'messages_by_id'],
+            "modal_jobs.get_message_cursor / sync_worker.get_sync_cursor / get_last_sync",
+        ),
+        QueryShape(
+            "supabase.sync_logs.legacy_cursor", "supabase",
+            """SELECT last_synced_id FROM sync_logs WHERE tenant_id = %s AND entity_type = 'messages'
+               ORDER BY created_at DESC LIMIT 1""",
+            lambda c: [c['tenant_id']],
+            "modal_jobs.get_message_cursor (fallback legado, sem linha em sync_state)",
+        ),
+        QueryShape(
+            "supabase.sync_logs.rollup_scan", "supabase",
+            """SELECT tenant_id, entity_type, date_trunc('hour', created_at) AS bucket, COUNT(*)
+               FROM sync_logs WHERE created_at < NOW() - INTERVAL '48 hours'
+               GROUP BY 1, 2, 3""",
+            lambda c: [],
+            "rollup_sync_logs (sync_worker_setup.sql)",
+        ),
+    ]
+
+
+@app.cls(image=image, secrets=[secrets], timeout=600, volumes={"/cache": cache_volume}, scaledown_window=5 * 60)
+class Explainer:
+    """Conexões criadas uma vez por container (como o Diagnoser)."""
+
+    @modal.enter()
+    def setup(self):
+        from utils.runtime import ContainerRuntime
+        self.runtime = ContainerRuntime(pool_max=1)
+
+    @modal.method()
+    def capture(self, only: str = "") -> dict:
+        self.runtime.start_run()
+        cache_volume.reload()
+        with self.runtime.neon.connection() as neon:
+            result = run_explain(neon, self.runtime, only)
+        cache_volume.commit()
+        return result
+
+    @modal.exit()
+    def teardown(self):
+        self.runtime.close()
+
+
+def build_context(neon, runtime) -> dict:
+    """Parâmetros representativos: tenant real, últimas 24h e ids recentes."""
+    from datetime import datetime, timedelta
+
+    neon_tenant_id = runtime.tenant.neon_tenant_id
+    with neon.cursor() as cur:
+        cur.execute("SELECT MAX(id) AS max_id FROM messages")
+        max_id = cur.fetchone()['max_id'] or 0
+        cur.execute("""
+            SELECT DISTINCT conversation_id FROM (
+                SELECT conversation_id FROM messages WHERE tenant_id = %s ORDER BY id DESC LIMIT 1000
+            ) recent LIMIT 200
+        """, (neon_tenant_id,))
+        conversation_ids = [r['conversation_id'] for r in cur.fetchall()]
+    neon.rollback()
+
+    return {
+        'tenant_id': runtime.tenant_id,
+        'neon_tenant_id': neon_tenant_id,
+        'since': datetime.utcnow() - timedelta(hours=24),
+        'max_message_id': max_id,
+        'recent_message_id': max(0, max_id - 5000),
+        'recent_conversation_ids': conversation_ids,
+    }
+
+
+def run_explain(neon, runtime, only: str = "") -> dict:
+    """EXPLAIN de todos os formatos, alertas, comparação com o relatório anterior."""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from utils.explain import explain, compare, latest_report, save_report
+
+    print("=" * 60)
+    print("🧪 EXPLAIN DAS QUERIES DO SYNC")
+    print("=" * 60)
+
+    context = build_context(neon, runtime)
+    shapes = [s for s in query_shapes() if not only or s.database == only]
+
+    supabase_conn = None
+    if any(s.database == 'supabase' for s in shapes):
+        if os.environ.get('SUPABASE_DB_URL'):
+            supabase_conn = psycopg2.connect(os.environ['SUPABASE_DB_URL'], cursor_factory=RealDictCursor)
+        else:
+            print("   ⚠️  SUPABASE_DB_URL não configurada: queries do Supabase puladas")
+            shapes = [s for s in shapes if s.database != 'supabase']
+
+    entries = []
+    try:
+        for shape in shapes:
+            conn = neon if shape.database == 'neon' else supabase_conn
+            entry = explain(conn, shape, context)
+            entries.append(entry)
+            print_entry(entry)
+    finally:
+        if supabase_conn is not None:
+            supabase_conn.close()
+
+    previous = latest_report(PLANS_DIR)
+    regressions = compare(entries, previous['queries']) if previous else []
+    path = save_report(PLANS_DIR, entries, regressions)
+
+    print("\n" + "=" * 60)
+    if previous:
+        print(f"📈 COMPARAÇÃO COM {previous['generated_at']}")
+        print("=" * 60)
+        for r in regressions:
+            print(f"   ❌ {r['name']}: {r['type']} ({r['detail']})")
+        if not regressions:
+            print("   ✅ Nenhuma regressão")
+    else:
+        print("📈 Primeiro relatório: nada para comparar")
+
+    flagged = sum(1 for e in entries if e.get('flags'))
+    print(f"\n   💾 Planos salvos em {path}")
+    print(f"   📊 {len(entries)} queries, {flagged} com alerta, {len(regressions)} regressões")
+    return {"queries": len(entries), "flagged": flagged, "regressions": regressions, "path": path}
+
+
+def print_entry(entry: dict):
+    if 'error' in entry:
+        print(f"\n   ⚠️  {entry['name']}: {entry['error'][:150]}")
+        return
+    icon = "❌" if entry['flags'] else "✅"
+    indexes = ', '.join(entry['indexes']) or 'nenhum índice'
+    print(f"\n   {icon} {entry['name']} ({entry['source']})")
+    print(f"      {entry['execution_ms']:.1f} ms · {entry['rows']} linhas · "
+          f"buffers {entry['shared_hit_blocks']} hit / {entry['shared_read_blocks']} read · {indexes}")
+    for flag in entry['flags']:
+        if flag['type'] == 'sort_on_disk':
+            print(f"      💽 Sort em disco ({flag['space_kb']} kB): {flag['sort_key']}")
+            continue
+        print(f"      🐢 Seq scan em {flag['relation']} ({flag['rows_scanned']:,} linhas lidas)")
+        if flag.get('suggestion'):
+            print(f"      💡 {flag['suggestion']}")
+
+
+@app.local_entrypoint()
+def main(only: str = ""):
+    result = Explainer().capture.remote(only)
+    print(f"\nResultado: {result['queries']} queries, {result['flagged']} com alerta, "
+          f"{len(result['regressions'])} regressões")
@@ -16,107 +16,152 @@ from datetime import datetime, timedelta
 # ============================================================
 app = modal.App("indaia-analytics")
 
-# Imagem com dependências
+# Imagem com dependências (+ sync/utils montado como pacote `utils`)
 image = modal.Image.debian_slim(python_version="3.11").pip_install(
     "psycopg2-binary",
     "supabase",
-    "httpx",
+    "httpx[http2]",
     "groq",
+    "python-dotenv",  # utils.neon / utils.supabase
+).add_local_dir(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sync", "utils"),
+    remote_path="/root/utils",
 )
 
 # Secrets (configurar no Modal Dashboard)
 secrets = modal.Secret.from_name("indaia-secrets")
 
+# Cache persistente dos mapas external_id → UUID (mesmo Volume do sync_worker,
+# um arquivo por tenant)
+id_cache_volume = modal.Volume.from_name("indaia-sync-cache", create_if_missing=True)
+CACHE_DIR = "/cache"
+
 
 # ============================================================
 # SYNC INCREMENTAL
 # ============================================================
-@app.function(
+# Container residente: pool do Neon, client do Supabase, tenant e writer são
+# montados uma vez e reaproveitados enquanto o container estiver quente
+WARM_WINDOW = 10 * 60
+
+
+@app.cls(
     image=image,
     secrets=[secrets],
     timeout=300,
+    volumes={"/cache": id_cache_volume},
+    scaledown_window=WARM_WINDOW,
+    max_containers=1,
 )
-def sync_new_messages():
-    """Sincroniza apenas mensagens novas."""
-    import psycopg2
-    from psycopg2.extras import RealDictCursor
-    from supabase import create_client
+class MessageSync:
+    """Sync incremental de mensagens com conexões residentes no container."""
     
-    print("🔄 Iniciando sync incremental...")
+    @modal.enter()
+    def setup(self):
+        from utils.runtime import ContainerRuntime
+        from utils.rate import AimdController
+        from utils.writer import PostgrestWriter
+        
+        self.runtime = ContainerRuntime(pool_max=2)
+        self.writer = PostgrestWriter(
+            os.environ['SUPABASE_URL'], os.environ['SUPABASE_SERVICE_KEY'],
+            AimdController('messages', batch_size=100, concurrency=4, pause=0.0)
+        )
     
-    # Conectar
-    neon = psycopg2.connect(
-        host=os.environ['NEON_HOST'],
-        database=os.environ['NEON_DATABASE'],
-        user=os.environ['NEON_USER'],
-        password=os.environ['NEON_PASSWORD'],
-        sslmode='require',
-        cursor_factory=RealDictCursor
-    )
+    @modal.method()
+    def run(self) -> dict:
+        return sync_messages_run(self.runtime, self.writer)
     
-    supabase = create_client(
-        os.environ['SUPABASE_URL'],
-        os.environ['SUPABASE_SERVICE_KEY']
-    )
-    
-    # Buscar tenant
-    tenant = supabase.table('tenants').select('id').eq('slug', 'indaia').single().execute()
-    tenant_id = tenant.data['id']
+    @modal.exit()
+    def teardown(self):
+        self.writer.close()
+        self.runtime.close()
+
+
+@app.function(image=image, timeout=360)
+def sync_new_messages():
+    """Sincroniza apenas mensagens novas (no container residente do MessageSync)."""
+    return MessageSync().run.remote()
+
+
+# Linha do cursor em sync_state (separada da entidade 'messages' do sync_worker,
+# que usa created_at como cursor)
+CURSOR_ENTITY = 'messages_by_id'
+
+
+def get_message_cursor(supabase, tenant_id: str) -> int:
+    """
+    Último id sincronizado, da linha do tenant em sync_state. Sem ela, cai no
+    sync_logs legado (o próximo run já grava em sync_state).
+    """
+    state = supabase.table('sync_state')\
+        .select('cursor_id')\
+        .eq('tenant_id', tenant_id)\
+        .eq('entity_type', CURSOR_ENTITY)\
+        .limit(1)\
+        .execute()
+    if state.data and state.data[0].get('cursor_id') is not None:
+        return state.data[0]['cursor_id']
     
-    # Buscar última mensagem sincronizada
-    last_sync = supabase.table('sync_logs')\
+    legacy = supabase.table('sync_logs')\
         .select('last_synced_id')\
         .eq('tenant_id', tenant_id)\
         .eq('entity_type', 'messages')\
         .order('created_at', desc=True)\
         .limit(1)\
         .execute()
+    return legacy.data[0]['last_synced_id'] if legacy.data else 0
+
+
+def sync_messages_run(runtime, writer) -> dict:
+    """Um run do sync incremental: pega uma conexão do pool e grava pelo writer residente."""
+    from utils.attachments import parse_message_content
+    from utils.id_cache import IdMapCache
+    from utils.keys import message_key
+    from utils.supabase import fill_missing_parents
+    from utils.tenants import tenant_cache_path
+    
+    print("🔄 Iniciando sync incremental...")
+    runtime.start_run()
+    id_cache_volume.reload()
     
-    last_id = last_sync.data[0]['last_synced_id'] if last_sync.data else 0
+    supabase = runtime.supabase
+    tenant_id = runtime.tenant_id
+    
+    # Cursor: último id do Neon já sincronizado (sync_state, leitura pela PK)
+    last_id = get_message_cursor(supabase, tenant_id)
     
     # Buscar mensagens novas do Neon
-    with neon.cursor() as cur:
+    with runtime.neon.connection() as neon, neon.cursor() as cur:
         cur.execute("""
             SELECT 
                 id, external_id, conversation_id, lead_id, user_id,
                 inbox_id, content, content_type, from_me, status,
                 sent_at, transcricao, platform, created_at
             FROM messages
-            WHERE id > %s
+            WHERE tenant_id = %s AND id > %s
             ORDER BY id
             LIMIT 1000
-        """, (last_id,))
+        """, (runtime.tenant.neon_tenant_id, last_id))
         messages = cur.fetchall()
     
     if not messages:
         print("   ✅ Nenhuma mensagem nova")
-        neon.close()
         return {"synced": 0}
     
     print(f"   📥 {len(messages)} mensagens novas encontradas")
     
-    # Buscar mapas de IDs (com paginação para pegar todos)
-    def fetch_all(table, columns):
-        all_data = []
-        offset = 0
-        while True:
-            result = supabase.table(table).select(columns).eq('tenant_id', tenant_id).range(offset, offset + 999).execute()
-            if not result.data:
-                break
-            all_data.extend(result.data)
-            if len(result.data) < 1000:
-                break
-            offset += 1000
-        return all_data
-    
-    contacts = fetch_all('contacts', 'id,external_id')
-    contact_map = {c['external_id']: c['id'] for c in contacts}
-    
-    agents = fetch_all('agents', 'id,external_id')
-    agent_map = {a['external_id']: a['id'] for a in agents}
+    # Mapas de IDs do cache persistente (só o delta desde o último run vem do Supabase)
+    id_cache = IdMapCache(tenant_cache_path(CACHE_DIR, runtime.tenant))
+    contact_map = id_cache.get_map(supabase, tenant_id, 'contacts')
+    agent_map = id_cache.get_map(supabase, tenant_id, 'agents')
+    conv_map = id_cache.get_map(supabase, tenant_id, 'conversations')
+    id_cache_volume.commit()
     
-    convs = fetch_all('conversations', 'id,external_id')
-    conv_map = {c['external_id']: c['id'] for c in convs}
+    # Conversas ainda não sincronizadas: grava os pais antes (em vez de pular as mensagens)
+    with runtime.neon.connection() as neon:
+        fill_missing_parents(supabase, neon, tenant_id, messages, conv_map, contact_map, agent_map,
+                             runtime.tenant.neon_tenant_id)
     
     # Preparar mensagens
     data = []
@@ -138,7 +183,7 @@ def sync_new_messages():
         
         msg = {
             'tenant_id': tenant_id,
-            'external_id': m['id'],
+            'external_id': message_key(m),
             'conversation_id': conv_map[m['conversation_id']],
             'content': m.get('content'),
             'content_type': m.get('content_type'),
@@ -150,7 +195,8 @@ def sync_new_messages():
                 'transcricao': m.get('transcricao'),
                 'platform': m.get('platform'),
                 'inbox_id': m.get('inbox_id')
-            }
+            },
+            **parse_message_content(m.get('content')),
         }
         
         if m.get('lead_id') and m['lead_id'] in contact_map:
@@ -162,17 +208,29 @@ def sync_new_messages():
         data.append(msg)
         max_id = max(max_id, m['id'])
     
-    # Inserir no Supabase
+    # Inserir no Supabase (batches adaptativos em paralelo, retry em 429/5xx/timeout)
     if data:
-        # Inserir em batches de 100
-        for i in range(0, len(data), 100):
-            batch = data[i:i+100]
-            supabase.table('messages').upsert(
-                batch,
-                on_conflict='tenant_id,external_id'
-            ).execute()
+        from utils import dead_letter
+        
+        def write(batch):
+            _, batch_failures = writer.upsert('messages', batch)
+            if batch_failures:
+                raise batch_failures[0][2]
+        
+        # Lote recusado por erro de dados: isola as linhas ruins em sync_dead_letters
+        _, failures = writer.upsert('messages', data)
+        for start, size, error in failures:
+            dead_letter.settle(supabase, write, 'messages', data[start:start + size], error)
+    
+    # Avançar o cursor (só depois da escrita) e registrar o histórico
+    supabase.table('sync_state').upsert({
+        'tenant_id': tenant_id,
+        'entity_type': CURSOR_ENTITY,
+        'cursor_id': max_id,
+        'records_synced': len(data),
+        'updated_at': datetime.utcnow().isoformat()
+    }, on_conflict='tenant_id,entity_type').execute()
     
-    # Salvar log de sync
     supabase.table('sync_logs').insert({
         'tenant_id': tenant_id,
         'entity_type': 'messages',
@@ -183,7 +241,6 @@ def sync_new_messages():
     }).execute()
     
     print(f"   ✅ {len(data)} mensagens sincronizadas")
-    neon.close()
     
     return {"synced": len(data), "last_id": max_id}
 
@@ -199,7 +256,6 @@ def sync_new_messages():
 def transcribe_pending_audios():
     """Transcreve áudios pendentes usando Groq Whisper."""
     import httpx
-    import json
     import tempfile
     from groq import Groq
     from supabase import create_client
@@ -217,19 +273,18 @@ def transcribe_pending_audios():
     tenant = supabase.table('tenants').select('id').eq('slug', 'indaia').single().execute()
     tenant_id = tenant.data['id']
     
-    # Buscar mensagens de áudio sem transcrição
+    # Buscar mensagens de áudio sem transcrição (attachment_type é indexado).
+    # O filtro vai na query, antes do limit: os já transcritos não ocupam a fila
     pending = supabase.table('messages')\
-        .select('id,external_id,content,metadata')\
+        .select('id,external_id,attachment_url,metadata')\
         .eq('tenant_id', tenant_id)\
-        .like('content', '%"file_type":"audio"%')\
+        .eq('attachment_type', 'audio')\
+        .is_('metadata->>transcricao', 'null')\
+        .not_.is_('attachment_url', 'null')\
+        .order('sent_at', desc=True)\
         .limit(10)\
         .execute()
-    
-    # Filtrar apenas os que não têm transcrição
-    pending_data = [
-        m for m in pending.data 
-        if not (m.get('metadata') or {}).get('transcricao')
-    ]
+    pending_data = pending.data
     
     if not pending_data:
         print("   ✅ Nenhum áudio pendente")
@@ -241,20 +296,8 @@ def transcribe_pending_audios():
     
     for msg in pending_data:
         try:
-            # Extrair URL do áudio
-            audio_url = None
-            content = msg.get('content', '')
-            
-            if content and '{' in content:
-                try:
-                    data = json.loads(content)
-                    attachments = data.get('attachments', [])
-                    for att in attachments:
-                        if att.get('file_type') == 'audio':
-                            audio_url = att.get('data_url')
-                            break
-                except:
-                    pass
+            # URL do áudio já normalizada pelo sync
+            audio_url = msg.get('attachment_url')
             
             if not audio_url:
                 print(f"   ⚠️  Msg {msg['id'][:8]}: URL não encontrada")
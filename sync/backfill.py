@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+Backfill - Neon → Supabase
+
+Motor único de carga histórica: sync inicial e retomadas.
+
+Cada entidade é lida por keyset (WHERE id > último id ORDER BY id LIMIT n):
+a latência por página não cresce com o volume já lido, e o checkpoint
+guarda o último id gravado, então linhas inseridas no Neon durante o run
+não deslocam a retomada. O espaço de ids pode ser dividido em faixas e
+processado em paralelo (processos locais ou containers no Modal), com um
+checkpoint por faixa.
+
+Ordem em fases: atendentes e contatos juntos → conversas → mensagens. Antes
+de conversas e mensagens, o coordenador atualiza os mapas de IDs no cache
+SQLite; os workers só leem o arquivo. Dentro de cada faixa, leitura do Neon,
+transformação e escrita no Supabase rodam em threads ligadas por filas
+limitadas (utils/pipeline.py): a próxima página já está pronta quando a
+escrita da atual termina.
+
+USO:
+  python backfill.py                                # Tudo desde 01/11/2025
+  python backfill.py --entities messages            # Só mensagens
+  python backfill.py --since 2025-12-01 --until 2026-01-01
+  python backfill.py --entities messages --workers 8 --ranges 64
+  python backfill.py --in-flight 1                  # Batches simultâneos por worker
+  python backfill.py --entities messages --copy     # Extração via COPY ... TO STDOUT
+  python backfill.py --reset                        # Apaga os checkpoints e recomeça
+  python backfill.py --tenant outro                 # Outro tenant do registro (checkpoints em .backfill/outro)
+  modal run backfill.py --entities messages         # Fan-out em containers do Modal (.map)
+
+O período (--since/--until) filtra conversas e mensagens por created_at;
+atendentes e contatos são sempre carregados inteiros (conversas antigas
+continuam apontando para eles).
+"""
+
+import os
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+try:
+    import modal
+except ImportError:
+    modal = None  # Só necessário para `modal run backfill.py`
+
+from utils.id_cache import IdMapCache, DEFAULT_CACHE_PATH
+from utils.pipeline import pipelined, PIPELINE_DEPTH
+from utils.neon import (
+    get_neon_connection,
+    fetch_id_bounds,
+    fetch_page_after,
+    copy_messages
+)
+from utils.supabase import (
+    get_supabase_client,
+    get_pg_loader,
+    fill_missing_parents,
+    prepare_agents,
+    prepare_contacts,
+    prepare_conversations,
+    prepare_messages,
+    upsert_with_retry,
+    write_rate
+)
+from utils.tenants import DEFAULT_TENANT_SLUG, get_tenant
+
+# ============================================================
+# CONFIGURAÇÕES
+# ============================================================
+ENTITIES = ('agents', 'contacts', 'conversations', 'messages')
+
+# Fases de carga: entidades da mesma fase não dependem umas das outras e
+# carregam ao mesmo tempo; cada fase espera a anterior terminar
+PHASES = (('agents', 'contacts'), ('conversations',), ('messages',))
+
+# Mapas de IDs que cada entidade precisa (atualizados antes de carregá-la)
+REQUIRED_MAPS = {
+    'agents': (),
+    'contacts': (),
+    'conversations': ('contacts', 'agents'),
+    'messages': ('contacts', 'agents', 'conversations'),
+}
+
+PAGE_SIZES = {'agents': 1000, 'contacts': 2000, 'conversations': 2000, 'messages': 5000}
+
+DEFAULT_SINCE = datetime(2025, 11, 1)
+DEFAULT_WORKERS = 1
+RANGES_PER_WORKER = 4       # Faixas menores equilibram workers com faixas mais densas
+WORKER_MAX_IN_FLIGHT = 2    # Teto de batches simultâneos por worker (o controle adaptativo fica abaixo dele)
+PROGRESS_EVERY = 10         # Páginas entre linhas de progresso de cada worker
+STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.backfill')
+
+MODAL_WORKERS = int(os.getenv('BACKFILL_MODAL_WORKERS', '16'))
+MODAL_CACHE_PATH = "/cache/id_maps.sqlite"
+MODAL_STATE_DIR = "/cache/backfill"
+
+
+# ============================================================
+# FAIXAS E CHECKPOINTS
+# ============================================================
+def split_ranges(min_id: int, max_id: int, count: int) -> list:
+    """
+    Divide [min_id, max_id] em até count faixas contíguas (inclusivas).
+    A última fica aberta (fim None) para pegar ids criados depois do plano.
+    """
+    span = max_id - min_id + 1
+    count = max(1, min(count, span))
+    step = -(-span // count)  # divisão com teto
+    ranges = [
+        [start, min(start + step - 1, max_id)]
+        for start in range(min_id, max_id + 1, step)
+    ]
+    ranges[-1][1] = None
+    return ranges
+
+
+def plan_path(state_dir: str, entity: str) -> str:
+    return os.path.join(state_dir, f"{entity}.plan.json")
+
+
+def checkpoint_path(state_dir: str, entity: str, start: int, end) -> str:
+    return os.path.join(state_dir, f"{entity}_{start}_{end if end is not None else 'max'}.json")
+
+
+def load_checkpoint(path: str, start: int) -> dict:
+    """Carrega o checkpoint da faixa (ou o estado inicial)."""
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'last_id': start - 1, 'synced': 0, 'skipped': 0, 'done': False}
+
+
+def save_json(path: str, data: dict):
+    """Grava JSON de forma atômica (arquivo temporário + rename)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def tenant_state_dir(state_dir: str, tenant) -> str:
+    """Checkpoints do tenant: o padrão mantém o diretório que já existia."""
+    if tenant.slug == DEFAULT_TENANT_SLUG:
+        return state_dir
+    return os.path.join(state_dir, tenant.slug)
+
+
+def clear_state(state_dir: str, entity: str):
+    """Apaga plano e checkpoints de uma entidade."""
+    for path in glob.glob(os.path.join(state_dir, f"{entity}_*.json")) + [plan_path(state_dir, entity)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# ============================================================
+# WORKER
+# ============================================================
+def transform(entity: str, tenant_id: str, rows: list, maps: dict, supabase=None, parents_neon=None,
+              neon_tenant_id: int = None):
+    """
+    Linhas do Neon → linhas do Supabase. Retorna (linhas, ignoradas).
+    Mensagens de conversas fora dos mapas têm os pais gravados antes (parents_neon).
+    """
+    if entity == 'agents':
+        return prepare_agents(tenant_id, rows), 0
+    if entity == 'contacts':
+        return prepare_contacts(tenant_id, rows), 0
+    if entity == 'conversations':
+        return prepare_conversations(tenant_id, rows, maps['contacts'], maps['agents']), 0
+    if parents_neon is not None:
+        fill_missing_parents(supabase, parents_neon, tenant_id, rows,
+                             maps['conversations'], maps['contacts'], maps['agents'], neon_tenant_id)
+    return prepare_messages(tenant_id, rows, maps['conversations'], maps['contacts'], maps['agents'])
+
+
+def iter_pages(neon, job: dict, after_id: int):
+    """
+    Páginas da faixa depois de after_id (o checkpoint). O cursor de leitura é
+    próprio: a leitura segue adiantada enquanto as páginas anteriores são gravadas.
+    """
+    if job['copy']:
+        yield from copy_messages(
+            neon, start_date=job['since'], until=job['until'],
+            after_id=after_id, end_id=job['end'], chunk_size=job['page_size'],
+            tenant_id=job['neon_tenant_id']
+        )
+        return
+
+    while True:
+        rows = fetch_page_after(
+            neon, job['entity'], after_id, end_id=job['end'],
+            since=job['since'], until=job['until'], limit=job['page_size'],
+            tenant_id=job['neon_tenant_id']
+        )
+        if not rows:
+            return
+        yield rows
+        if len(rows) < job['page_size']:
+            return
+        after_id = rows[-1]['id']
+
+
+def backfill_range(job: dict) -> dict:
+    """
+    Sincroniza uma faixa de ids com conexões próprias. Roda no processo
+    principal, num processo separado ou num container (job é serializável).
+    """
+    entity, start, end = job['entity'], job['start'], job['end']
+    label = f"{entity} {start:,}-{end:,}" if end is not None else f"{entity} {start:,}+"
+    path = checkpoint_path(job['state_dir'], entity, start, end)
+    state = load_checkpoint(path, start)
+    if state['done']:
+        return {'entity': entity, 'start': start, 'end': end, **state}
+
+    # Mapas só de leitura: o coordenador já atualizou o cache
+    cache = IdMapCache(job['cache_path'])
+    maps = {table: cache.snapshot(job['tenant_id'], table) for table in REQUIRED_MAPS[entity]}
+
+    neon = get_neon_connection()
+    supabase = get_supabase_client()
+    # Conexão à parte para buscar pais ausentes (a principal pode estar no meio de um COPY)
+    parents_neon = get_neon_connection() if entity == 'messages' else None
+
+    # A conexão COPY é única por processo: com ela, um batch por vez.
+    # No REST, o writer mantém até max_in_flight batches em voo.
+    write_rate.set_max_concurrency(1 if get_pg_loader() else job['max_in_flight'])
+    pages = 0
+    page_started = time.monotonic()
+
+    def transform_page(rows):
+        return (rows, *transform(entity, job['tenant_id'], rows, maps, supabase, parents_neon,
+                                 job['neon_tenant_id']))
+
+    try:
+        # Extract (Neon) e transform rodam adiantados em threads; o load fica aqui,
+        # na ordem das páginas, para o checkpoint avançar só depois da escrita
+        for rows, data, skipped in pipelined(iter_pages(neon, job, state['last_id']), transform_page,
+                                             depth=PIPELINE_DEPTH):
+            upsert_with_retry(supabase, entity, data, 'tenant_id,external_id')  # Falha: o checkpoint não avança
+
+            state['last_id'] = rows[-1]['id']
+            state['synced'] += len(data)
+            state['skipped'] += skipped
+            save_json(path, state)
+
+            pages += 1
+            if pages % PROGRESS_EVERY == 0:
+                elapsed = time.monotonic() - page_started
+                print(f"   📦 {label}: id {state['last_id']:,} · {state['synced']:,} linhas "
+                      f"· {elapsed / PROGRESS_EVERY:.2f}s/página")
+                print(f"   🎚️  {write_rate.describe()}")
+                page_started = time.monotonic()
+    finally:
+        neon.close()
+        if parents_neon is not None:
+            parents_neon.close()
+
+    state['done'] = True
+    save_json(path, state)
+    return {'entity': entity, 'start': start, 'end': end, **state}
+
+
+# ============================================================
+# COORDENADOR
+# ============================================================
+def plan_jobs(entity: str, ranges: int, state_dir: str, cache_path: str, max_in_flight: int,
+              since: datetime = DEFAULT_SINCE, until: datetime = None,
+              reset: bool = False, copy: bool = False, tenant_slug: str = DEFAULT_TENANT_SLUG) -> list:
+    """
+    Atualiza os mapas de IDs de que a entidade depende e monta as faixas.
+    O plano fica salvo junto dos checkpoints: rodar de novo retoma as mesmas faixas.
+    Só as linhas do tenant no Neon entram (tenants.neon_tenant_id).
+    """
+    supabase = get_supabase_client()
+    tenant = get_tenant(supabase, tenant_slug)
+    tenant_id = tenant.id
+    state_dir = tenant_state_dir(state_dir, tenant)
+
+    os.makedirs(state_dir, exist_ok=True)
+    if reset:
+        clear_state(state_dir, entity)
+        print(f"   🗑️  Checkpoints de {entity} apagados")
+
+    cache = IdMapCache(cache_path)
+    for table in REQUIRED_MAPS[entity]:
+        cache.refresh(supabase, tenant_id, table)
+        print(f"   🗺️  {len(cache.load(tenant_id, table)):,} {table} mapeados")
+
+    period = {
+        'since': since.isoformat() if since else None,
+        'until': until.isoformat() if until else None,
+    }
+    path = plan_path(state_dir, entity)
+    if os.path.exists(path):
+        with open(path) as f:
+            plan = json.load(f)
+        if {k: plan.get(k) for k in period} != period:
+            raise SystemExit(f"❌ Checkpoint de {entity} é de outro período {plan['since']} → {plan['until']}. "
+                             f"Use --reset para recomeçar.")
+        print(f"   📍 Retomando {len(plan['ranges'])} faixas de {entity}")
+    else:
+        neon = get_neon_connection()
+        min_id, max_id = fetch_id_bounds(neon, entity, since=since, until=until, tenant_id=tenant.neon_tenant_id)
+        neon.close()
+        if min_id is None:
+            return []
+        plan = {**period, 'ranges': split_ranges(min_id, max_id, ranges)}
+        save_json(path, plan)
+        print(f"   📐 ids {min_id:,} → {max_id:,} em {len(plan['ranges'])} faixas")
+
+    return [{
+        'entity': entity,
+        'tenant_id': tenant_id,
+        'neon_tenant_id': tenant.neon_tenant_id,
+        'start': start,
+        'end': end,
+        'since': since,
+        'until': until,
+        'state_dir': state_dir,
+        'cache_path': cache_path,
+        'page_size': PAGE_SIZES[entity],
+        'max_in_flight': max_in_flight,
+        'copy': copy and entity == 'messages',
+    } for start, end in plan['ranges']]
+
+
+def run_jobs_local(jobs: list, workers: int):
+    """
+    Executa as faixas (de uma ou mais entidades da mesma fase) no próprio
+    processo (1 worker) ou num pool de processos.
+    """
+    results, failures = [], []
+
+    if workers <= 1:
+        # Um processo: faixas de cada entidade em sequência, entidades da fase em paralelo
+        by_entity = {}
+        for job in jobs:
+            by_entity.setdefault(job['entity'], []).append(job)
+
+        def run_entity(entity_jobs: list):
+            for job in entity_jobs:
+                try:
+                    results.append(backfill_range(job))
+                except Exception as e:
+                    failures.append((job, e))
+                    print(f"   ❌ {job['entity']} faixa {job['start']:,}: {str(e)[:100]}")
+
+        with ThreadPoolExecutor(max_workers=len(by_entity)) as pool:
+            for future in [pool.submit(run_entity, entity_jobs) for entity_jobs in by_entity.values()]:
+                future.result()
+        return results, failures
+
+    # spawn: cada worker abre as próprias conexões do zero
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(backfill_range, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+                results.append(result)
+                print(f"   ✅ {job['entity']} faixa {job['start']:,}: {result['synced']:,} linhas "
+                      f"({len(results)}/{len(jobs)})")
+            except Exception as e:
+                failures.append((job, e))
+                print(f"   ❌ {job['entity']} faixa {job['start']:,}: {str(e)[:100]}")
+    return results, failures
+
+
+def print_entity_summary(entity: str, results: list, failures: list):
+    results = [r for r in results if r['entity'] == entity]
+    failures = [(job, e) for job, e in failures if job['entity'] == entity]
+    synced = sum(r['synced'] for r in results)
+    skipped = sum(r['skipped'] for r in results)
+
+    if failures:
+        print(f"   ⚠️  {entity}: {synced:,} linhas, {len(failures)} faixas com erro "
+              f"(rode de novo para retomar)")
+    else:
+        print(f"   ✅ {entity}: {synced:,} linhas")
+    if skipped:
+        print(f"   ⚠️  {skipped:,} ignoradas (conversa não encontrada)")
+
+
+def parse_entities(value: str) -> list:
+    if value == 'all':
+        return list(ENTITIES)
+    entities = [e.strip() for e in value.split(',') if e.strip()]
+    unknown = set(entities) - set(ENTITIES)
+    if unknown:
+        raise SystemExit(f"❌ Entidades desconhecidas: {', '.join(sorted(unknown))}")
+    # Sempre na ordem de dependência, independente da ordem na linha de comando
+    return [e for e in ENTITIES if e in entities]
+
+
+def plan_phases(entities: list) -> list:
+    """Agrupa as entidades pedidas nas fases de carga (fases vazias saem)."""
+    phases = [[e for e in phase if e in entities] for phase in PHASES]
+    return [phase for phase in phases if phase]
+
+
+def parse_date(value: str):
+    return datetime.fromisoformat(value) if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill Neon → Supabase por keyset, retomável")
+    parser.add_argument('--entities', default='all', help=f"Lista separada por vírgula ({','.join(ENTITIES)}) ou all")
+    parser.add_argument('--since', default=DEFAULT_SINCE.date().isoformat(), help="Início do período (created_at)")
+    parser.add_argument('--until', default='', help="Fim do período, exclusivo (padrão: sem limite)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Processos simultâneos")
+    parser.add_argument('--ranges', type=int, default=None, help="Número de faixas (padrão: workers × 4)")
+    parser.add_argument('--in-flight', type=int, default=WORKER_MAX_IN_FLIGHT, help="Batches simultâneos por worker")
+    parser.add_argument('--copy', action='store_true', help="Mensagens via COPY ... TO STDOUT")
+    parser.add_argument('--reset', action='store_true', help="Apaga os checkpoints e recomeça")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT_SLUG, help="Slug do tenant (registro tenants.neon_tenant_id)")
+    args = parser.parse_args()
+
+    entities = parse_entities(args.entities)
+    since, until = parse_date(args.since), parse_date(args.until)
+    ranges = args.ranges or (args.workers * RANGES_PER_WORKER if args.workers > 1 else 1)
+
+    print("=" * 60)
+    print("🔄 BACKFILL - Neon → Supabase")
+    print("=" * 60)
+    print(f"\n📅 Período: {since.strftime('%d/%m/%Y') if since else 'início'} → "
+          f"{until.strftime('%d/%m/%Y') if until else 'hoje'}")
+    print(f"   ⚙️  {args.workers} workers × até {args.in_flight} batches em voo (batch e pausa adaptativos)")
+
+    incomplete = False
+    for phase in plan_phases(entities):
+        jobs = []
+        for entity in phase:
+            print(f"\n📦 {entity}")
+            entity_jobs = plan_jobs(entity, ranges, STATE_DIR, DEFAULT_CACHE_PATH, args.in_flight,
+                                    since=since, until=until, reset=args.reset, copy=args.copy,
+                                    tenant_slug=args.tenant)
+            if not entity_jobs:
+                print("   ✅ Nada no período")
+            jobs += entity_jobs
+        if not jobs:
+            continue
+
+        if len(phase) > 1:
+            print(f"\n⚡ {' + '.join(phase)} em paralelo")
+        results, failures = run_jobs_local(jobs, args.workers)
+        for entity in phase:
+            print_entity_summary(entity, results, failures)
+        if failures:
+            # Fases seguintes dependem desta: para aqui e retoma no próximo run
+            incomplete = True
+            break
+
+    print("\n" + "=" * 60)
+    print("⚠️  BACKFILL INCOMPLETO" if incomplete else "✅ BACKFILL COMPLETO!")
+    print("=" * 60)
+
+
+# ============================================================
+# MODAL: mesmas faixas, uma por container
+# ============================================================
+if modal is not None:
+    app = modal.App("indaia-backfill")
+
+    image = modal.Image.debian_slim(python_version="3.11")\
+        .pip_install("psycopg2-binary", "supabase", "python-dotenv", "tqdm")\
+        .add_local_dir(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"),
+            remote_path="/root/utils"
+        )
+
+    secrets = [modal.Secret.from_name("indaia-secrets")]
+    cache_volume = modal.Volume.from_name("indaia-sync-cache", create_if_missing=True)
+
+    @app.function(image=image, secrets=secrets, volumes={"/cache": cache_volume}, timeout=900)
+    def plan_remote(entity: str, ranges: int, since: str, until: str, reset: bool, copy: bool,
+                    tenant: str = DEFAULT_TENANT_SLUG) -> list:
+        cache_volume.reload()
+        jobs = plan_jobs(entity, ranges, MODAL_STATE_DIR, MODAL_CACHE_PATH, WORKER_MAX_IN_FLIGHT,
+                         since=parse_date(since), until=parse_date(until), reset=reset, copy=copy,
+                         tenant_slug=tenant)
+        cache_volume.commit()
+        return jobs
+
+    @app.function(
+        image=image,
+        secrets=secrets,
+        volumes={"/cache": cache_volume},
+        timeout=3600,
+        max_containers=MODAL_WORKERS
+    )
+    def backfill_range_remote(job: dict) -> dict:
+        cache_volume.reload()
+        try:
+            return backfill_range(job)
+        finally:
+            cache_volume.commit()
+
+    @app.local_entrypoint()
+    def modal_main(entities: str = 'all', since: str = DEFAULT_SINCE.date().isoformat(), until: str = '',
+                   ranges: int = MODAL_WORKERS * RANGES_PER_WORKER, copy: bool = False, reset: bool = False,
+                   tenant: str = DEFAULT_TENANT_SLUG):
+        print(f"🔄 BACKFILL no Modal (até {MODAL_WORKERS} containers)")
+        for phase in plan_phases(parse_entities(entities)):
+            jobs = []
+            for entity in phase:
+                print(f"\n📦 {entity}")
+                entity_jobs = plan_remote.remote(entity, ranges, since, until, reset, copy, tenant)
+                if not entity_jobs:
+                    print("   ✅ Nada no período")
+                jobs += entity_jobs
+            if not jobs:
+                continue
+
+            # Faixas de todas as entidades da fase dividem os mesmos containers
+            results, failures = [], []
+            for job, result in zip(jobs, backfill_range_remote.map(jobs, return_exceptions=True)):
+                if isinstance(result, Exception):
+                    failures.append((job, result))
+                else:
+                    results.append(result)
+            for entity in phase:
+                print_entity_summary(entity, results, failures)
+            if failures:
+                break
+
+
+if __name__ == '__main__':
+    main()
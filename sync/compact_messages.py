@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Compactação de mensagens duplicadas - Supabase
+
+Antes da chave canônica (utils/keys.py), o sync_worker gravava as mensagens
+com o external_id do Chatwoot e o modal_jobs/backfill com o id do Neon: a
+mesma mensagem podia existir duas vezes. Este job lê do Neon os pares
+(external_id do Chatwoot → id) e manda cada lote para a função
+compact_message_keys (sync_worker_setup.sql), que resolve tudo no banco:
+rechaveia as linhas que só existem com a chave legada e apaga as duplicatas,
+movendo a transcrição para a linha canônica.
+
+Sem --apply é dry-run: só conta e grava o relatório.
+
+Chaves legadas ambíguas ficam de fora e entram no relatório: só com dígitos
+(podem coincidir com o id de outra mensagem no Neon) ou compartilhadas por
+mais de uma mensagem do Neon (não dá para saber qual delas a linha legada
+representa).
+
+USO:
+  python compact_messages.py                    # Dry-run + relatório
+  python compact_messages.py --apply
+  python compact_messages.py --tenant indaia --chunk 2000
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+
+from utils.keys import message_key
+from utils.neon import get_neon_connection, iter_legacy_message_keys
+from utils.supabase import get_supabase_client
+from utils.tenants import DEFAULT_TENANT_SLUG, get_tenant
+
+CHUNK_SIZE = 1000           # Pares por chamada da função (uma transação cada)
+COUNTERS = ('ambiguous', 'legacy_rows', 'duplicates', 'rekeyed', 'transcriptions',
+            'transcriptions_moved', 'transcriptions_dropped')
+SAMPLE_SIZE = 20
+
+
+def compact_chunk(supabase, tenant_id: str, pairs: list, apply: bool) -> dict:
+    return supabase.rpc('compact_message_keys', {
+        'p_tenant_id': tenant_id,
+        'p_legacy_keys': [legacy for legacy, _ in pairs],
+        'p_canonical_keys': [canonical for _, canonical in pairs],
+        'p_apply': apply,
+    }).execute().data
+
+
+def compact(neon, supabase, tenant, apply: bool = False, chunk_size: int = CHUNK_SIZE) -> dict:
+    """Percorre as chaves legadas do tenant no Neon e compacta lote a lote."""
+    report = {counter: 0 for counter in COUNTERS}
+    report.update({'tenant': tenant.slug, 'apply': apply, 'pairs': 0, 'numeric': 0, 'shared': 0,
+                   'sample': [], 'shared_sample': []})
+
+    for rows in iter_legacy_message_keys(neon, tenant.neon_tenant_id, chunk_size):
+        pairs = []
+        for row in rows:
+            if row['external_id'].isdigit():
+                report['numeric'] += 1
+                continue
+            if row['shared'] > 1:
+                report['shared'] += 1
+                if len(report['shared_sample']) < SAMPLE_SIZE:
+                    report['shared_sample'].append({'legacy': row['external_id'], 'messages': row['shared']})
+                continue
+            pairs.append((row['external_id'], message_key(row)))
+        if not pairs:
+            continue
+
+        result = compact_chunk(supabase, tenant.id, pairs, apply)
+        report['pairs'] += len(pairs)
+        for counter in COUNTERS:
+            report[counter] += result.get(counter) or 0
+        report['sample'] += result.get('sample') or []
+        del report['sample'][SAMPLE_SIZE:]
+        print(f"   📦 {report['pairs']:,} pares · {report['duplicates']:,} duplicatas · "
+              f"{report['rekeyed']:,} a rechavear")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Unifica mensagens duplicadas na chave canônica (id do Neon)")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT_SLUG, help="Slug do tenant")
+    parser.add_argument('--apply', action='store_true', help="Aplica (sem isso, só o relatório)")
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help="Pares por transação")
+    parser.add_argument('--output', help="Arquivo do relatório (padrão: compact_messages_<data>.json)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"🧹 COMPACTAÇÃO DE MENSAGENS {'(APLICANDO)' if args.apply else '(DRY-RUN)'}")
+    print("=" * 60)
+
+    supabase = get_supabase_client()
+    tenant = get_tenant(supabase, args.tenant)
+    neon = get_neon_connection()
+
+    started = time.time()
+    try:
+        report = compact(neon, supabase, tenant, args.apply, args.chunk)
+    finally:
+        neon.close()
+    report['elapsed_s'] = round(time.time() - started, 1)
+
+    path = args.output or f"compact_messages_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print("\n" + "=" * 60)
+    print(f"   🔑 {report['pairs']:,} mensagens com chave legada no Neon")
+    print(f"   ⏭️  Ambíguas, puladas: {report['numeric']:,} numéricas, {report['shared']:,} "
+          f"compartilhadas por mais de uma mensagem, {report['ambiguous']:,} no lote")
+    for item in report['shared_sample'][:5]:
+        print(f"      {item['legacy']}: {item['messages']} mensagens no Neon")
+    print(f"   📋 {report['legacy_rows']:,} linhas com chave legada no Supabase")
+    print(f"   ♻️  {report['duplicates']:,} duplicatas (com {report['transcriptions']:,} transcrições)")
+    print(f"   🔁 {report['rekeyed']:,} só com a chave legada")
+    for item in report['sample'][:5]:
+        print(f"      {item['legacy']} → {item['canonical']}{' (duplicata)' if item['duplicate'] else ''}")
+    if args.apply:
+        print(f"   ✅ Aplicado: {report['transcriptions_moved']:,} transcrições movidas, "
+              f"{report['transcriptions_dropped']:,} descartadas (a canônica já tinha)")
+    else:
+        print("   ℹ️  Dry-run: nada foi alterado (use --apply)")
+    print(f"   💾 Relatório em {path} ({report['elapsed_s']}s)")
+
+
+if __name__ == '__main__':
+    main()
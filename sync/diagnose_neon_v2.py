@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 """
 Diagnóstico do banco Neon v2 - Listar TODAS as tabelas
+
+USO:
+  python diagnose_neon_v2.py                            # Diagnóstico completo (volumes estimados)
+  python diagnose_neon_v2.py --profile                  # Só o perfil de volume (catálogo, < 1s) + JSON
+  python diagnose_neon_v2.py --profile --exact messages,conversations
+  python diagnose_neon_v2.py --profile --exact all --timeout 10
+
+O volume vem do catálogo (pg_class.reltuples, pg_stat_user_tables, tamanhos
+de tabela e índice), sem COUNT(*). Contagens exatas só com --exact, em
+paralelo e com statement_timeout.
 """
 
 import os
+import argparse
+from datetime import datetime
+
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
+from utils.profiler import EXACT_TIMEOUT_MS, build_report, save_report, print_report
+
 load_dotenv()
 
 def get_connection():
@@ -44,16 +59,6 @@ def get_table_columns(conn, table_name):
         cur.execute(query, (table_name,))
         return cur.fetchall()
 
-def get_row_count(conn, table_name):
-    """Conta registros de uma tabela."""
-    try:
-        with conn.cursor() as cur:
-            cur.execute(f'SELECT COUNT(*) as count FROM "{table_name}"')
-            return cur.fetchone()['count']
-    except Exception as e:
-        conn.rollback()
-        return f"Erro: {e}"
-
 def get_sample_row(conn, table_name):
     """Retorna uma linha de exemplo."""
     try:
@@ -64,21 +69,53 @@ def get_sample_row(conn, table_name):
         conn.rollback()
         return None
 
+def run_profile(exact: list, timeout_ms: int, output: str):
+    """Perfil de volume pelo catálogo (+ contagens exatas pedidas) e relatório JSON."""
+    print("=" * 70)
+    print("📏 PERFIL DE VOLUME DO NEON")
+    print("=" * 70)
+    
+    conn = get_connection()
+    try:
+        report = build_report(conn, get_connection, exact=exact, timeout_ms=timeout_ms)
+    finally:
+        conn.close()
+    
+    print_report(report)
+    path = output or f"neon_profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    save_report(report, path)
+    print(f"   💾 Relatório salvo em {path}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Diagnóstico do banco Neon")
+    parser.add_argument('--profile', action='store_true', help="Só o perfil de volume (catálogo) + relatório JSON")
+    parser.add_argument('--exact', default='', help="COUNT(*) exato destas tabelas (separadas por vírgula) ou all")
+    parser.add_argument('--timeout', type=float, default=EXACT_TIMEOUT_MS / 1000,
+                        help="statement_timeout de cada contagem exata, em segundos")
+    parser.add_argument('--output', default='', help="Arquivo do relatório (padrão: neon_profile_<data>.json)")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    exact = ['*'] if args.exact == 'all' else [t.strip() for t in args.exact.split(',') if t.strip()]
+    if args.profile:
+        run_profile(exact, int(args.timeout * 1000), args.output)
+        return
+    
     print("=" * 70)
     print("🔍 DIAGNÓSTICO COMPLETO DO BANCO NEON")
     print("=" * 70)
     
     conn = get_connection()
     
-    # 1. Listar TODAS as tabelas
+    # 1. Listar TODAS as tabelas (volume estimado pelo catálogo, sem COUNT(*))
     print("\n📋 TODAS AS TABELAS DO BANCO:")
     print("-" * 70)
     tables = list_all_tables(conn)
-    
-    for table in tables:
-        count = get_row_count(conn, table)
-        print(f"   {table:40} {str(count):>20}")
+    report = build_report(conn, get_connection, exact=exact, timeout_ms=int(args.timeout * 1000))
+    print_report(report)
     
     # 2. Identificar tabelas importantes
     print("\n" + "=" * 70)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Replay das dead letters - Supabase
+
+Tenta gravar de novo as linhas que o sync isolou em sync_dead_letters (lotes
+recusados por erro de dados, ver utils/dead_letter.py). Rode depois de
+corrigir a causa (coluna maior, pai que faltava...). As linhas que entram
+ficam marcadas com resolved_at; as que falham de novo ganham o erro novo.
+
+USO:
+  python replay_dead_letters.py                     # Todas as tabelas, até 500 por tabela
+  python replay_dead_letters.py --table messages    # Só uma tabela
+  python replay_dead_letters.py --limit 5000
+"""
+
+import argparse
+
+from utils.dead_letter import REPLAY_ORDER, REPLAY_PAGE, DEAD_LETTER_TABLE, replay
+from utils.supabase import get_supabase_client, get_tenant_id, rest_writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Regrava as linhas pendentes de {DEAD_LETTER_TABLE}")
+    parser.add_argument('--table', choices=REPLAY_ORDER, help="Só esta tabela (padrão: todas, pais antes)")
+    parser.add_argument('--tenant', default='indaia', help="Slug do tenant")
+    parser.add_argument('--limit', type=int, default=REPLAY_PAGE, help="Máximo de linhas por tabela")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("☠️  REPLAY DAS DEAD LETTERS")
+    print("=" * 60)
+
+    supabase = get_supabase_client()
+    tenant_id = get_tenant_id(supabase, args.tenant)
+    tables = (args.table,) if args.table else REPLAY_ORDER
+
+    summary = replay(
+        supabase,
+        lambda table, on_conflict: rest_writer(supabase, table, on_conflict),
+        tables=tables, tenant_id=tenant_id, limit=args.limit
+    )
+
+    if not summary:
+        print("\n✅ Nenhuma dead letter pendente")
+        return
+    for table, (written, pending) in summary.items():
+        icon = '✅' if not pending else '⚠️ '
+        print(f"   {icon} {table}: {written} regravadas, {pending} ainda com erro")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Normalização do content das mensagens do Chatwoot.
+
+Mensagens com anexo chegam como JSON (`{"content": ..., "attachments": [...]}`).
+O sync lê esse JSON uma vez e grava colunas indexadas em messages
+(attachment_type, attachment_url, attachment_count, text_content), para que
+fila de áudios, análises e diagnósticos não precisem reparsear o texto nem
+fazer LIKE no content.
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+import json
+from typing import Optional
+
+# Ordem de preferência quando a mensagem tem anexos de tipos diferentes
+# (o áudio alimenta a fila de transcrição)
+TYPE_PRIORITY = ('audio', 'image', 'video', 'file')
+
+
+def _attachment_type(attachment: dict) -> str:
+    return (attachment.get('file_type') or 'file').lower()
+
+
+def parse_message_content(content: Optional[str]) -> dict:
+    """
+    Colunas derivadas do content. Texto puro vira text_content; JSON do Chatwoot
+    vira o texto do campo content (None se não houver) + o anexo principal.
+    """
+    parsed = {
+        'text_content': content or '',
+        'attachment_type': None,
+        'attachment_url': None,
+        'attachment_count': 0,
+    }
+    if not content or not content.lstrip().startswith('{'):
+        return parsed
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return parsed
+    if not isinstance(data, dict):
+        return parsed
+
+    text = data.get('content')
+    parsed['text_content'] = text if isinstance(text, str) else None
+
+    attachments = [a for a in data.get('attachments') or [] if isinstance(a, dict)]
+    parsed['attachment_count'] = len(attachments)
+    if attachments:
+        rank = {t: i for i, t in enumerate(TYPE_PRIORITY)}
+        main = min(attachments, key=lambda a: rank.get(_attachment_type(a), len(rank)))
+        parsed['attachment_type'] = _attachment_type(main)
+        parsed['attachment_url'] = main.get('data_url') or main.get('file_url')
+    return parsed
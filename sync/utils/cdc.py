@@ -0,0 +1,182 @@
+"""
+Change data capture do Neon via replicação lógica (wal2json).
+
+Consome um replication slot e agrupa as mudanças em micro-batches de
+{tabela: ids alterados}. Quem consome (sync_worker.stream_neon_changes) relê
+essas linhas do Neon e aplica o mesmo transform + upsert do sync por polling;
+o LSN só é confirmado ao servidor depois que o batch foi gravado, então uma
+falha faz o slot reenviar as mudanças no próximo start.
+
+Teste local (Postgres com wal_level=logical e wal2json instalado):
+
+  cd sync
+  python -m utils.cdc "postgresql://postgres@localhost:5432/chatwoot" --slot indaia_sync_test
+"""
+
+import json
+import select
+import time
+from typing import Callable, Optional
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+
+CDC_TABLES = ("users", "leads", "conversations", "messages")
+DEFAULT_SLOT = "indaia_sync"
+
+# Micro-batch: fecha o batch com N mudanças ou após X segundos
+BATCH_MAX_CHANGES = 2000
+BATCH_MAX_WAIT = 5.0
+
+
+def decode_wal2json(payload: str) -> Optional[tuple]:
+    """Converte uma mensagem wal2json (format-version 2) em (tabela, ação, id)."""
+    change = json.loads(payload)
+    action = change.get("action")
+    if action not in ("I", "U", "D"):
+        return None  # B/C (transação), M (mensagem lógica), T (truncate)
+
+    values = change.get("identity") if action == "D" else change.get("columns")
+    for column in values or []:
+        if column["name"] == "id":
+            return change["table"], action, column["value"]
+    return None
+
+
+class ChangeStream:
+    """Leitor de um slot wal2json que entrega micro-batches e confirma LSNs."""
+
+    def __init__(self, dsn: str, slot: str = DEFAULT_SLOT, tables=CDC_TABLES,
+                 batch_max_changes: int = BATCH_MAX_CHANGES, batch_max_wait: float = BATCH_MAX_WAIT):
+        self.dsn = dsn
+        self.slot = slot
+        self.tables = tables
+        self.batch_max_changes = batch_max_changes
+        self.batch_max_wait = batch_max_wait
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=psycopg2.extras.LogicalReplicationConnection)
+        return conn, conn.cursor()
+
+    def ensure_slot(self, cur):
+        """Cria o slot se ainda não existir (a partir daí o servidor retém o WAL)."""
+        try:
+            cur.create_replication_slot(self.slot, output_plugin="wal2json")
+            print(f"   🆕 Slot {self.slot} criado")
+        except psycopg2.errors.DuplicateObject:
+            pass
+
+    def drop_slot(self):
+        conn, cur = self._connect()
+        try:
+            cur.drop_replication_slot(self.slot)
+        finally:
+            conn.close()
+
+    def run(self, apply_batch: Callable[[dict], None], max_seconds: Optional[float] = None) -> dict:
+        """
+        Consome o slot até max_seconds (ou para sempre), chamando apply_batch com
+        {tabela: [ids]} de inserts/updates. Deletes são só contados: o sync não
+        apaga linhas no Supabase.
+        """
+        conn, cur = self._connect()
+        stats = {"batches": 0, "changes": 0, "deletes": 0}
+        stop_at = time.monotonic() + max_seconds if max_seconds else None
+
+        try:
+            self.ensure_slot(cur)
+            cur.start_replication(slot_name=self.slot, decode=True, options={
+                "format-version": "2",
+                "include-transaction": "false",
+                "add-tables": ",".join(f"public.{table}" for table in self.tables),
+            })
+
+            pending = {}
+            pending_count = 0
+            last_lsn = None
+            batch_started = None
+
+            def flush():
+                nonlocal pending, pending_count, batch_started
+                if pending:
+                    apply_batch({table: list(ids) for table, ids in pending.items()})
+                    stats["batches"] += 1
+                    stats["changes"] += pending_count
+                if last_lsn is not None:
+                    cur.send_feedback(flush_lsn=last_lsn)
+                pending, pending_count, batch_started = {}, 0, None
+
+            while True:
+                msg = cur.read_message()
+                if msg is not None:
+                    last_lsn = msg.data_start
+                    change = decode_wal2json(msg.payload)
+                    if change:
+                        table, action, row_id = change
+                        if action == "D":
+                            stats["deletes"] += 1
+                        else:
+                            # dict preserva a ordem de chegada e deduplica ids
+                            pending.setdefault(table, {})[row_id] = None
+                            pending_count += 1
+                        if batch_started is None:
+                            batch_started = time.monotonic()
+                    if pending_count >= self.batch_max_changes:
+                        flush()
+
+                # Checado também com tráfego contínuo: batch parcial não espera
+                # encher e o prazo (max_seconds) vale mesmo sem pausa no WAL
+                now = time.monotonic()
+                if batch_started is not None and now - batch_started >= self.batch_max_wait:
+                    flush()
+                if stop_at is not None and now >= stop_at:
+                    flush()
+                    if last_lsn is not None:
+                        # send_feedback só agenda o status (vai no próximo intervalo): força
+                        # o envio antes de fechar, senão o slot fica um batch atrás e ele é
+                        # reaplicado a cada start
+                        cur.send_feedback(flush_lsn=last_lsn, reply=True, force=True)
+                    break
+                if msg is not None:
+                    continue
+
+                cur.send_feedback()  # keepalive sem avançar o LSN
+                select.select([cur], [], [], self.batch_max_wait)
+        finally:
+            conn.close()
+
+        return stats
+
+
+def main():
+    """Modo dry-run: imprime os batches em vez de gravar no Supabase."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lê mudanças do slot wal2json e imprime os micro-batches")
+    parser.add_argument("dsn")
+    parser.add_argument("--slot", default=f"{DEFAULT_SLOT}_test")
+    parser.add_argument("--seconds", type=float, default=None)
+    parser.add_argument("--drop-slot", action="store_true", help="Remove o slot e sai")
+    args = parser.parse_args()
+
+    stream = ChangeStream(args.dsn, slot=args.slot)
+    if args.drop_slot:
+        stream.drop_slot()
+        print(f"🗑️  Slot {args.slot} removido")
+        return
+
+    def print_batch(changes):
+        for table, ids in changes.items():
+            print(f"   📦 {table}: {len(ids)} ids → {ids[:10]}{'...' if len(ids) > 10 else ''}")
+
+    print(f"🔄 Lendo slot {args.slot} (Ctrl+C para sair)...")
+    try:
+        stats = stream.run(print_batch, max_seconds=args.seconds)
+        print(f"✅ {stats}")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
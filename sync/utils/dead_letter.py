@@ -0,0 +1,184 @@
+"""
+Dead letters: linhas que o Supabase recusa não travam mais o sync.
+
+Quando um lote falha com erro que não é de sobrecarga (content grande demais,
+FK inválida, valor fora do tipo...), o lote é dividido ao meio e cada metade
+é gravada de novo, recursivamente, até isolar as linhas problemáticas. O
+resto do lote é gravado; as linhas isoladas vão para sync_dead_letters com o
+texto do erro (ver sync_worker_setup.sql) e o cursor/checkpoint segue em
+frente. `replay()` tenta gravá-las de novo depois que o problema for
+corrigido (python replay_dead_letters.py).
+
+Erros de sobrecarga (429, 5xx, timeout) continuam subindo: são transitórios
+e o próximo run tenta de novo. Erros de schema (coluna ou tabela inexistente,
+sem permissão...) valem para qualquer linha: são reconhecidos pelo código
+(SQLSTATE/PGRST) e sobem sem dividir o lote, em vez de mandar a tabela toda
+para dead letter. Um lote só com linhas ruins (ex.: duas linhas com content
+grande demais) vai inteiro para dead letter e o sync segue.
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+from datetime import datetime
+from typing import Callable
+
+from .rate import error_code, is_throttle_error
+
+DEAD_LETTER_TABLE = 'sync_dead_letters'
+
+# Ordem de replay: pais antes dos filhos
+REPLAY_ORDER = ('agents', 'contacts', 'conversations', 'messages', 'transcriptions')
+
+REPLAY_PAGE = 500
+RESOLVE_CHUNK = 200         # ids por `id=in.(...)` (limite prático de URL)
+ERROR_MAX_CHARS = 2000
+
+# Erros que nenhuma linha do lote escaparia: coluna/tabela/função inexistente,
+# ON CONFLICT sem constraint, permissão, schema cache do PostgREST, JWT
+SCHEMA_ERROR_CODES = {
+    '42703', '42P01', '42883', '42P10', '42501',
+    'PGRST106', 'PGRST200', 'PGRST204', 'PGRST205', 'PGRST301', 'PGRST302',
+}
+
+
+class BatchError(Exception):
+    """Lote inteiro recusado por erro de schema: nenhuma linha pode ser gravada."""
+
+
+def is_schema_error(error: Exception) -> bool:
+    """True quando o erro vale para o lote todo (ver SCHEMA_ERROR_CODES), não para uma linha."""
+    return error_code(error) in SCHEMA_ERROR_CODES
+
+
+def isolate(write: Callable, rows: list, error: Exception) -> tuple:
+    """
+    Regrava `rows` (que falharam com `error`) em metades até isolar as linhas
+    ruins. `write(linhas)` grava ou levanta. Retorna (gravadas, [(linha, erro)]).
+    """
+    if len(rows) == 1:
+        return 0, [(rows[0], error)]
+
+    mid = len(rows) // 2
+    written, dead = 0, []
+    for half in (rows[:mid], rows[mid:]):
+        try:
+            write(half)
+            written += len(half)
+        except Exception as e:
+            if is_throttle_error(e):
+                raise
+            half_written, half_dead = isolate(write, half, e)
+            written += half_written
+            dead += half_dead
+    return written, dead
+
+
+def row_key(row: dict, on_conflict: str) -> str:
+    return '|'.join(str(row.get(column)) for column in on_conflict.split(','))
+
+
+def record(client, table: str, dead: list, on_conflict: str = 'tenant_id,external_id'):
+    """Grava (ou atualiza) as linhas recusadas em sync_dead_letters."""
+    failed_at = datetime.utcnow().isoformat()
+    entries = {}
+    for row, error in dead:
+        key = row_key(row, on_conflict)
+        entries[key] = {
+            'tenant_id': row.get('tenant_id'),
+            'target_table': table,
+            'row_key': key,
+            'on_conflict': on_conflict,
+            'payload': row,
+            'error': str(error)[:ERROR_MAX_CHARS],
+            'failed_at': failed_at,
+            'resolved_at': None,
+        }
+    client.table(DEAD_LETTER_TABLE)\
+        .upsert(list(entries.values()), on_conflict='target_table,row_key')\
+        .execute()
+
+
+def settle(client, write: Callable, table: str, rows: list, error: Exception,
+           on_conflict: str = 'tenant_id,external_id') -> tuple:
+    """
+    Trata um lote que falhou: sobrecarga sobe como está, erro de schema vira
+    BatchError; erro de dados isola as linhas ruins, grava o resto e manda as
+    ruins para dead letter. Retorna (gravadas, linhas que foram para dead letter).
+    """
+    if is_throttle_error(error):
+        raise error
+    if is_schema_error(error):
+        raise BatchError(f"{table}: lote de {len(rows)} linhas recusado inteiro: {str(error)[:200]}") from error
+
+    written, dead = isolate(write, rows, error)
+
+    if dead:
+        try:
+            record(client, table, dead, on_conflict)
+        except Exception as e:
+            print(f"   ⚠️  Não foi possível gravar em {DEAD_LETTER_TABLE} "
+                  f"(rode sync_worker_setup.sql): {str(e)[:100]}")
+            raise dead[0][1]
+        print(f"   ☠️  {table}: {len(dead)} linhas isoladas em {DEAD_LETTER_TABLE} "
+              f"(ex.: {row_key(dead[0][0], on_conflict)}: {str(dead[0][1])[:120]})")
+    return written, [row for row, _ in dead]
+
+
+def replay(client, write_for: Callable, tables: tuple = REPLAY_ORDER, tenant_id: str = None,
+           limit: int = None) -> dict:
+    """
+    Tenta gravar de novo as dead letters pendentes, tabela por tabela (pais
+    antes dos filhos). `write_for(tabela, on_conflict)` devolve a função de
+    escrita. As que entram ficam com resolved_at; as que falham de novo ganham
+    o erro novo e mais uma tentativa. Retorna {tabela: (gravadas, ainda pendentes)}.
+    """
+    summary = {}
+    for table in tables:
+        query = client.table(DEAD_LETTER_TABLE)\
+            .select('id,row_key,on_conflict,payload,attempts')\
+            .eq('target_table', table)\
+            .is_('resolved_at', 'null')
+        if tenant_id:
+            query = query.eq('tenant_id', tenant_id)
+        entries = query.order('failed_at').limit(limit or REPLAY_PAGE).execute().data
+        if not entries:
+            continue
+
+        resolved, pending = [], 0
+        by_conflict = {}
+        for entry in entries:
+            by_conflict.setdefault(entry['on_conflict'], []).append(entry)
+
+        for on_conflict, group in by_conflict.items():
+            write = write_for(table, on_conflict)
+            rows = [entry['payload'] for entry in group]
+            try:
+                write(rows)
+                dead = []
+            except Exception as e:
+                if is_throttle_error(e):
+                    raise
+                _, dead = isolate(write, rows, e)
+
+            errors = {row_key(row, on_conflict): error for row, error in dead}
+            now = datetime.utcnow().isoformat()
+            for entry in group:
+                error = errors.get(entry['row_key'])
+                if error is None:
+                    resolved.append(entry['id'])
+                    continue
+                pending += 1
+                client.table(DEAD_LETTER_TABLE).update({
+                    'error': str(error)[:ERROR_MAX_CHARS],
+                    'attempts': (entry.get('attempts') or 1) + 1,
+                    'failed_at': now,
+                }).eq('id', entry['id']).execute()
+
+        for i in range(0, len(resolved), RESOLVE_CHUNK):
+            client.table(DEAD_LETTER_TABLE)\
+                .update({'resolved_at': datetime.utcnow().isoformat()})\
+                .in_('id', resolved[i:i + RESOLVE_CHUNK])\
+                .execute()
+
+        summary[table] = (len(resolved), pending)
+    return summary
@@ -0,0 +1,192 @@
+"""
+Captura e análise de planos EXPLAIN (ANALYZE, BUFFERS) das queries do sync.
+
+Cada formato de query (`QueryShape`) roda com parâmetros representativos,
+numa transação que é desfeita no fim e com statement_timeout. Do plano em
+JSON saem tempo de execução, buffers lidos, índices usados e os alertas:
+seq scan em tabela grande (com sugestão de índice pelas colunas do filtro)
+e sort que foi para o disco.
+
+Os relatórios são gravados com timestamp; `compare()` aponta regressões em
+relação ao anterior (índice que deixou de ser usado, tempo que multiplicou).
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+import glob
+import json
+import os
+import re
+import time
+from datetime import datetime
+from typing import Callable, NamedTuple
+
+# Seq scan que lê menos linhas que isso não é alerta (tabelas pequenas)
+SEQ_SCAN_MIN_ROWS = 1000
+STATEMENT_TIMEOUT_MS = 30000
+
+# Regressão: tempo de execução multiplicado por este fator (e acima do piso)
+REGRESSION_FACTOR = 2.0
+REGRESSION_MIN_MS = 50.0
+
+# Literais ('audio', 'transcricao') e casts (::text, ::timestamp without time zone)
+# saem da condição antes de procurar colunas: o nome do tipo não é coluna
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_CAST_RE = re.compile(
+    r'::\s*(?:timestamp(?:\(\d+\))? with(?:out)? time zone|time with(?:out)? time zone|character varying'
+    r'|double precision|bit varying|"[^"]+"|[a-z_][a-z0-9_.]*)(?:\(\d+(?:,\s*\d+)?\))?(?:\[\])*',
+    re.IGNORECASE,
+)
+_ROW_COLUMNS_RE = re.compile(r'ROW\(([a-z0-9_, ]+)\)\s*(?:=|>=|<=|>|<)', re.IGNORECASE)
+_FILTER_COLUMN_RE = re.compile(
+    r"""(?<![:'"\w])\(?\b([a-z_][a-z0-9_]*)\)?\s*(=|>=|<=|>|<|<>|~~|IS\b)""", re.IGNORECASE
+)
+
+
+class QueryShape(NamedTuple):
+    name: str            # identificador estável (chave da comparação entre relatórios)
+    database: str        # 'neon' ou 'supabase'
+    sql: str
+    params: Callable     # contexto → parâmetros
+    source: str = ''     # onde o sync usa essa query
+
+
+def walk(node: dict):
+    """Percorre o nó do plano e todos os filhos."""
+    yield node
+    for child in node.get('Plans', ()):
+        yield from walk(child)
+
+
+def filter_columns(condition: str) -> list:
+    """
+    Colunas citadas numa condição de filtro do plano, na ordem de um índice
+    composto: igualdades primeiro, depois as de faixa (sem repetir).
+
+    >>> filter_columns("((attachment_type = 'audio'::text) AND ((metadata ->> 'transcricao'::text) IS NULL))")
+    ['attachment_type']
+    >>> filter_columns("((tenant_id = 1) AND (ROW(created_at, id) > ROW('2025-01-01'::timestamp without time zone, 0)))")
+    ['tenant_id', 'created_at', 'id']
+    """
+    condition = _CAST_RE.sub('', _LITERAL_RE.sub("''", condition or ''))
+    equality, ranged = [], []
+    for column, operator in _FILTER_COLUMN_RE.findall(condition):
+        (equality if operator == '=' else ranged).append(column)
+    # Keyset (a, b) > (x, y) aparece como ROW(a, b) > ROW(...)
+    ranged = [c.strip() for group in _ROW_COLUMNS_RE.findall(condition) for c in group.split(',')] + ranged
+
+    columns = []
+    for column in equality + ranged:
+        if column.lower() not in ('and', 'or', 'not', 'null') and column not in columns:
+            columns.append(column)
+    return columns
+
+
+def analyze_plan(plan: dict) -> dict:
+    """Resumo do plano (EXPLAIN FORMAT JSON) com os alertas."""
+    root = plan['Plan']
+    flags, indexes = [], []
+    for node in walk(root):
+        node_type = node.get('Node Type', '')
+        loops = node.get('Actual Loops', 1) or 1
+        if node.get('Index Name'):
+            indexes.append(node['Index Name'])
+
+        if node_type == 'Seq Scan':
+            scanned = (node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)) * loops
+            if scanned >= SEQ_SCAN_MIN_ROWS:
+                relation = node.get('Relation Name')
+                flag = {'type': 'seq_scan', 'relation': relation, 'rows_scanned': scanned,
+                        'filter': node.get('Filter')}
+                columns = filter_columns(node.get('Filter'))
+                if columns:
+                    flag['type'] = 'missing_index'
+                    flag['suggestion'] = f"CREATE INDEX ON {relation} ({', '.join(columns)})"
+                flags.append(flag)
+
+        if node_type in ('Sort', 'Incremental Sort') and node.get('Sort Space Type') == 'Disk':
+            flags.append({'type': 'sort_on_disk', 'sort_key': node.get('Sort Key'),
+                          'space_kb': node.get('Sort Space Used')})
+
+    return {
+        'execution_ms': plan.get('Execution Time'),
+        'planning_ms': plan.get('Planning Time'),
+        'rows': root.get('Actual Rows'),
+        'shared_hit_blocks': root.get('Shared Hit Blocks'),
+        'shared_read_blocks': root.get('Shared Read Blocks'),
+        'indexes': sorted(set(indexes)),
+        'flags': flags,
+    }
+
+
+def explain(conn, shape: QueryShape, context: dict, timeout_ms: int = STATEMENT_TIMEOUT_MS) -> dict:
+    """
+    Roda a query com EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) e devolve plano +
+    análise. A transação é desfeita sempre: o ANALYZE executa a query de verdade.
+    """
+    started = time.monotonic()
+    entry = {'name': shape.name, 'database': shape.database, 'source': shape.source, 'sql': shape.sql.strip()}
+    try:
+        params = shape.params(context)
+        entry['params'] = [str(p) for p in params]
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + shape.sql, params)
+            row = cur.fetchone()
+        result = row['QUERY PLAN'] if isinstance(row, dict) else row[0]
+        plan = (json.loads(result) if isinstance(result, str) else result)[0]
+        entry.update(analyze_plan(plan))
+        entry['plan'] = plan
+    except Exception as e:
+        entry['error'] = str(e).strip()[:300]
+    finally:
+        conn.rollback()
+    entry['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+    return entry
+
+
+def compare(current: list, previous: list) -> list:
+    """Regressões do relatório atual em relação ao anterior, por nome de query."""
+    before = {entry['name']: entry for entry in previous}
+    regressions = []
+    for entry in current:
+        old = before.get(entry['name'])
+        if not old or 'error' in entry or 'error' in old:
+            continue
+        old_flags = {(f['type'], f.get('relation')) for f in old.get('flags', ())}
+        for flag in entry.get('flags', ()):
+            if (flag['type'], flag.get('relation')) not in old_flags:
+                regressions.append({'name': entry['name'], 'type': f"novo {flag['type']}",
+                                    'detail': flag.get('relation') or flag.get('sort_key')})
+        lost = set(old.get('indexes', ())) - set(entry.get('indexes', ()))
+        if lost:
+            regressions.append({'name': entry['name'], 'type': 'índice não usado mais',
+                                'detail': ', '.join(sorted(lost))})
+        old_ms, new_ms = old.get('execution_ms') or 0, entry.get('execution_ms') or 0
+        if new_ms >= REGRESSION_MIN_MS and old_ms and new_ms >= old_ms * REGRESSION_FACTOR:
+            regressions.append({'name': entry['name'], 'type': 'mais lenta',
+                                'detail': f"{old_ms:.1f} ms → {new_ms:.1f} ms"})
+    return regressions
+
+
+def report_path(directory: str, when: datetime = None) -> str:
+    return os.path.join(directory, f"plans_{(when or datetime.utcnow()).strftime('%Y%m%d_%H%M%S')}.json")
+
+
+def latest_report(directory: str):
+    """Último relatório gravado no diretório (ou None)."""
+    paths = sorted(glob.glob(os.path.join(directory, 'plans_*.json')))
+    if not paths:
+        return None
+    with open(paths[-1]) as f:
+        return json.load(f)
+
+
+def save_report(directory: str, entries: list, regressions: list) -> str:
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.utcnow()
+    path = report_path(directory, now)
+    with open(path, 'w') as f:
+        json.dump({'generated_at': now.isoformat(), 'queries': entries, 'regressions': regressions},
+                  f, indent=2, ensure_ascii=False, default=str)
+    return path
@@ -0,0 +1,107 @@
+"""
+Fingerprints das linhas já gravadas no Supabase (SQLite).
+
+Cada linha transformada vira um hash (sem colunas voláteis como synced_at),
+guardado por (tenant, tabela, external_id). Antes do upsert, as linhas cujo
+hash não mudou desde a última escrita são descartadas: um updated_at que
+andou no Neon sem mudar nenhuma coluna mapeada não gera requisição.
+
+Os hashes só são gravados depois que o upsert deu certo, e expiram após
+FINGERPRINT_TTL para que uma linha alterada/apagada direto no Supabase volte
+a ser escrita em algum momento. Usa o mesmo arquivo do cache de IDs.
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+from .id_cache import DEFAULT_CACHE_PATH
+
+# Colunas que mudam a cada run sem representar mudança no dado
+VOLATILE_COLUMNS = ('synced_at',)
+
+# Reescreve mesmo sem mudança depois desse prazo
+FINGERPRINT_TTL = timedelta(days=7)
+
+# Limite de variáveis por query do SQLite
+_LOOKUP_CHUNK = 500
+
+
+def fingerprint(row: dict) -> str:
+    """Hash estável da linha transformada (ordem das chaves não importa)."""
+    payload = {k: v for k, v in row.items() if k not in VOLATILE_COLUMNS}
+    encoded = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class FingerprintStore:
+    """Hashes das últimas linhas gravadas por (tenant, tabela, external_id)."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: timedelta = FINGERPRINT_TTL):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    tenant_id TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    external_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    written_at TEXT NOT NULL,
+                    PRIMARY KEY (tenant_id, table_name, external_id)
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Uma conexão por operação: seguro para usar a partir de threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def filter_changed(self, tenant_id: str, table: str, rows: list):
+        """
+        Separa as linhas que precisam ser gravadas. Retorna (linhas, pendentes),
+        onde pendentes deve ir para commit() depois do upsert bem-sucedido.
+        """
+        hashes = {str(row['external_id']): fingerprint(row) for row in rows}
+        fresh_after = (datetime.utcnow() - self.ttl).isoformat()
+
+        stored = {}
+        keys = list(hashes)
+        with self._connect() as conn:
+            for i in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[i:i + _LOOKUP_CHUNK]
+                stored.update(conn.execute(
+                    f"SELECT external_id, hash FROM fingerprints "
+                    f"WHERE tenant_id = ? AND table_name = ? AND written_at >= ? "
+                    f"AND external_id IN ({','.join('?' * len(chunk))})",
+                    [tenant_id, table, fresh_after, *chunk]
+                ).fetchall())
+
+        changed = [row for row in rows if stored.get(str(row['external_id'])) != hashes[str(row['external_id'])]]
+        pending = [(external_id, h) for external_id, h in hashes.items() if stored.get(external_id) != h]
+        return changed, pending
+
+    def commit(self, tenant_id: str, table: str, pending: list):
+        """Registra os hashes das linhas gravadas."""
+        if not pending:
+            return
+        written_at = datetime.utcnow().isoformat()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (tenant_id, table_name, external_id, hash, written_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(tenant_id, table, external_id, h, written_at) for external_id, h in pending]
+            )
+
+    def clear(self, tenant_id: str, table: Optional[str] = None):
+        """Esquece os hashes (força reescrita no próximo run)."""
+        with self._connect() as conn:
+            if table:
+                conn.execute("DELETE FROM fingerprints WHERE tenant_id = ? AND table_name = ?", (tenant_id, table))
+            else:
+                conn.execute("DELETE FROM fingerprints WHERE tenant_id = ?", (tenant_id,))
@@ -0,0 +1,183 @@
+"""
+Cache persistente dos mapas external_id → UUID (SQLite).
+
+Evita baixar as tabelas inteiras de conversations/contacts/agents a cada run:
+o cache guarda o mapa em disco (arquivo local ou Modal Volume) e só busca no
+Supabase as linhas com synced_at/created_at mais novos que a marca d'água.
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from .paging import iter_pages
+
+# Margem de segurança: linhas gravadas por um run em andamento podem ter
+# synced_at um pouco anterior à marca d'água quando o commit acontece.
+REFRESH_OVERLAP = timedelta(minutes=15)
+
+DEFAULT_CACHE_PATH = os.getenv(
+    'SYNC_ID_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.id_cache.sqlite')
+)
+
+
+def _parse_ts(value: Optional[str]) -> Optional[datetime]:
+    """Converte timestamp ISO do PostgREST (com ou sem Z) para datetime."""
+    if not value:
+        return None
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None) - parsed.utcoffset()
+    return parsed
+
+
+def native_key(external_id: str):
+    """IDs numéricos voltam como int (tipo dos IDs do Neon), o resto como texto."""
+    return int(external_id) if external_id.isdigit() else external_id
+
+
+class IdMapCache:
+    """Mapas external_id → UUID por (tenant, tabela), persistidos em SQLite."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS id_map (
+                    tenant_id TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    external_id TEXT NOT NULL,
+                    uuid TEXT NOT NULL,
+                    PRIMARY KEY (tenant_id, table_name, external_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    tenant_id TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    watermark TEXT NOT NULL,
+                    PRIMARY KEY (tenant_id, table_name)
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Uma conexão por operação: seguro para usar a partir de threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    # --------------------------------------------------------
+    # Leitura
+    # --------------------------------------------------------
+    def watermark(self, tenant_id: str, table: str) -> Optional[datetime]:
+        """Retorna a marca d'água do mapa (None = cache frio)."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT watermark FROM watermarks WHERE tenant_id = ? AND table_name = ?",
+                (tenant_id, table)
+            ).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def is_warm(self, tenant_id: str, table: str) -> bool:
+        return self.watermark(tenant_id, table) is not None
+
+    def load(self, tenant_id: str, table: str) -> dict:
+        """Mapa {str(external_id): uuid} do que está em disco, sem ir ao Supabase."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT external_id, uuid FROM id_map WHERE tenant_id = ? AND table_name = ?",
+                (tenant_id, table)
+            ).fetchall()
+        return dict(rows)
+
+    def get_map(self, client, tenant_id: str, table: str) -> dict:
+        """
+        Atualiza o mapa (delta, ou completo se frio) e retorna {external_id: uuid},
+        com as chaves no mesmo formato dos mapas antigos (int para IDs do Neon).
+        """
+        self.refresh(client, tenant_id, table)
+        return self.snapshot(tenant_id, table)
+
+    def snapshot(self, tenant_id: str, table: str) -> dict:
+        """Mapa {external_id: uuid} como está em disco, sem refresh (leitura compartilhada)."""
+        return {native_key(k): v for k, v in self.load(tenant_id, table).items()}
+
+    # --------------------------------------------------------
+    # Atualização
+    # --------------------------------------------------------
+    def refresh(self, client, tenant_id: str, table: str) -> int:
+        """
+        Busca no Supabase só as linhas novas/alteradas desde a marca d'água.
+        Com o cache frio, reconstrói o mapa inteiro. Retorna linhas gravadas.
+        """
+        watermark = self.watermark(tenant_id, table)
+        since = watermark - REFRESH_OVERLAP if watermark else None
+
+        def where(query):
+            query = query.eq('tenant_id', tenant_id)
+            if since:
+                since_iso = since.isoformat()
+                query = query.or_(f"synced_at.gte.{since_iso},created_at.gte.{since_iso}")
+            return query
+
+        total = 0
+        newest = watermark
+        # Keyset por id com faixas lidas em paralelo (utils/paging.py)
+        for page in iter_pages(client, table, 'id,external_id,synced_at,created_at', where):
+            self._store(tenant_id, table, page)
+            total += len(page)
+            for item in page:
+                for column in ('synced_at', 'created_at'):
+                    ts = _parse_ts(item.get(column))
+                    if ts and (newest is None or ts > newest):
+                        newest = ts
+
+        # Tabela vazia também conta como cache quente
+        self._set_watermark(tenant_id, table, newest or datetime.utcnow())
+        return total
+
+    def start_background_rebuild(self, client, tenant_id: str, tables) -> threading.Thread:
+        """Reconstrói em background os mapas frios; o chamador segue sem esperar."""
+        cold = [table for table in tables if not self.is_warm(tenant_id, table)]
+
+        def rebuild():
+            for table in cold:
+                try:
+                    count = self.refresh(client, tenant_id, table)
+                    print(f"   🗺️  Cache de {table} reconstruído ({count:,} IDs)")
+                except Exception as e:
+                    print(f"   ⚠️  Erro ao reconstruir cache de {table}: {e}")
+
+        thread = threading.Thread(target=rebuild, name="id-cache-rebuild", daemon=True)
+        thread.start()
+        return thread
+
+    def clear(self, tenant_id: str, table: Optional[str] = None):
+        """Esvazia o cache (ex.: depois de rodar cleanup.sql)."""
+        with self._connect() as conn:
+            if table:
+                conn.execute("DELETE FROM id_map WHERE tenant_id = ? AND table_name = ?", (tenant_id, table))
+                conn.execute("DELETE FROM watermarks WHERE tenant_id = ? AND table_name = ?", (tenant_id, table))
+            else:
+                conn.execute("DELETE FROM id_map WHERE tenant_id = ?", (tenant_id,))
+                conn.execute("DELETE FROM watermarks WHERE tenant_id = ?", (tenant_id,))
+
+    def _store(self, tenant_id: str, table: str, rows: list):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO id_map (tenant_id, table_name, external_id, uuid) VALUES (?, ?, ?, ?)",
+                [(tenant_id, table, str(r['external_id']), r['id']) for r in rows if r.get('external_id') is not None]
+            )
+
+    def _set_watermark(self, tenant_id: str, table: str, watermark: datetime):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO watermarks (tenant_id, table_name, watermark) VALUES (?, ?, ?)",
+                (tenant_id, table, watermark.isoformat())
+            )
@@ -0,0 +1,18 @@
+"""
+Chave canônica das mensagens no Supabase.
+
+messages.external_id é sempre o id (PK) da mensagem no Neon, como texto.
+Todos os caminhos de sync (sync_worker, CDC, modal_jobs, backfill) gravam
+por esta função: a mesma mensagem do Neon cai sempre na mesma linha.
+
+Chave legada: o sync_worker usava o external_id do Chatwoot (ex.: wamid...)
+quando existia, o que duplicava a mensagem gravada pelos outros caminhos.
+Essas linhas são unificadas por compact_messages.py.
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+
+def message_key(row: dict) -> str:
+    """external_id da mensagem no Supabase a partir da linha do Neon."""
+    return str(row['id'])
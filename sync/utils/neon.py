@@ -1,10 +1,62 @@
 import os
+import re
+import queue
+import threading
+from datetime import datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Linhas por ida ao servidor nos cursores nomeados (server-side)
+ITERSIZE = 2000
+
+# Colunas extraídas de cada tabela
+USER_COLUMNS = ('id', 'name', 'email', 'role', 'active', 'avatar_url', 'created_at')
+
+LEAD_COLUMNS = (
+    'id', 'external_id', 'identifier', 'name', 'email', 'phone_number as phone',
+    'status', 'additional_attributes', 'custom_attributes', 'utm_source',
+    'utm_medium', 'utm_campaign', 'created_at',
+)
+
+CONVERSATION_COLUMNS = (
+    'id', 'lead_id', 'user_id', 'status', 'team_id', 'folder_id', 'is_bot',
+    'platform', 'last_message', 'last_message_at', 'created_at', 'updated_at',
+)
+
+# Colunas de messages (mesma ordem no SELECT e no COPY)
+MESSAGE_COLUMNS = (
+    'id', 'external_id', 'conversation_id', 'lead_id', 'user_id', 'inbox_id',
+    'content', 'content_type', 'from_me', 'status', 'sent_at', 'transcricao',
+    'platform', 'created_at',
+)
+
+# Backfill por keyset: entidade → (tabela no Neon, colunas, coluna do período)
+KEYSET_SOURCES = {
+    'agents': ('users', USER_COLUMNS, None),
+    'contacts': ('leads', LEAD_COLUMNS, None),
+    'conversations': ('conversations', CONVERSATION_COLUMNS, 'created_at'),
+    'messages': ('messages', MESSAGE_COLUMNS, 'created_at'),
+}
+
+# Conversão dos campos texto do COPY para os tipos que o RealDictCursor entregaria
+_COPY_CONVERTERS = {
+    'id': int,
+    'conversation_id': int,
+    'lead_id': int,
+    'user_id': int,
+    'inbox_id': int,
+    'from_me': lambda v: v == 't',
+    'sent_at': datetime.fromisoformat,
+    'created_at': datetime.fromisoformat,
+}
+
+# Escapes do formato texto do COPY (COPY TO não emite octal/hex)
+_COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+_COPY_ESCAPE_RE = re.compile(r'\\(.)')
+
 def get_neon_connection():
     """Conecta ao banco Neon."""
     return psycopg2.connect(
@@ -16,70 +68,57 @@ def get_neon_connection():
         cursor_factory=RealDictCursor
     )
 
-def fetch_users(conn, limit=None):
-    """Busca usuários (atendentes) - tabela users."""
-    query = """
-        SELECT 
-            id,
-            name,
-            email,
-            role,
-            active,
-            avatar_url,
-            created_at
+def _stream(conn, query, params=None, chunk_size=ITERSIZE, name='sync_stream'):
+    """
+    Executa a query num cursor nomeado (server-side) e gera listas de até
+    chunk_size linhas: a memória fica constante, independente do tamanho da tabela.
+    """
+    with conn.cursor(name=name) as cur:
+        cur.itersize = chunk_size
+        cur.execute(query, params or [])
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    # Fecha a transação aberta pelo cursor nomeado (só leitura)
+    conn.commit()
+
+def _users_query(limit=None):
+    query = f"""
+        SELECT {', '.join(USER_COLUMNS)}
         FROM users
         ORDER BY id
     """
     if limit:
         query += f" LIMIT {limit}"
-    
+    return query
+
+def fetch_users(conn, limit=None):
+    """Busca usuários (atendentes) - tabela users."""
     with conn.cursor() as cur:
-        cur.execute(query)
+        cur.execute(_users_query(limit))
         return cur.fetchall()
 
-def fetch_leads(conn, limit=None):
-    """Busca leads/contatos - tabela leads (NÃO contacts!)."""
-    query = """
-        SELECT 
-            id,
-            external_id,
-            identifier,
-            name,
-            email,
-            phone_number as phone,
-            status,
-            additional_attributes,
-            custom_attributes,
-            utm_source,
-            utm_medium,
-            utm_campaign,
-            created_at
+def _leads_query(limit=None):
+    query = f"""
+        SELECT {', '.join(LEAD_COLUMNS)}
         FROM leads
         ORDER BY id
     """
     if limit:
         query += f" LIMIT {limit}"
-    
+    return query
+
+def fetch_leads(conn, limit=None):
+    """Busca leads/contatos - tabela leads (NÃO contacts!)."""
     with conn.cursor() as cur:
-        cur.execute(query)
+        cur.execute(_leads_query(limit))
         return cur.fetchall()
 
-def fetch_conversations(conn, start_date=None, limit=None):
-    """Busca conversas."""
-    query = """
-        SELECT 
-            id,
-            lead_id,
-            user_id,
-            status,
-            team_id,
-            folder_id,
-            is_bot,
-            platform,
-            last_message,
-            last_message_at,
-            created_at,
-            updated_at
+def _conversations_query(start_date=None, limit=None):
+    query = f"""
+        SELECT {', '.join(CONVERSATION_COLUMNS)}
         FROM conversations
         WHERE 1=1
     """
@@ -93,29 +132,18 @@ def fetch_conversations(conn, start_date=None, limit=None):
     
     if limit:
         query += f" LIMIT {limit}"
-    
+    return query, params
+
+def fetch_conversations(conn, start_date=None, limit=None):
+    """Busca conversas."""
+    query, params = _conversations_query(start_date, limit)
     with conn.cursor() as cur:
         cur.execute(query, params)
         return cur.fetchall()
 
-def fetch_messages(conn, conversation_ids=None, start_date=None, limit=None):
-    """Busca mensagens."""
-    query = """
-        SELECT 
-            id,
-            external_id,
-            conversation_id,
-            lead_id,
-            user_id,
-            inbox_id,
-            content,
-            content_type,
-            from_me,
-            status,
-            sent_at,
-            transcricao,
-            platform,
-            created_at
+def _messages_query(conversation_ids=None, start_date=None, limit=None):
+    query = f"""
+        SELECT {', '.join(MESSAGE_COLUMNS)}
         FROM messages
         WHERE 1=1
     """
@@ -133,20 +161,217 @@ def fetch_messages(conn, conversation_ids=None, start_date=None, limit=None):
     
     if limit:
         query += f" LIMIT {limit}"
+    return query, params
+
+def fetch_messages(conn, conversation_ids=None, start_date=None, limit=None):
+    """Busca mensagens."""
+    query, params = _messages_query(conversation_ids, start_date, limit)
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return cur.fetchall()
+
+def _keyset_query(entity, after_id=None, end_id=None, since=None, until=None, tenant_id=None):
+    """
+    SELECT de uma entidade do backfill: id > after_id e id <= end_id (faixa),
+    período em [since, until) quando a tabela tem coluna de data, ordenado por id.
+    Com tenant_id, só as linhas do tenant (users não tem tenant).
+    """
+    table, columns, date_column = KEYSET_SOURCES[entity]
+    query = f"""
+        SELECT {', '.join(columns)}
+        FROM {table}
+        WHERE 1=1
+    """
+    params = []
+    
+    if tenant_id is not None and entity != 'agents':
+        query += " AND tenant_id = %s"
+        params.append(tenant_id)
+    
+    if after_id is not None:
+        query += " AND id > %s"
+        params.append(after_id)
+    
+    if end_id is not None:
+        query += " AND id <= %s"
+        params.append(end_id)
+    
+    if date_column and since:
+        query += f" AND {date_column} >= %s"
+        params.append(since)
+    
+    if date_column and until:
+        query += f" AND {date_column} < %s"
+        params.append(until)
+    
+    query += " ORDER BY id"
+    return query, params
+
+def fetch_by_ids(conn, entity, ids, tenant_id=None):
+    """
+    Linhas da entidade com id em ids, numa query só (ex.: pais que faltam para
+    um lote de mensagens). Com tenant_id, filtra o tenant (users não tem tenant).
+    """
+    if not ids:
+        return []
+    table, columns, _ = KEYSET_SOURCES[entity]
+    query = f"SELECT {', '.join(columns)} FROM {table} WHERE id = ANY(%s)"
+    params = [list(ids)]
+    
+    if tenant_id is not None and entity != 'agents':
+        query += " AND tenant_id = %s"
+        params.append(tenant_id)
     
     with conn.cursor() as cur:
         cur.execute(query, params)
         return cur.fetchall()
 
-def fetch_messages_count(conn, start_date=None):
-    """Conta mensagens para progress bar."""
-    query = "SELECT COUNT(*) as count FROM messages WHERE 1=1"
+def iter_legacy_message_keys(conn, tenant_id, chunk_size=ITERSIZE):
+    """
+    Gera listas de (id, external_id, shared) das chaves legadas do tenant: o
+    external_id do Chatwoot com que o sync_worker gravava no Supabase. Uma
+    linha por external_id; shared > 1 quando várias mensagens do Neon têm o
+    mesmo (não dá para saber qual delas a linha legada representa).
+    """
+    query = """
+        SELECT MIN(id) AS id, external_id::text AS external_id, COUNT(*) AS shared
+        FROM messages
+        WHERE tenant_id = %s AND external_id IS NOT NULL AND external_id::text <> id::text
+        GROUP BY external_id::text
+        ORDER BY MIN(id)
+    """
+    return _stream(conn, query, [tenant_id], chunk_size=chunk_size, name='stream_legacy_message_keys')
+
+def fetch_id_bounds(conn, entity, since=None, until=None, tenant_id=None):
+    """Retorna (menor id, maior id) da entidade no período (e no tenant), ou (None, None)."""
+    table, _, date_column = KEYSET_SOURCES[entity]
+    query = f"SELECT MIN(id) as min_id, MAX(id) as max_id FROM {table} WHERE 1=1"
     params = []
     
-    if start_date:
-        query += " AND created_at >= %s"
-        params.append(start_date)
+    if tenant_id is not None and entity != 'agents':
+        query += " AND tenant_id = %s"
+        params.append(tenant_id)
+    
+    if date_column and since:
+        query += f" AND {date_column} >= %s"
+        params.append(since)
+    
+    if date_column and until:
+        query += f" AND {date_column} < %s"
+        params.append(until)
     
     with conn.cursor() as cur:
         cur.execute(query, params)
-        return cur.fetchone()['count']
+        row = cur.fetchone()
+    return row['min_id'], row['max_id']
+
+def fetch_page_after(conn, entity, after_id, end_id=None, since=None, until=None, limit=ITERSIZE,
+                     tenant_id=None):
+    """
+    Próxima página por keyset (id > after_id). Cada página é uma busca no
+    índice da PK: o custo não cresce com o quanto já foi lido, ao contrário do OFFSET.
+    """
+    query, params = _keyset_query(entity, after_id, end_id, since, until, tenant_id)
+    query += " LIMIT %s"
+    params.append(limit)
+    
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return cur.fetchall()
+
+def _decode_copy_field(name, value):
+    if value == '\\N':
+        return None
+    if '\\' in value:
+        value = _COPY_ESCAPE_RE.sub(lambda m: _COPY_ESCAPES.get(m.group(1), m.group(1)), value)
+    converter = _COPY_CONVERTERS.get(name)
+    return converter(value) if converter else value
+
+def copy_messages(conn, start_date=None, chunk_size=5000, after_id=None, end_id=None, until=None,
+                  tenant_id=None):
+    """
+    Extrai mensagens com COPY (SELECT ...) TO STDOUT (formato texto) e gera
+    chunks de dicts no mesmo formato de fetch_messages, decodificados linha a linha.
+    
+    O COPY roda numa thread e entrega as linhas por uma fila limitada, então o
+    Neon só avança enquanto o consumidor (upsert no Supabase) acompanha.
+    As linhas saem ordenadas por id: after_id/end_id permitem retomar uma faixa.
+    Fechar o gerador antes do fim (erro no load) cancela o COPY e espera a thread.
+    """
+    query, params = _keyset_query('messages', after_id, end_id, start_date, until, tenant_id)
+    with conn.cursor() as cur:
+        copy_sql = f"COPY ({cur.mogrify(query, params).decode()}) TO STDOUT"
+    
+    lines = queue.Queue(maxsize=chunk_size * 2)
+    done = object()
+    stop = threading.Event()
+    
+    def put(item) -> bool:
+        # Com timeout: se o consumidor parou, a thread do COPY não fica presa na fila cheia
+        while not stop.is_set():
+            try:
+                lines.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    class _QueueWriter:
+        """Destino do copy_expert: cada write do psycopg2 é uma linha do COPY."""
+        def write(self, data):
+            if isinstance(data, bytes):
+                data = data.decode('utf-8')
+            if not put(data):
+                raise RuntimeError("COPY interrompido: consumidor parou")
+    
+    def run_copy():
+        try:
+            with conn.cursor() as cur:
+                cur.copy_expert(copy_sql, _QueueWriter())
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+    
+    worker = threading.Thread(target=run_copy, name='copy-messages', daemon=True)
+    worker.start()
+    
+    try:
+        chunk = []
+        buffer = ''
+        while True:
+            item = lines.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            buffer += item
+            *complete, buffer = buffer.split('\n')
+            for line in complete:
+                values = line.split('\t')
+                chunk.append({
+                    name: _decode_copy_field(name, value)
+                    for name, value in zip(MESSAGE_COLUMNS, values)
+                })
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        
+        worker.join()
+        conn.commit()
+        if chunk:
+            yield chunk
+    finally:
+        # Consumidor parou antes do fim (erro no load, break): cancela o COPY no
+        # servidor e espera a thread, para a conexão não ser fechada no meio dele
+        stop.set()
+        if worker.is_alive():
+            try:
+                conn.cancel()
+            except Exception:
+                pass
+            worker.join(timeout=10)
+            try:
+                conn.rollback()
+            except Exception:
+                pass
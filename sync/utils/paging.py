@@ -0,0 +1,125 @@
+"""
+Leitura paginada de tabelas do Supabase por keyset (id > último), com prefetch.
+
+`.range(offset, ...)` obriga o Postgres a pular todas as linhas anteriores a
+cada página (O(n²) na tabela inteira). Aqui cada página é `id > último id`
+com `order=id`, que usa o índice da PK. Como os ids são UUID aleatórios, o
+espaço de ids é dividido em faixas por prefixo hexadecimal e cada faixa é
+lida por uma thread própria: as próximas páginas já estão chegando enquanto
+quem chama processa a atual. As páginas são entregues conforme chegam (fora
+de ordem entre faixas), com fila limitada para não acumular memória.
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+import queue
+import threading
+from typing import Callable, Iterator, Optional
+
+# Limite padrão de linhas por resposta do PostgREST
+PAGE_SIZE = 1000
+
+# Faixas de id lidas em paralelo (divisor de 16)
+PREFETCH_SHARDS = 8
+
+_DONE = object()
+
+
+def uuid_bounds(shards: int = PREFETCH_SHARDS) -> list:
+    """Divide o espaço de UUIDs em faixas [início, fim) pelo primeiro dígito hex."""
+    step = max(1, 16 // shards)
+    edges = [f"{i:x}0000000-0000-0000-0000-000000000000" for i in range(step, 16, step)]
+    starts = [None] + edges
+    ends = edges + [None]
+    return list(zip(starts, ends))
+
+
+def iter_pages(client, table: str, columns: str, where: Optional[Callable] = None,
+               page_size: int = PAGE_SIZE, shards: int = PREFETCH_SHARDS) -> Iterator[list]:
+    """
+    Gera as páginas (listas de linhas) de `table` por keyset em `id`.
+
+    `where` recebe a query e devolve a query filtrada (ex.: tenant). `columns`
+    ganha `id` se não tiver. shards=1 lê sequencialmente, sem threads.
+    """
+    if 'id' not in [c.strip() for c in columns.split(',')]:
+        columns = f"id,{columns}"
+
+    def read_range(start: Optional[str], end: Optional[str]) -> Iterator[list]:
+        last = None
+        while True:
+            query = client.table(table).select(columns)
+            if where:
+                query = where(query)
+            if last:
+                query = query.gt('id', last)
+            elif start:
+                query = query.gte('id', start)
+            if end:
+                query = query.lt('id', end)
+            rows = query.order('id').limit(page_size).execute().data
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            last = rows[-1]['id']
+
+    if shards <= 1:
+        yield from read_range(None, None)
+        return
+
+    pages = queue.Queue(maxsize=shards * 2)
+    stop = threading.Event()
+
+    def emit(rows) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(rows, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker(start, end):
+        try:
+            for rows in read_range(start, end):
+                if not emit(rows):
+                    return
+            emit(_DONE)
+        except BaseException as e:
+            emit(e)
+
+    threads = [
+        threading.Thread(target=worker, args=bounds, name=f"paging-{table}-{i}", daemon=True)
+        for i, bounds in enumerate(uuid_bounds(shards))
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        running = len(threads)
+        while running:
+            item = pages.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield item
+    finally:
+        # Consumidor parou antes do fim (ou erro): libera as threads bloqueadas
+        stop.set()
+        while True:
+            try:
+                pages.get_nowait()
+            except queue.Empty:
+                break
+
+
+def fetch_all(client, table: str, columns: str, where: Optional[Callable] = None,
+              page_size: int = PAGE_SIZE, shards: int = PREFETCH_SHARDS) -> list:
+    """Todas as linhas de iter_pages numa lista."""
+    rows = []
+    for page in iter_pages(client, table, columns, where, page_size, shards):
+        rows.extend(page)
+    return rows
@@ -0,0 +1,148 @@
+"""
+Carga direta no Postgres do Supabase via COPY + merge a partir de staging.
+
+Alternativa ao PostgREST para backfills: cada chunk vai por COPY para uma
+tabela temporária de staging e entra na tabela final com um único
+INSERT ... ON CONFLICT (tenant_id, external_id) DO UPDATE. A staging é TEMP
+(some com a conexão, mesmo se o processo morrer) e ON COMMIT DELETE ROWS
+(vazia a cada transação): nenhum worker deixa tabelas no schema public.
+
+Ativado com SUPABASE_DB_URL (connection string do banco, em Settings →
+Database). Sem ela, utils.supabase continua usando o REST.
+
+Teste local:
+
+  cd sync
+  python -m utils.pg_loader "postgresql://postgres@localhost:5432/postgres"
+"""
+
+import io
+import json
+import threading
+from datetime import date, datetime
+
+import psycopg2
+from psycopg2 import sql
+
+
+def _copy_value(value) -> str:
+    """Serializa um valor no formato texto do COPY."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    elif not isinstance(value, str):
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class PgLoader:
+    """Upsert em massa por COPY numa conexão direta ao Postgres do Supabase."""
+
+    def __init__(self, dsn: str, schema: str = 'public'):
+        self.conn = psycopg2.connect(dsn)
+        self.schema = schema
+        # Uma conexão, uma transação por vez: threads do mesmo processo esperam a vez
+        self._lock = threading.Lock()
+
+    def _staging_table(self, cur, table: str) -> str:
+        # Criada (se preciso) em toda transação: vale também atrás de um pooler
+        # em modo transação, onde a sessão do servidor pode mudar entre chunks
+        staging = f"sync_stage_{table}"
+        cur.execute(sql.SQL(
+            "CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {}.{} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        ).format(sql.Identifier(staging), sql.Identifier(self.schema), sql.Identifier(table)))
+        return staging
+
+    def upsert(self, table: str, rows: list, conflict_columns=('tenant_id', 'external_id')) -> int:
+        """COPY → staging → INSERT ... ON CONFLICT DO UPDATE, numa transação. Retorna linhas gravadas."""
+        if not rows:
+            return 0
+
+        # Mesma chave duas vezes no chunk quebraria o ON CONFLICT: vale a última
+        unique_rows = {tuple(r.get(c) for c in conflict_columns): r for r in rows}
+        rows = list(unique_rows.values())
+
+        columns = list(rows[0].keys())
+        for row in rows[1:]:
+            columns.extend(c for c in row if c not in columns)
+
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_copy_value(row.get(c)) for c in columns) + '\n')
+        buffer.seek(0)
+
+        target = sql.SQL('{}.{}').format(sql.Identifier(self.schema), sql.Identifier(table))
+        column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+        updates = sql.SQL(', ').join(
+            sql.SQL('{0} = EXCLUDED.{0}').format(sql.Identifier(c))
+            for c in columns if c not in conflict_columns
+        )
+
+        with self._lock:
+            try:
+                with self.conn.cursor() as cur:
+                    staging = sql.Identifier(self._staging_table(cur, table))
+                    cur.copy_expert(
+                        sql.SQL('COPY {} ({}) FROM STDIN').format(staging, column_list).as_string(cur),
+                        buffer
+                    )
+                    cur.execute(sql.SQL(
+                        'INSERT INTO {target} ({cols}) SELECT {cols} FROM {staging} '
+                        'ON CONFLICT ({conflict}) DO UPDATE SET {updates}'
+                    ).format(
+                        target=target, cols=column_list, staging=staging,
+                        conflict=sql.SQL(', ').join(map(sql.Identifier, conflict_columns)),
+                        updates=updates,
+                    ))
+                    written = cur.rowcount
+                self.conn.commit()
+                return written
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def close(self):
+        """Fecha a conexão (as stagings temporárias somem com ela)."""
+        self.conn.close()
+
+
+def main():
+    """Teste de fumaça contra um Postgres local: cria uma tabela, faz upsert duas vezes."""
+    import sys
+
+    loader = PgLoader(sys.argv[1])
+    with loader.conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS pg_loader_smoke (
+                id SERIAL PRIMARY KEY,
+                tenant_id TEXT NOT NULL,
+                external_id BIGINT NOT NULL,
+                content TEXT,
+                metadata JSONB,
+                UNIQUE (tenant_id, external_id)
+            )
+        """)
+        cur.execute("TRUNCATE pg_loader_smoke")
+    loader.conn.commit()
+
+    rows = [{'tenant_id': 't', 'external_id': i, 'content': f"linha {i}\tcom tab\n", 'metadata': {'i': i}}
+            for i in range(10_000)]
+    print(f"inseridas: {loader.upsert('pg_loader_smoke', rows)}")
+    rows[0]['content'] = None
+    print(f"atualizadas: {loader.upsert('pg_loader_smoke', rows[:100])}")
+
+    with loader.conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*), COUNT(content) FROM pg_loader_smoke")
+        print(f"total, com content: {cur.fetchone()}")
+        cur.execute("DROP TABLE pg_loader_smoke")
+    loader.conn.commit()
+    loader.close()
+
+
+if __name__ == '__main__':
+    main()
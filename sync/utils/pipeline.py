@@ -0,0 +1,105 @@
+"""
+Pipeline extract → transform → load com filas limitadas.
+
+Cada estágio roda numa thread própria e passa o resultado adiante por uma
+fila de tamanho `depth`: enquanto uma página é gravada no Supabase, as
+próximas já estão sendo lidas do Neon e transformadas. Quando o load fica
+para trás, as filas enchem e a leitura espera (backpressure), então a
+memória fica limitada a poucas páginas por estágio.
+
+O último estágio (load) é quem consome o gerador, na thread de quem chama:
+a ordem das páginas é preservada e o checkpoint pode avançar a cada item.
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+import queue
+import threading
+from typing import Callable, Iterable, Iterator
+
+# Páginas prontas esperando o estágio seguinte
+PIPELINE_DEPTH = 2
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def pipelined(source: Iterable, *stages: Callable, depth: int = PIPELINE_DEPTH) -> Iterator:
+    """
+    Itera `source` numa thread, aplica cada função de `stages` em outra thread
+    por estágio e entrega os resultados em ordem. Erro em qualquer estágio sobe
+    para quem consome; parar de consumir encerra as threads.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=depth) for _ in range(len(stages) + 1)]
+
+    def put(q: queue.Queue, item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q: queue.Queue):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def extract():
+        try:
+            for item in source:
+                if not put(queues[0], item):
+                    return
+            put(queues[0], _DONE)
+        except BaseException as e:
+            put(queues[0], _Failure(e))
+        finally:
+            # Gerador interrompido: roda o finally dele aqui (ex.: cancelar um COPY)
+            close = getattr(source, 'close', None)
+            if close is not None:
+                close()
+
+    def stage(fn: Callable, inbox: queue.Queue, outbox: queue.Queue):
+        while True:
+            item = get(inbox)
+            if item is _DONE or isinstance(item, _Failure):
+                put(outbox, item)
+                return
+            try:
+                result = fn(item)
+            except BaseException as e:
+                put(outbox, _Failure(e))
+                return
+            if not put(outbox, result):
+                return
+
+    threads = [threading.Thread(target=extract, name="pipeline-extract", daemon=True)]
+    threads += [
+        threading.Thread(target=stage, args=(fn, queues[i], queues[i + 1]), name=f"pipeline-stage-{i}", daemon=True)
+        for i, fn in enumerate(stages)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # Consumidor parou (fim, erro ou break): libera as threads bloqueadas
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=5)
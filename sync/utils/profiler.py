@@ -0,0 +1,168 @@
+"""
+Perfil de volume do Neon a partir do catálogo do Postgres.
+
+`COUNT(*)` em cada tabela lê a tabela inteira (minutos nas tabelas grandes e
+uma conexão do pooler presa o tempo todo). Aqui o volume vem de
+pg_class.reltuples (estimativa do último ANALYZE), pg_stat_user_tables
+(linhas vivas/mortas, scans, último vacuum/analyze) e dos tamanhos de tabela
+e índice: duas queries no catálogo, resposta em milissegundos.
+
+Contagens exatas só quando pedidas: cada tabela numa conexão própria, em
+paralelo, com statement_timeout (SET LOCAL, compatível com o pooler em modo
+transação). Tabela que estoura o tempo fica marcada, sem travar as outras.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+
+EXACT_TIMEOUT_MS = 5000
+EXACT_WORKERS = 4
+
+TABLES_QUERY = """
+    SELECT
+        c.relname AS "table",
+        CASE WHEN c.reltuples < 0 THEN NULL ELSE c.reltuples::bigint END AS estimated_rows,
+        s.n_live_tup AS live_rows,
+        s.n_dead_tup AS dead_rows,
+        pg_table_size(c.oid) AS table_bytes,
+        pg_indexes_size(c.oid) AS index_bytes,
+        pg_total_relation_size(c.oid) AS total_bytes,
+        s.seq_scan,
+        s.idx_scan,
+        GREATEST(s.last_analyze, s.last_autoanalyze) AS last_analyze,
+        GREATEST(s.last_vacuum, s.last_autovacuum) AS last_vacuum
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE n.nspname = %s AND c.relkind IN ('r', 'p')
+    ORDER BY pg_total_relation_size(c.oid) DESC
+"""
+
+INDEXES_QUERY = """
+    SELECT
+        s.relname AS "table",
+        s.indexrelname AS "index",
+        pg_relation_size(s.indexrelid) AS bytes,
+        s.idx_scan AS scans
+    FROM pg_stat_user_indexes s
+    WHERE s.schemaname = %s
+    ORDER BY pg_relation_size(s.indexrelid) DESC
+"""
+
+
+def _jsonable(row: dict) -> dict:
+    return {k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()}
+
+
+def catalog_profile(conn, schema: str = 'public') -> dict:
+    """Volume e tamanhos de todas as tabelas e índices do schema, só pelo catálogo."""
+    started = time.monotonic()
+    with conn.cursor() as cur:
+        cur.execute(TABLES_QUERY, (schema,))
+        tables = [_jsonable(dict(r)) for r in cur.fetchall()]
+        cur.execute(INDEXES_QUERY, (schema,))
+        indexes = [_jsonable(dict(r)) for r in cur.fetchall()]
+    conn.rollback()
+
+    for table in tables:
+        # Tabela nunca analisada: reltuples = -1, usa o contador de linhas vivas
+        if table['estimated_rows'] is None:
+            table['estimated_rows'] = table['live_rows']
+
+    return {
+        'generated_at': datetime.utcnow().isoformat(),
+        'schema': schema,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+        'tables': tables,
+        'indexes': indexes,
+    }
+
+
+def exact_count(connect, table: str, schema: str = 'public', timeout_ms: int = EXACT_TIMEOUT_MS) -> dict:
+    """COUNT(*) numa conexão própria, com statement_timeout. Retorna linhas, tempo e status."""
+    started = time.monotonic()
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+            cur.execute(sql.SQL("SELECT COUNT(*) AS count FROM {}.{}").format(
+                sql.Identifier(schema), sql.Identifier(table)
+            ))
+            rows, status = cur.fetchone()['count'], 'ok'
+    except psycopg2.extensions.QueryCanceledError:
+        rows, status = None, 'timeout'
+    except psycopg2.Error as e:
+        rows, status = None, f"erro: {str(e).strip()[:120]}"
+    finally:
+        conn.close()
+    return {'rows': rows, 'status': status, 'elapsed_ms': round((time.monotonic() - started) * 1000, 1)}
+
+
+def exact_counts(connect, tables: list, schema: str = 'public', timeout_ms: int = EXACT_TIMEOUT_MS,
+                 workers: int = EXACT_WORKERS) -> dict:
+    """Contagens exatas em paralelo (uma conexão por tabela em andamento)."""
+    if not tables:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(workers, len(tables))) as pool:
+        futures = {table: pool.submit(exact_count, connect, table, schema, timeout_ms) for table in tables}
+        return {table: future.result() for table, future in futures.items()}
+
+
+def build_report(conn, connect=None, exact: list = None, schema: str = 'public',
+                 timeout_ms: int = EXACT_TIMEOUT_MS, workers: int = EXACT_WORKERS) -> dict:
+    """Perfil do catálogo + contagens exatas das tabelas pedidas (exact=['*'] = todas)."""
+    report = catalog_profile(conn, schema)
+    if exact:
+        names = [t['table'] for t in report['tables']]
+        wanted = names if '*' in exact else [t for t in exact if t in names]
+        counts = exact_counts(connect, wanted, schema, timeout_ms, workers)
+        for table in report['tables']:
+            if table['table'] in counts:
+                table['exact'] = counts[table['table']]
+    return report
+
+
+def save_report(report: dict, path: str) -> str:
+    """Grava o relatório em JSON (cria o diretório se preciso)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    return path
+
+
+def format_bytes(value) -> str:
+    if value is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if value < 1024:
+            return f"{value:.0f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TB"
+
+
+def print_report(report: dict):
+    """Tabela resumida do relatório no console."""
+    print(f"\n   {'tabela':32} {'linhas (est.)':>14} {'exato':>14} {'mortas':>10} {'dados':>10} {'índices':>10}")
+    print("   " + "-" * 94)
+    for t in report['tables']:
+        exact = t.get('exact')
+        if exact is None:
+            exact_text = ''
+        elif exact['status'] == 'ok':
+            exact_text = f"{exact['rows']:,}"
+        else:
+            exact_text = exact['status'][:14]
+        estimated = f"{t['estimated_rows']:,}" if t['estimated_rows'] is not None else '-'
+        dead = f"{t['dead_rows']:,}" if t['dead_rows'] is not None else '-'
+        print(f"   {t['table'][:32]:32} {estimated:>14} {exact_text:>14} {dead:>10} "
+              f"{format_bytes(t['table_bytes']):>10} {format_bytes(t['index_bytes']):>10}")
+    print(f"\n   ⏱️  Catálogo lido em {report['elapsed_ms']} ms")
@@ -0,0 +1,224 @@
+"""
+Controle adaptativo (AIMD) da taxa de escrita no Supabase.
+
+Cada requisição passa por AimdController.execute, que mede a latência e
+classifica os erros. Enquanto o Supabase responde rápido, o tamanho do batch
+e a concorrência crescem em passos fixos e a pausa entre batches diminui;
+com 429/5xx/timeout (ou latência acima do alvo), tudo é cortado pela metade
+e as próximas requisições esperam um cooldown. O estado atual aparece nos logs.
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+# Latência alvo por batch: acima dela (média móvel) o batch encolhe
+TARGET_LATENCY = 2.0
+LATENCY_SMOOTHING = 0.3
+
+# Aumento aditivo / corte multiplicativo
+BATCH_STEP = 50
+PAUSE_STEP = 0.05
+DECREASE_FACTOR = 0.5
+CONCURRENCY_EVERY = 20      # Sucessos seguidos para ganhar +1 de concorrência
+MIN_BACKOFF = 1.0
+MAX_PAUSE = 60.0
+
+MAX_RETRIES = 5
+LOG_EVERY = 50              # Sucessos entre logs de estado
+
+# SQLSTATE de statement timeout (canceling statement due to statement timeout)
+STATEMENT_TIMEOUT_CODE = '57014'
+
+
+def error_code(error: Exception):
+    """
+    Código do erro: SQLSTATE/PGRST do PostgREST (APIError.code, WriteError.code)
+    ou do psycopg2 (pgcode). None se o erro não trouxer código.
+    """
+    code = getattr(error, 'code', None) or getattr(error, 'pgcode', None)
+    return str(code) if code is not None else None
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """
+    True para erros de sobrecarga (429, 5xx, timeout, conexão caída): vale retry
+    mais devagar. Decide só pelo status HTTP, pelo SQLSTATE e pelo tipo da
+    exceção: o texto do erro pode trazer a linha recusada ("Failing row
+    contains ..."), que não diz nada sobre a carga do servidor.
+    """
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+
+    name = type(error).__name__.lower()
+    if 'timeout' in name or 'connect' in name or 'protocol' in name or name == 'operationalerror':
+        return True  # httpx.ReadTimeout, ConnectError, RemoteProtocolError, conexão do psycopg2 caída...
+
+    # postgrest.APIError: 57014 = statement timeout; sem JSON na resposta, o código é o status HTTP
+    code = error_code(error)
+    if code == STATEMENT_TIMEOUT_CODE:
+        return True
+    return code is not None and code.isdigit() and len(code) == 3 and (code == '429' or code.startswith('5'))
+
+
+class AimdController:
+    """Tamanho de batch, concorrência e pausa ajustados pelas respostas do Supabase."""
+
+    def __init__(self, name: str, batch_size: int = 500, min_batch: int = 50, max_batch: int = 2000,
+                 concurrency: int = 1, max_concurrency: int = 4, pause: float = 0.3,
+                 target_latency: float = TARGET_LATENCY):
+        self.name = name
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+
+        self._batch_size = batch_size
+        self._concurrency = min(concurrency, max_concurrency)
+        self._pause = pause
+        self._latency = None
+        self._cooldown_until = 0.0
+        self._in_flight = 0
+        self._successes = 0
+        self._streak = 0
+        self._throttles = 0
+        self._cond = threading.Condition()
+
+    # --------------------------------------------------------
+    # Estado
+    # --------------------------------------------------------
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size
+
+    @property
+    def concurrency(self) -> int:
+        return self._concurrency
+
+    @property
+    def pause(self) -> float:
+        return self._pause
+
+    def state(self) -> dict:
+        return {
+            'batch_size': self._batch_size,
+            'concurrency': self._concurrency,
+            'pause': round(self._pause, 2),
+            'latency': round(self._latency, 2) if self._latency is not None else None,
+            'successes': self._successes,
+            'throttles': self._throttles,
+        }
+
+    def cooldown_remaining(self) -> float:
+        """Segundos até o fim do cooldown aberto pelo último throttle."""
+        return max(0.0, self._cooldown_until - time.monotonic())
+
+    def describe(self) -> str:
+        latency = f"{self._latency:.2f}s" if self._latency is not None else "-"
+        return (f"{self.name}: batch {self._batch_size} · concorrência {self._concurrency} · "
+                f"pausa {self._pause:.2f}s · latência {latency} "
+                f"({self._successes} ok, {self._throttles} throttles)")
+
+    # --------------------------------------------------------
+    # Ajuste
+    # --------------------------------------------------------
+    def set_max_concurrency(self, max_concurrency: int):
+        """Novo teto de concorrência (ex.: fatia de um tenant no fan-out)."""
+        with self._cond:
+            self.max_concurrency = max(1, max_concurrency)
+            self._concurrency = min(self._concurrency, self.max_concurrency)
+            self._cond.notify_all()
+
+    def record_success(self, latency: float):
+        with self._cond:
+            self._successes += 1
+            self._latency = latency if self._latency is None else \
+                LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self._latency
+
+            if self._latency > self.target_latency:
+                # Lento mas sem erro: só o batch encolhe
+                self._batch_size = max(self.min_batch, int(self._batch_size * DECREASE_FACTOR))
+                self._latency = None  # recomeça a média com o batch novo
+                self._streak = 0
+                print(f"   🐢 {self.describe()}")
+                return
+
+            self._batch_size = min(self.max_batch, self._batch_size + BATCH_STEP)
+            self._pause = max(0.0, self._pause - PAUSE_STEP)
+            self._streak += 1
+            if self._streak % CONCURRENCY_EVERY == 0 and self._concurrency < self.max_concurrency:
+                self._concurrency += 1
+                self._cond.notify_all()
+
+            if self._successes % LOG_EVERY == 0:
+                print(f"   🎚️  {self.describe()}")
+
+    def record_throttle(self, error: Exception) -> float:
+        """Corte multiplicativo + cooldown compartilhado. Retorna a espera aplicada."""
+        with self._cond:
+            self._throttles += 1
+            self._streak = 0
+            self._batch_size = max(self.min_batch, int(self._batch_size * DECREASE_FACTOR))
+            self._concurrency = max(1, int(self._concurrency * DECREASE_FACTOR))
+            self._pause = min(MAX_PAUSE, max(MIN_BACKOFF, self._pause * 2))
+            self._cooldown_until = time.monotonic() + self._pause
+            print(f"   🚦 {self.describe()} ← {str(error)[:80]}")
+            return self._pause
+
+    # --------------------------------------------------------
+    # Uso
+    # --------------------------------------------------------
+    @contextmanager
+    def slot(self):
+        """Limita as requisições simultâneas à concorrência atual e respeita o cooldown."""
+        with self._cond:
+            while self._in_flight >= self._concurrency:
+                self._cond.wait()
+            self._in_flight += 1
+        try:
+            wait = self.cooldown_remaining()
+            if wait > 0:
+                time.sleep(wait)
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def execute(self, write, retries: int = MAX_RETRIES):
+        """
+        Executa write() (uma requisição) dentro de um slot, medindo a latência.
+        Erros de sobrecarga reduzem a taxa e são tentados de novo; os demais
+        (ex.: coluna inexistente) sobem direto, pois repetir não resolve.
+        """
+        for attempt in range(retries):
+            with self.slot():
+                started = time.monotonic()
+                try:
+                    result = write()
+                except Exception as e:
+                    if attempt == retries - 1 or not is_throttle_error(e):
+                        raise
+                    self.record_throttle(e)
+                    print(f"   ⚠️  Retry {attempt + 1}/{retries - 1} em {self._pause:.1f}s")
+                    continue
+            self.record_success(time.monotonic() - started)
+            return result
+
+    def batches(self, rows: list):
+        """Fatia rows com o tamanho de batch vigente a cada fatia."""
+        start = 0
+        while start < len(rows):
+            size = self._batch_size
+            yield rows[start:start + size]
+            start += size
+
+    def wait(self):
+        """Pausa entre batches sequenciais (some enquanto o Supabase aguenta)."""
+        if self._pause > 0:
+            time.sleep(self._pause)
@@ -0,0 +1,122 @@
+"""
+Recursos residentes de um container do Modal.
+
+Os jobs agendados rodam várias vezes no mesmo container enquanto ele está
+quente. Pool de conexões do Neon, client do Supabase (sessão HTTP keep-alive)
+e tenant são montados uma vez no @modal.enter() e cada execução só pega uma
+conexão emprestada do pool.
+
+Só depende de psycopg2 e supabase (sem dotenv), para poder ser montado nas
+imagens do Modal.
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import RealDictCursor
+
+from .tenants import DEFAULT_TENANT_SLUG, get_tenant
+
+NEON_POOL_MIN = 1
+NEON_POOL_MAX = int(os.getenv('NEON_POOL_MAX', '4'))
+
+# Conexão parada há mais tempo que isso é testada (SELECT 1) antes de ser
+# entregue: o pooler do Neon derruba conexões ociosas entre os runs
+HEALTH_CHECK_AFTER = 60.0
+
+
+def neon_params() -> dict:
+    """Parâmetros de conexão do Neon a partir das variáveis de ambiente."""
+    return dict(
+        host=os.environ['NEON_HOST'],
+        database=os.environ['NEON_DATABASE'],
+        user=os.environ['NEON_USER'],
+        password=os.environ['NEON_PASSWORD'],
+        sslmode='require',
+        cursor_factory=RealDictCursor,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=3,
+    )
+
+
+class NeonPool:
+    """Pool de conexões do Neon com teste de saúde na retirada."""
+
+    def __init__(self, minconn: int = NEON_POOL_MIN, maxconn: int = NEON_POOL_MAX, **overrides):
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **{**neon_params(), **overrides})
+        self._returned_at = {}  # id(conn) → quando voltou ao pool
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        conn = self._pool.getconn()
+        with self._lock:
+            idle = time.monotonic() - self._returned_at.pop(id(conn), time.monotonic())
+        if conn.closed or (idle > HEALTH_CHECK_AFTER and not self._alive(conn)):
+            # Conexão morta: descarta e abre outra
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        return conn
+
+    @staticmethod
+    def _alive(conn) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão; devolve ao pool (sem transação aberta) ao sair."""
+        conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if not broken and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            with self._lock:
+                self._returned_at[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def close(self):
+        self._pool.closeall()
+
+
+class ContainerRuntime:
+    """Pool do Neon, client do Supabase e tenant (registro), criados uma vez por container."""
+
+    def __init__(self, tenant_slug: str = DEFAULT_TENANT_SLUG, pool_max: int = NEON_POOL_MAX):
+        from supabase import create_client
+
+        self.neon = NeonPool(maxconn=pool_max)
+        self.supabase = create_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_SERVICE_KEY'])
+        self.tenant = get_tenant(self.supabase, tenant_slug)
+        self.tenant_id = self.tenant.id
+        self.runs = 0
+        print(f"   🔌 Container pronto (tenant {self.tenant.slug} {self.tenant_id[:8]}..., "
+              f"Neon #{self.tenant.neon_tenant_id}, pool até {pool_max} conexões)")
+
+    def start_run(self) -> int:
+        """Conta a execução; a partir da segunda o container já estava quente."""
+        self.runs += 1
+        if self.runs > 1:
+            print(f"   ♨️  Container quente (execução #{self.runs})")
+        return self.runs
+
+    def close(self):
+        self.neon.close()
@@ -3,17 +3,35 @@ Supabase Utils - Versão com Rate Limiting e Retry
 """
 
 import os
-import time
+import threading
+from datetime import datetime
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+from . import dead_letter
+from .attachments import parse_message_content
+from .id_cache import IdMapCache, native_key
+from .keys import message_key
+from .neon import fetch_by_ids
+from .paging import fetch_all
+from .rate import AimdController
+
 load_dotenv()
 
-# Rate limiting
-BATCH_SIZE = 500
-DELAY_BETWEEN_BATCHES = 0.3
-MAX_RETRIES = 5
-RETRY_DELAY = 3
+# Rate limiting adaptativo: batch, concorrência e pausa partem destes valores
+# e se ajustam às respostas do Supabase (ver utils/rate.py)
+write_rate = AimdController('supabase', batch_size=500, pause=0.3)
+
+# Carga direta por COPY (opcional): connection string do Postgres do Supabase
+SUPABASE_DB_URL = os.getenv('SUPABASE_DB_URL')
+COPY_BATCH_SIZE = 5000
+
+# external_ids por query `external_id=in.(...)` (limite prático de URL)
+LOOKUP_CHUNK = 200
+
+_pg_loader = None
+_writer = None
+_shared_lock = threading.Lock()  # Threads do backfill criam o loader/writer uma vez só
 
 
 def get_supabase_client() -> Client:
@@ -31,70 +49,110 @@ def get_tenant_id(client: Client, slug: str = 'indaia') -> str:
 
 
 def fetch_all_paginated(client: Client, table: str, columns: str, tenant_id: str) -> list:
-    """Busca TODOS os registros de uma tabela usando paginação."""
-    all_data = []
-    page_size = 1000
-    offset = 0
-    
-    while True:
-        result = client.table(table)\
-            .select(columns)\
-            .eq('tenant_id', tenant_id)\
-            .range(offset, offset + page_size - 1)\
-            .execute()
-        
-        if not result.data:
-            break
-            
-        all_data.extend(result.data)
-        
-        if len(result.data) < page_size:
-            break
-            
-        offset += page_size
-        time.sleep(0.1)  # Pequeno delay entre páginas
-    
-    return all_data
+    """Busca TODOS os registros do tenant (keyset por id, páginas em paralelo)."""
+    return fetch_all(client, table, columns, where=lambda query: query.eq('tenant_id', tenant_id))
+
+
+def get_pg_loader():
+    """PgLoader compartilhado se SUPABASE_DB_URL estiver configurada (None = só REST)."""
+    global _pg_loader
+    with _shared_lock:
+        if _pg_loader is None and SUPABASE_DB_URL:
+            try:
+                from .pg_loader import PgLoader
+                _pg_loader = PgLoader(SUPABASE_DB_URL)
+                print("   🚚 Carga direta via COPY ativada")
+            except Exception as e:
+                print(f"   ⚠️  Sem conexão direta ao Postgres ({str(e)[:80]}), usando REST")
+                _pg_loader = False
+    return _pg_loader or None
+
+
+def get_writer(client: Client):
+    """PostgrestWriter compartilhado (None se não puder ser criado: usa o client síncrono)."""
+    global _writer
+    with _shared_lock:
+        if _writer is None:
+            try:
+                from .writer import PostgrestWriter
+                _writer = PostgrestWriter(client.supabase_url, client.supabase_key, write_rate)
+            except Exception as e:
+                print(f"   ⚠️  Writer assíncrono indisponível ({str(e)[:80]}), usando client síncrono")
+                _writer = False
+    return _writer or None
 
 
 def upsert_with_retry(client: Client, table: str, data: list, on_conflict: str) -> bool:
-    """Insere dados com retry exponencial."""
-    delay = RETRY_DELAY
-    
-    for attempt in range(MAX_RETRIES):
+    """
+    Grava data inteiro: via COPY (se ativado) ou pelo writer assíncrono, que
+    divide em batches adaptativos e mantém vários em voo. Retry em 429/5xx/timeout.
+    Lote recusado por erro de dados é dividido até isolar as linhas ruins, que
+    vão para sync_dead_letters (utils/dead_letter.py); o resto é gravado.
+    """
+    loader = get_pg_loader()
+    if loader:
         try:
-            client.table(table).upsert(
-                data,
-                on_conflict=on_conflict
-            ).execute()
+            for i in range(0, len(data), COPY_BATCH_SIZE):
+                loader.upsert(table, data[i:i+COPY_BATCH_SIZE], tuple(on_conflict.split(',')))
             return True
         except Exception as e:
-            if attempt < MAX_RETRIES - 1:
-                print(f"\n   ⚠️  Retry {attempt + 1}/{MAX_RETRIES}: {str(e)[:80]}...")
-                time.sleep(delay)
-                delay *= 2
-            else:
-                raise e
-    return False
+            print(f"\n   ⚠️  COPY falhou em {table}, usando REST: {str(e)[:80]}...")
+    
+    write = rest_writer(client, table, on_conflict)
+    writer = get_writer(client)
+    if writer:
+        written, failures = writer.upsert(table, data, on_conflict)
+        for start, size, error in failures:
+            dead_letter.settle(client, write, table, data[start:start + size], error, on_conflict)
+        return True
+    
+    for batch in write_rate.batches(data):
+        try:
+            write(batch)
+        except Exception as e:
+            dead_letter.settle(client, write, table, batch, e, on_conflict)
+        write_rate.wait()
+    return True
 
 
-def upsert_agents(client: Client, tenant_id: str, users: list):
-    """Insere ou atualiza atendentes (users → agents)."""
-    data = [{
+def rest_writer(client: Client, table: str, on_conflict: str):
+    """Função que grava um lote pelo REST (writer assíncrono ou client) e levanta se falhar."""
+    writer = get_writer(client)
+    
+    def write(rows: list):
+        if writer:
+            _, failures = writer.upsert(table, rows, on_conflict)
+            if failures:
+                raise failures[0][2]
+            return
+        write_rate.execute(lambda: client.table(table).upsert(rows, on_conflict=on_conflict).execute())
+    
+    return write
+
+
+def prepare_agents(tenant_id: str, users: list) -> list:
+    """Transforma users do Neon em linhas de agents."""
+    return [{
         'tenant_id': tenant_id,
         'external_id': u['id'],
         'name': u['name'] or f"User {u['id']}",
         'email': u.get('email'),
         'role': u.get('role'),
         'active': u.get('active', True),
-        'avatar_url': u.get('avatar_url')
+        'avatar_url': u.get('avatar_url'),
+        'synced_at': datetime.utcnow().isoformat()
     } for u in users]
-    
+
+
+def upsert_agents(client: Client, tenant_id: str, users: list):
+    """Insere ou atualiza atendentes (users → agents)."""
+    data = prepare_agents(tenant_id, users)
     return upsert_with_retry(client, 'agents', data, 'tenant_id,external_id')
 
 
-def upsert_contacts(client: Client, tenant_id: str, leads: list):
-    """Insere ou atualiza contatos (leads → contacts)."""
+def prepare_contacts(tenant_id: str, leads: list) -> list:
+    """Transforma leads do Neon em linhas de contacts."""
+    synced_at = datetime.utcnow().isoformat()
     data = []
     for lead in leads:
         contact = {
@@ -111,33 +169,36 @@ def upsert_contacts(client: Client, tenant_id: str, leads: list):
                 'utm_source': lead.get('utm_source'),
                 'utm_medium': lead.get('utm_medium'),
                 'utm_campaign': lead.get('utm_campaign'),
-            }
+            },
+            'synced_at': synced_at
         }
         data.append(contact)
     
-    # Inserir em batches com delay
-    for i in range(0, len(data), BATCH_SIZE):
-        batch = data[i:i+BATCH_SIZE]
-        upsert_with_retry(client, 'contacts', batch, 'tenant_id,external_id')
-        time.sleep(DELAY_BETWEEN_BATCHES)
+    return data
+
+
+def upsert_contacts(client: Client, tenant_id: str, leads: list):
+    """Insere ou atualiza contatos (leads → contacts)."""
+    data = prepare_contacts(tenant_id, leads)
+    
+    upsert_with_retry(client, 'contacts', data, 'tenant_id,external_id')
     
     return len(data)
 
 
-def get_contact_uuid_map(client: Client, tenant_id: str) -> dict:
-    """Retorna mapeamento COMPLETO external_id → UUID dos contatos."""
-    all_contacts = fetch_all_paginated(client, 'contacts', 'id,external_id', tenant_id)
-    return {c['external_id']: c['id'] for c in all_contacts}
+def get_contact_uuid_map(client: Client, tenant_id: str, cache: IdMapCache = None) -> dict:
+    """Retorna mapeamento COMPLETO external_id → UUID dos contatos (via cache incremental)."""
+    return (cache or IdMapCache()).get_map(client, tenant_id, 'contacts')
 
 
-def get_agent_uuid_map(client: Client, tenant_id: str) -> dict:
-    """Retorna mapeamento external_id → UUID dos atendentes."""
-    all_agents = fetch_all_paginated(client, 'agents', 'id,external_id', tenant_id)
-    return {a['external_id']: a['id'] for a in all_agents}
+def get_agent_uuid_map(client: Client, tenant_id: str, cache: IdMapCache = None) -> dict:
+    """Retorna mapeamento external_id → UUID dos atendentes (via cache incremental)."""
+    return (cache or IdMapCache()).get_map(client, tenant_id, 'agents')
 
 
-def upsert_conversations(client: Client, tenant_id: str, conversations: list, contact_map: dict, agent_map: dict):
-    """Insere ou atualiza conversas."""
+def prepare_conversations(tenant_id: str, conversations: list, contact_map: dict, agent_map: dict) -> list:
+    """Transforma conversas do Neon em linhas do Supabase."""
+    synced_at = datetime.utcnow().isoformat()
     data = []
     for c in conversations:
         conv = {
@@ -152,7 +213,8 @@ def upsert_conversations(client: Client, tenant_id: str, conversations: list, co
                 'team_id': c.get('team_id'),
                 'folder_id': c.get('folder_id'),
                 'is_bot': c.get('is_bot')
-            }
+            },
+            'synced_at': synced_at
         }
         
         # Mapear lead_id → contact_id
@@ -165,24 +227,25 @@ def upsert_conversations(client: Client, tenant_id: str, conversations: list, co
         
         data.append(conv)
     
-    # Inserir em batches com delay
-    for i in range(0, len(data), BATCH_SIZE):
-        batch = data[i:i+BATCH_SIZE]
-        upsert_with_retry(client, 'conversations', batch, 'tenant_id,external_id')
-        time.sleep(DELAY_BETWEEN_BATCHES)
+    return data
+
+
+def upsert_conversations(client: Client, tenant_id: str, conversations: list, contact_map: dict, agent_map: dict):
+    """Insere ou atualiza conversas."""
+    data = prepare_conversations(tenant_id, conversations, contact_map, agent_map)
+    
+    upsert_with_retry(client, 'conversations', data, 'tenant_id,external_id')
     
     return len(data)
 
 
-def get_conversation_uuid_map(client: Client, tenant_id: str) -> dict:
-    """Retorna mapeamento COMPLETO external_id → UUID das conversas."""
-    all_conversations = fetch_all_paginated(client, 'conversations', 'id,external_id', tenant_id)
-    return {c['external_id']: c['id'] for c in all_conversations}
+def get_conversation_uuid_map(client: Client, tenant_id: str, cache: IdMapCache = None) -> dict:
+    """Retorna mapeamento COMPLETO external_id → UUID das conversas (via cache incremental)."""
+    return (cache or IdMapCache()).get_map(client, tenant_id, 'conversations')
 
 
-def insert_messages_batch(client: Client, tenant_id: str, messages: list, 
-                          conv_map: dict, contact_map: dict, agent_map: dict):
-    """Insere mensagens em batch."""
+def prepare_messages(tenant_id: str, messages: list, conv_map: dict, contact_map: dict, agent_map: dict):
+    """Transforma mensagens do Neon em linhas do Supabase. Retorna (linhas, ignoradas)."""
     data = []
     skipped = 0
     
@@ -205,7 +268,7 @@ def insert_messages_batch(client: Client, tenant_id: str, messages: list,
         
         msg = {
             'tenant_id': tenant_id,
-            'external_id': m['id'],
+            'external_id': message_key(m),
             'conversation_id': conv_map[m['conversation_id']],
             'content': m.get('content'),
             'content_type': m.get('content_type'),
@@ -217,7 +280,8 @@ def insert_messages_batch(client: Client, tenant_id: str, messages: list,
                 'transcricao': m.get('transcricao'),
                 'platform': m.get('platform'),
                 'inbox_id': m.get('inbox_id')
-            }
+            },
+            **parse_message_content(m.get('content')),
         }
         
         # Mapear lead_id → contact_id
@@ -230,13 +294,81 @@ def insert_messages_batch(client: Client, tenant_id: str, messages: list,
         
         data.append(msg)
     
+    return data, skipped
+
+
+def lookup_ids(client: Client, tenant_id: str, table: str, external_ids, id_map: dict):
+    """Acrescenta ao mapa (in place) os UUIDs dos external_ids que ainda faltam."""
+    pending = sorted({str(e) for e in external_ids if e is not None and e not in id_map})
+    for i in range(0, len(pending), LOOKUP_CHUNK):
+        result = client.table(table)\
+            .select('id,external_id')\
+            .eq('tenant_id', tenant_id)\
+            .in_('external_id', pending[i:i + LOOKUP_CHUNK])\
+            .execute()
+        for item in result.data or []:
+            id_map[native_key(str(item['external_id']))] = item['id']
+
+
+def fill_missing_parents(client: Client, neon_conn, tenant_id: str, messages: list,
+                         conv_map: dict, contact_map: dict, agent_map: dict, neon_tenant_id=None) -> dict:
+    """
+    Conversas (e leads/atendentes) que as mensagens referenciam mas não estão
+    nos mapas: busca no Neon com uma query por tabela, grava os pais antes das
+    mensagens e atualiza os mapas in place. Retorna {tabela: linhas gravadas}.
+    """
+    missing = {m['conversation_id'] for m in messages
+               if m.get('conversation_id') and m['conversation_id'] not in conv_map}
+    if not missing:
+        return {}
+    
+    # Pode já estar no Supabase (mapa desatualizado)
+    lookup_ids(client, tenant_id, 'conversations', missing, conv_map)
+    conversations = fetch_by_ids(neon_conn, 'conversations', missing - conv_map.keys(), neon_tenant_id)
+    
+    rows = conversations + messages
+    lead_ids = {r['lead_id'] for r in rows if r.get('lead_id')}
+    user_ids = {r['user_id'] for r in rows if r.get('user_id')}
+    lookup_ids(client, tenant_id, 'contacts', lead_ids - contact_map.keys(), contact_map)
+    lookup_ids(client, tenant_id, 'agents', user_ids - agent_map.keys(), agent_map)
+    leads = fetch_by_ids(neon_conn, 'contacts', lead_ids - contact_map.keys(), neon_tenant_id)
+    users = fetch_by_ids(neon_conn, 'agents', user_ids - agent_map.keys())
+    
+    # Pais antes dos filhos: agents/contacts → conversations
+    if users:
+        upsert_with_retry(client, 'agents', prepare_agents(tenant_id, users), 'tenant_id,external_id')
+        lookup_ids(client, tenant_id, 'agents', [u['id'] for u in users], agent_map)
+    if leads:
+        upsert_with_retry(client, 'contacts', prepare_contacts(tenant_id, leads), 'tenant_id,external_id')
+        lookup_ids(client, tenant_id, 'contacts', [l['id'] for l in leads], contact_map)
+    if conversations:
+        data = prepare_conversations(tenant_id, conversations, contact_map, agent_map)
+        upsert_with_retry(client, 'conversations', data, 'tenant_id,external_id')
+        lookup_ids(client, tenant_id, 'conversations', [c['id'] for c in conversations], conv_map)
+    
+    written = {'agents': len(users), 'contacts': len(leads), 'conversations': len(conversations)}
+    if any(written.values()):
+        print(f"   🧩 Pais buscados no Neon: {written['conversations']} conversas, "
+              f"{written['contacts']} contatos, {written['agents']} atendentes")
+    return written
+
+
+def insert_messages_batch(client: Client, tenant_id: str, messages: list, 
+                          conv_map: dict, contact_map: dict, agent_map: dict,
+                          neon_conn=None, neon_tenant_id=None):
+    """
+    Insere mensagens em batch. Com neon_conn, conversas ausentes dos mapas são
+    buscadas no Neon e gravadas antes (em vez de as mensagens serem puladas).
+    """
+    if neon_conn is not None:
+        fill_missing_parents(client, neon_conn, tenant_id, messages, conv_map, contact_map, agent_map, neon_tenant_id)
+    
+    data, skipped = prepare_messages(tenant_id, messages, conv_map, contact_map, agent_map)
+    
     if not data:
         return 0, skipped
     
-    # Inserir em batches menores com delay
-    for i in range(0, len(data), BATCH_SIZE):
-        batch = data[i:i+BATCH_SIZE]
-        upsert_with_retry(client, 'messages', batch, 'tenant_id,external_id')
-        time.sleep(DELAY_BETWEEN_BATCHES)
+    # Batches adaptativos, vários em voo (ver upsert_with_retry)
+    upsert_with_retry(client, 'messages', data, 'tenant_id,external_id')
     
     return len(data), skipped
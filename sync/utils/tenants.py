@@ -0,0 +1,64 @@
+"""
+Registro de tenants: UUID no Supabase ↔ tenant_id (integer) no Neon.
+
+A fonte é a coluna tenants.neon_tenant_id (ver sync_worker_setup.sql): todo
+tenant com neon_tenant_id preenchido entra no sync. Enquanto a coluna não
+existir, vale o mapeamento legado (só o tenant 'indaia' → 1).
+
+Este módulo só usa a stdlib, para poder ser montado nas imagens do Modal.
+"""
+
+import os
+from typing import NamedTuple, Optional
+
+DEFAULT_TENANT_SLUG = 'indaia'
+
+# Mapeamento usado antes do registro existir
+LEGACY_NEON_IDS = {DEFAULT_TENANT_SLUG: 1}
+
+
+class Tenant(NamedTuple):
+    id: str               # UUID no Supabase
+    slug: str
+    neon_tenant_id: int   # tenant_id nas tabelas do Neon
+
+
+def load_tenants(supabase, slugs: Optional[list] = None) -> list:
+    """Tenants com neon_tenant_id (opcionalmente só os slugs pedidos), ordenados por slug."""
+    try:
+        query = supabase.table('tenants')\
+            .select('id,slug,neon_tenant_id')\
+            .not_.is_('neon_tenant_id', 'null')
+        if slugs:
+            query = query.in_('slug', list(slugs))
+        rows = query.order('slug').execute().data
+        return [Tenant(r['id'], r['slug'], int(r['neon_tenant_id'])) for r in rows]
+    except Exception as e:
+        if 'neon_tenant_id' not in str(e):
+            raise
+        print("   ⚠️  tenants.neon_tenant_id não existe (rode sync_worker_setup.sql); usando mapeamento legado")
+
+    wanted = [slug for slug in (slugs or LEGACY_NEON_IDS) if slug in LEGACY_NEON_IDS]
+    if not wanted:
+        return []
+    rows = supabase.table('tenants').select('id,slug').in_('slug', wanted).order('slug').execute().data
+    return [Tenant(r['id'], r['slug'], LEGACY_NEON_IDS[r['slug']]) for r in rows]
+
+
+def get_tenant(supabase, slug: str = DEFAULT_TENANT_SLUG) -> Tenant:
+    """Um tenant do registro; erro se ele não estiver mapeado para o Neon."""
+    tenants = load_tenants(supabase, [slug])
+    if not tenants:
+        raise ValueError(f"Tenant '{slug}' não está no registro (tenants.neon_tenant_id)")
+    return tenants[0]
+
+
+def tenant_cache_path(cache_dir: str, tenant: Tenant) -> str:
+    """
+    Arquivo de cache (mapas de IDs + fingerprints) exclusivo do tenant: cada
+    worker grava só o seu arquivo no Volume. O tenant padrão mantém o arquivo
+    que já existia, para não começar com o cache frio.
+    """
+    if tenant.slug == DEFAULT_TENANT_SLUG:
+        return os.path.join(cache_dir, "id_maps.sqlite")
+    return os.path.join(cache_dir, f"id_maps_{tenant.slug}.sqlite")
@@ -0,0 +1,182 @@
+"""
+Escrita assíncrona no PostgREST (Supabase) com conexões persistentes.
+
+Um event loop numa thread dedicada mantém um httpx.AsyncClient (HTTP/2 quando
+o pacote h2 está instalado, keep-alive sempre) e vários batches em voo ao
+mesmo tempo. Quem chama continua síncrono: upsert() bloqueia até os batches
+daquela chamada terminarem; submit() devolve um Future para seguir lendo
+enquanto a escrita acontece.
+
+Ordem entre tabelas: os batches de uma tabela filha (ex.: messages) só saem
+depois que todas as escritas já submetidas das tabelas pais (conversations,
+contacts, agents) terminaram. Uma mensagem nunca chega antes da sua conversa.
+
+Tamanho dos batches, concorrência e retry vêm do AimdController (rate.py).
+"""
+
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import httpx
+
+from .rate import AimdController, is_throttle_error, MAX_RETRIES
+
+# Tabelas que precisam estar gravadas antes de cada tabela filha
+TABLE_PARENTS = {
+    'conversations': ('contacts', 'agents'),
+    'messages': ('conversations', 'contacts', 'agents'),
+    'transcriptions': ('messages',),
+}
+
+MAX_CONNECTIONS = 16
+REQUEST_TIMEOUT = 60.0
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class WriteError(Exception):
+    """Resposta de erro do PostgREST (status_code é lido pelo controle de taxa)."""
+
+    def __init__(self, table: str, status_code: int, body: str):
+        super().__init__(f"{table}: HTTP {status_code} {body[:200]}")
+        self.status_code = status_code
+        self.code = None  # SQLSTATE/PGRST do corpo JSON ({"code": "23502", ...})
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return
+        if isinstance(payload, dict) and payload.get('code') is not None:
+            self.code = str(payload['code'])
+
+
+class PostgrestWriter:
+    """Upserts em batches concorrentes, com ordem pai → filho entre tabelas."""
+
+    def __init__(self, url: str, key: str, rate: AimdController,
+                 max_connections: int = MAX_CONNECTIONS, timeout: float = REQUEST_TIMEOUT):
+        self.base_url = url.rstrip('/') + '/rest/v1'
+        self.headers = {
+            'apikey': key,
+            'Authorization': f"Bearer {key}",
+            'Content-Type': 'application/json',
+            'Prefer': 'resolution=merge-duplicates,return=minimal',
+        }
+        self.rate = rate
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.http2 = _http2_available()
+
+        self._pending = {}  # tabela → escritas (tasks) ainda em andamento
+        self._in_flight = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='postgrest-writer', daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    async def _setup(self):
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            http2=self.http2,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+        self._slots = asyncio.Condition()
+
+    # --------------------------------------------------------
+    # API síncrona
+    # --------------------------------------------------------
+    def submit(self, table: str, rows: list, on_conflict: str = 'tenant_id,external_id') -> Future:
+        """
+        Agenda o upsert e retorna um Future com (gravadas, falhas), onde falhas
+        é uma lista de (linha inicial, tamanho do batch, exceção).
+        """
+        return asyncio.run_coroutine_threadsafe(self._upsert(table, rows, on_conflict), self._loop)
+
+    def upsert(self, table: str, rows: list, on_conflict: str = 'tenant_id,external_id') -> tuple:
+        """Como submit, mas espera terminar."""
+        return self.submit(table, rows, on_conflict).result()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    # --------------------------------------------------------
+    # Event loop
+    # --------------------------------------------------------
+    async def _upsert(self, table: str, rows: list, on_conflict: str) -> tuple:
+        # Nada de await antes do registro: a ordem de submit() é a ordem de chegada aqui
+        parents = [task for parent in TABLE_PARENTS.get(table, ()) for task in self._pending.get(parent, ())]
+        current = asyncio.current_task()
+        self._pending.setdefault(table, set()).add(current)
+
+        try:
+            if parents:
+                await asyncio.gather(*parents, return_exceptions=True)
+
+            batches, start = [], 0
+            for batch in self.rate.batches(rows):
+                batches.append((start, batch))
+                start += len(batch)
+
+            results = await asyncio.gather(
+                *(self._send(table, batch, on_conflict) for _, batch in batches),
+                return_exceptions=True
+            )
+        finally:
+            self._pending[table].discard(current)
+
+        written, failures = 0, []
+        for (start, batch), result in zip(batches, results):
+            if isinstance(result, BaseException):
+                failures.append((start, len(batch), result))
+            else:
+                written += result
+        return written, failures
+
+    async def _acquire(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < self.rate.concurrency)
+            self._in_flight += 1
+        wait = max(self.rate.cooldown_remaining(), self.rate.pause)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _release(self):
+        async with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+    async def _send(self, table: str, batch: list, on_conflict: str) -> int:
+        # Colunas = união das chaves: linhas sem uma coluna recebem NULL (como o client síncrono)
+        columns = list(dict.fromkeys(key for row in batch for key in row))
+        params = {'on_conflict': on_conflict, 'columns': ','.join(f'"{c}"' for c in columns)}
+        body = json.dumps(batch, default=str, ensure_ascii=False)
+
+        for attempt in range(MAX_RETRIES):
+            await self._acquire()
+            started = time.monotonic()
+            try:
+                response = await self._client.post(f"/{table}", params=params, content=body)
+                if response.status_code >= 400:
+                    raise WriteError(table, response.status_code, response.text)
+            except Exception as e:
+                await self._release()
+                if attempt == MAX_RETRIES - 1 or not is_throttle_error(e):
+                    raise
+                self.rate.record_throttle(e)
+                continue
+            await self._release()
+            self.rate.record_success(time.monotonic() - started)
+            return len(batch)
@@ -5,6 +5,7 @@ Roda a cada 10 minutos para sincronizar conversas, mensagens e contatos.
 
 import modal
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 import json
@@ -12,66 +13,220 @@ import json
 # Configuração do App Modal
 app = modal.App("indaia-sync")
 
-# Imagem com dependências
+# Imagem com dependências (+ sync/utils montado como pacote `utils`)
 image = modal.Image.debian_slim(python_version="3.11").pip_install(
     "psycopg2-binary",  # PostgreSQL (Neon)
     "supabase",         # Supabase client
+    "httpx[http2]",     # Writer assíncrono (HTTP/2)
     "python-dotenv",
+).add_local_dir(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sync", "utils"),
+    remote_path="/root/utils",
 )
 
 # Secrets
 secrets = modal.Secret.from_name("indaia-secrets")
 
+# Volume com o cache persistente dos mapas external_id → UUID (um arquivo por tenant)
+id_cache_volume = modal.Volume.from_name("indaia-sync-cache", create_if_missing=True)
+CACHE_DIR = "/cache"
+
+# Escrita em lote no Supabase (configurável via env/secrets): o batch parte de
+# UPSERT_BATCH_SIZE e os batches em voo vão até UPSERT_MAX_IN_FLIGHT, ajustados
+# pelo controle adaptativo (utils/rate.py) conforme latência e 429/5xx
+UPSERT_BATCH_SIZE = int(os.environ.get("SYNC_UPSERT_BATCH_SIZE", "500"))
+UPSERT_MAX_IN_FLIGHT = int(os.environ.get("SYNC_UPSERT_MAX_IN_FLIGHT", "4"))
+
+# Teto de batches em voo somando todos os tenants: cada worker recebe uma fatia
+# (mínimo 1), então mais tenants não multiplicam a carga no Supabase
+TOTAL_MAX_IN_FLIGHT = int(os.environ.get("SYNC_TOTAL_MAX_IN_FLIGHT", "8"))
+
+# Entidades com fingerprint das linhas gravadas (linhas sem mudança não são reenviadas).
+# Mensagens ficam de fora: quase nunca mudam e inflariam o arquivo de cache.
+FINGERPRINT_ENTITIES = ("agents", "contacts", "conversations")
+
+# Quantos external_ids por query `external_id=in.(...)` (limite prático de URL)
+RESOLVER_CHUNK_SIZE = 200
+
+# Tabelas cujos mapas de IDs ficam no cache persistente
+CACHED_ID_TABLES = ("conversations", "contacts", "agents")
+
+# Tamanho da página keyset lida do Neon por entidade
+PAGE_SIZES = {
+    "agents": 1000,
+    "contacts": 1000,
+    "conversations": 500,
+    "messages": 2000,
+}
+
+# Sem cursor nem sync anterior, começa das últimas 24h (agents: desde o início)
+INITIAL_LOOKBACK = timedelta(hours=24)
+
+# Origem keyset de cada entidade no Neon: (tabela, filtro, coluna de ordenação)
+NEON_SOURCES = {
+    "agents": ("users", "active = true", "updated_at"),
+    "contacts": ("leads", "tenant_id = %s", "updated_at"),
+    "conversations": ("conversations c", "c.tenant_id = %s", "c.updated_at"),
+    "messages": ("messages m", "m.tenant_id = %s", "m.created_at"),
+}
+
+# SELECT de cada entidade no Neon (o keyset/filtro por id é acrescentado depois).
+# Messages usam created_at como cursor (ordem de chegada no Neon): sent_at vem
+# da plataforma e pode chegar fora de ordem.
+NEON_QUERIES = {
+    "agents": """
+        SELECT id, name, email, role, active, created_at, updated_at
+        FROM users
+        WHERE active = true
+    """,
+    "contacts": """
+        SELECT id, external_id, identifier, name, email, phone_number, 
+               additional_attributes, custom_attributes, created_at, updated_at
+        FROM leads
+        WHERE tenant_id = %s
+    """,
+    "conversations": """
+        SELECT c.id, c.lead_id, c.user_id, c.status, 
+               c.created_at, c.updated_at, c.last_message_at,
+               c.last_message, c.platform
+        FROM conversations c
+        WHERE c.tenant_id = %s
+    """,
+    "messages": """
+        SELECT m.id, m.external_id, m.conversation_id, m.lead_id, m.user_id, 
+               m.content, m.content_type, m.from_me, m.sent_at,
+               m.is_private, m.transcricao, m.platform, m.created_at
+        FROM messages m
+        WHERE m.tenant_id = %s
+    """,
+}
+
+# Drain: continua lendo páginas até alcançar o Neon ou gastar a fração do timeout
+SYNC_TIMEOUT = 300  # 5 minutos max
+DRAIN_MODE = os.environ.get("SYNC_DRAIN", "1") == "1"
+DRAIN_BUDGET_FRACTION = float(os.environ.get("SYNC_DRAIN_BUDGET", "0.8"))
+
+# Retenção do sync_logs: logs crus → resumos por hora → resumos por dia → apagados
+SYNC_LOGS_RAW_RETENTION_HOURS = int(os.environ.get("SYNC_LOGS_RAW_RETENTION_HOURS", "48"))
+SYNC_LOGS_HOURLY_RETENTION_DAYS = int(os.environ.get("SYNC_LOGS_HOURLY_RETENTION_DAYS", "30"))
+SYNC_LOGS_DAILY_RETENTION_DAYS = int(os.environ.get("SYNC_LOGS_DAILY_RETENTION_DAYS", "365"))
+
+# Contagem de pendentes no relatório de lag é limitada para não pesar no Neon
+LAG_COUNT_CAP = 100_000
+
+# CDC (replicação lógica): tabela do Neon → entidade, na ordem de dependência
+CDC_ENTITIES = {
+    "users": "agents",
+    "leads": "contacts",
+    "conversations": "conversations",
+    "messages": "messages",
+}
+CDC_RUN_SECONDS = 3300  # cada execução consome ~55 min; o slot retém o resto
+
+
+# Container residente: fica quente entre os crons de 10 minutos, então pool do
+# Neon, client do Supabase, tenant e writer são montados uma vez só
+WARM_WINDOW = 15 * 60
+
+
+@app.cls(
+    image=image,
+    secrets=[secrets],
+    timeout=SYNC_TIMEOUT,
+    volumes={"/cache": id_cache_volume},
+    scaledown_window=WARM_WINDOW,
+    max_containers=1,
+)
+class SyncService:
+    """
+    Worker de um tenant: cada slug é um conjunto próprio de containers, com
+    pool, cursores, cache de IDs e controle de taxa isolados dos outros.
+    """
+    
+    tenant_slug: str = modal.parameter(default="indaia")
+    
+    @modal.enter()
+    def setup(self):
+        from utils.runtime import ContainerRuntime
+        self.runtime = ContainerRuntime(self.tenant_slug)
+        get_writer(self.runtime.supabase)
+    
+    @modal.method()
+    def sync(self, drain: bool = DRAIN_MODE, max_in_flight: int = UPSERT_MAX_IN_FLIGHT) -> dict:
+        return run_sync(self.runtime, drain, max_in_flight)
+    
+    @modal.exit()
+    def teardown(self):
+        close_writer()
+        self.runtime.close()
+
 
 @app.function(
     image=image,
     secrets=[secrets],
     schedule=modal.Cron("*/10 * * * *"),  # A cada 10 minutos
-    timeout=300,  # 5 minutos max
+    timeout=SYNC_TIMEOUT + 60,
 )
-def sync_neon_to_supabase():
+def sync_neon_to_supabase(drain: bool = DRAIN_MODE):
     """
     Sincroniza dados do Neon (Chatwoot) para o Supabase.
-    Roda a cada 10 minutos.
+    Roda a cada 10 minutos: um SyncService por tenant do registro, em paralelo,
+    cada um com o próprio timeout (mais tenants não alongam o run).
     """
-    import psycopg2
-    from psycopg2.extras import RealDictCursor
-    from supabase import create_client, Client
+    from supabase import create_client
+    from utils.tenants import load_tenants
     
-    print("🔄 Iniciando sync Neon → Supabase...")
-    start_time = datetime.now()
+    supabase = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+    tenants = load_tenants(supabase)
+    if not tenants:
+        print("⚠️  Nenhum tenant no registro (tenants.neon_tenant_id)")
+        return {}
     
-    # Conexões
-    NEON_HOST = os.environ.get("NEON_HOST")
-    NEON_DATABASE = os.environ.get("NEON_DATABASE")
-    NEON_USER = os.environ.get("NEON_USER")
-    NEON_PASSWORD = os.environ.get("NEON_PASSWORD")
+    share = max(1, min(UPSERT_MAX_IN_FLIGHT, TOTAL_MAX_IN_FLIGHT // len(tenants)))
+    print(f"🔀 Sync de {len(tenants)} tenants ({share} batches em voo cada)")
+    calls = {tenant.slug: SyncService(tenant_slug=tenant.slug).sync.spawn(drain, share) for tenant in tenants}
     
-    SUPABASE_URL = os.environ["SUPABASE_URL"]
-    SUPABASE_KEY = os.environ["SUPABASE_SERVICE_KEY"]
+    # Falha de um tenant não derruba os outros; o erro sobe no fim
+    results, failed = {}, []
+    for slug, call in calls.items():
+        try:
+            results[slug] = call.get()
+        except Exception as e:
+            print(f"❌ Tenant {slug}: {e}")
+            results[slug] = {"error": str(e)[:500]}
+            failed.append(slug)
     
-    # Conectar Neon (read-only)
-    neon_conn = psycopg2.connect(
-        host=NEON_HOST,
-        database=NEON_DATABASE,
-        user=NEON_USER,
-        password=NEON_PASSWORD,
-        sslmode='require',
-        cursor_factory=RealDictCursor
-    )
-    neon_cursor = neon_conn.cursor()
+    if failed:
+        raise RuntimeError(f"Sync falhou para {len(failed)}/{len(tenants)} tenants: {', '.join(failed)}")
+    return results
+
+
+def run_sync(runtime, drain: bool = DRAIN_MODE, max_in_flight: int = UPSERT_MAX_IN_FLIGHT) -> dict:
+    """
+    Um run do sync de um tenant usando os recursos residentes (utils/runtime.py):
+    só pega uma conexão do pool do Neon; client do Supabase e tenant já estão prontos.
+    
+    Em modo drain, cada entidade lê páginas até alcançar o Neon ou até gastar
+    DRAIN_BUDGET_FRACTION do timeout; sem drain, lê uma página por entidade.
+    """
+    from utils.id_cache import IdMapCache
+    from utils.fingerprints import FingerprintStore
+    from utils.tenants import tenant_cache_path
     
-    # Conectar Supabase
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    print(f"🔄 Iniciando sync Neon → Supabase ({runtime.tenant.slug})...")
+    start_time = datetime.now()
+    started = time.monotonic()
+    deadline = started + SYNC_TIMEOUT * DRAIN_BUDGET_FRACTION if drain else None
+    runtime.start_run()
+    get_write_rate().set_max_concurrency(max_in_flight)
     
-    # Buscar tenant (UUID no Supabase)
-    tenant = supabase.table('tenants').select('id').eq('slug', 'indaia').single().execute()
-    tenant_id = tenant.data['id']  # UUID string
+    # Container quente: enxerga o que outros jobs gravaram no cache desde o último run
+    id_cache_volume.reload()
     
-    # Para queries no Neon, precisamos do tenant_id como integer
-    # Assumindo que o tenant_id no Neon é 1 (ou buscar de outra forma)
-    # Por enquanto, vamos usar um valor fixo ou buscar do Supabase metadata
-    neon_tenant_id = 1  # TODO: Mapear tenant_id UUID → integer do Neon se necessário
+    supabase = runtime.supabase
+    tenant_id = runtime.tenant_id  # UUID string
+    neon_tenant_id = runtime.tenant.neon_tenant_id  # integer no Neon (registro de tenants)
+    cache_path = tenant_cache_path(CACHE_DIR, runtime.tenant)
     
     stats = {
         "agents": 0,
@@ -80,30 +235,43 @@ def sync_neon_to_supabase():
         "messages": 0,
     }
     
+    # Resolver external_id → UUID compartilhado por todas as entidades do run
+    # (mapas vêm do cache persistente; cache frio é reconstruído em background)
+    resolver = IdResolver(supabase, tenant_id, cache=IdMapCache(cache_path))
+    fingerprints = FingerprintStore(cache_path)
+    
     try:
-        # 1. Buscar último sync
-        last_sync = get_last_sync(supabase, tenant_id)
-        print(f"📅 Último sync: {last_sync or 'Nunca'}")
-        
-        # 2. Sync Agents (atendentes)
-        stats["agents"] = sync_agents(neon_cursor, supabase, tenant_id, last_sync)
-        
-        # 3. Sync Contacts (leads)
-        stats["contacts"] = sync_contacts(neon_cursor, supabase, tenant_id, last_sync, neon_tenant_id)
-        
-        # 4. Sync Conversations
-        stats["conversations"] = sync_conversations(neon_cursor, supabase, tenant_id, last_sync, neon_tenant_id)
-        
-        # 5. Sync Messages
-        stats["messages"] = sync_messages(neon_cursor, supabase, tenant_id, last_sync, neon_tenant_id)
-        
-        # 6. Atualizar último sync
-        update_last_sync(supabase, tenant_id, stats)
+        with runtime.neon.connection() as neon_conn, neon_conn.cursor() as neon_cursor:
+            # 1. Buscar último sync
+            last_sync = get_last_sync(supabase, tenant_id)
+            print(f"📅 Último sync: {last_sync or 'Nunca'}")
+            
+            lag = {}
+            
+            # 2. Sync Agents (atendentes)
+            stats["agents"] = sync_agents(neon_cursor, supabase, tenant_id, last_sync, deadline, lag, fingerprints)
+            
+            # 3. Sync Contacts (leads)
+            stats["contacts"] = sync_contacts(neon_cursor, supabase, tenant_id, last_sync, neon_tenant_id, deadline, lag, fingerprints)
+            
+            # 4. Sync Conversations
+            stats["conversations"] = sync_conversations(neon_cursor, supabase, tenant_id, last_sync, neon_tenant_id, resolver, deadline, lag, fingerprints)
+            
+            # 5. Sync Messages
+            stats["messages"] = sync_messages(neon_cursor, supabase, tenant_id, last_sync, neon_tenant_id, resolver, deadline, lag)
+            
+            # 6. Atualizar último sync
+            update_last_sync(supabase, tenant_id, stats)
+            
+            # 7. Lag restante (o que ficou para o próximo run)
+            stats["lag"] = report_lag(neon_cursor, lag, neon_tenant_id)
         
         duration = (datetime.now() - start_time).total_seconds()
         print(f"✅ Sync completo em {duration:.1f}s")
         print(f"   📊 Agents: {stats['agents']}, Contacts: {stats['contacts']}")
         print(f"   💬 Conversations: {stats['conversations']}, Messages: {stats['messages']}")
+        print(f"   🎚️  {get_write_rate().describe()}")
+        stats["write_rate"] = get_write_rate().state()
         
         return stats
         
@@ -113,13 +281,26 @@ def sync_neon_to_supabase():
         traceback.print_exc()
         raise
     finally:
-        neon_cursor.close()
-        neon_conn.close()
+        # Não deixa a reconstrução do cache estourar o timeout do Modal
+        resolver.wait_for_cache(timeout=max(0, SYNC_TIMEOUT - (time.monotonic() - started) - 15))
+        id_cache_volume.commit()
 
 
 def get_last_sync(supabase, tenant_id: str) -> Optional[datetime]:
-    """Busca timestamp do último sync bem-sucedido."""
+    """
+    Busca timestamp do último sync bem-sucedido: linha 'all' de sync_state
+    (leitura pela PK). Sem ela, cai no sync_logs legado.
+    """
     try:
+        state = supabase.table("sync_state")\
+            .select("cursor_value")\
+            .eq("tenant_id", tenant_id)\
+            .eq("entity_type", "all")\
+            .limit(1)\
+            .execute()
+        if state.data and state.data[0].get("cursor_value"):
+            return _parse_timestamp(state.data[0]["cursor_value"])
+        
         result = supabase.table("sync_logs")\
             .select("completed_at")\
             .eq("tenant_id", tenant_id)\
@@ -132,49 +313,192 @@ def get_last_sync(supabase, tenant_id: str) -> Optional[datetime]:
         if result.data and len(result.data) > 0:
             completed_str = result.data[0].get("completed_at")
             if completed_str:
-                # Remover Z e converter
-                if completed_str.endswith('Z'):
-                    completed_str = completed_str[:-1] + '+00:00'
-                return datetime.fromisoformat(completed_str)
+                return _parse_timestamp(completed_str)
     except Exception as e:
         print(f"   ⚠️  Erro ao buscar último sync: {e}")
     return None
 
 
+def _parse_timestamp(value: str) -> datetime:
+    # Remover Z e converter
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+
+def get_sync_cursor(supabase, tenant_id: str, entity: str, last_sync: Optional[datetime]) -> Optional[tuple]:
+    """
+    Retorna o cursor keyset (valor_ordenação, id) da entidade em sync_state.
+    
+    Sem cursor salvo, parte do último sync legado (sync_logs 'all') ou das
+    últimas 24h; agents (tabela pequena) começam do início.
+    """
+    result = supabase.table("sync_state")\
+        .select("cursor_value,cursor_id")\
+        .eq("tenant_id", tenant_id)\
+        .eq("entity_type", entity)\
+        .limit(1)\
+        .execute()
+    
+    if result.data and result.data[0].get("cursor_value"):
+        return (result.data[0]["cursor_value"], result.data[0].get("cursor_id") or 0)
+    
+    if entity == "agents" and not last_sync:
+        return None
+    since = last_sync or (datetime.utcnow() - INITIAL_LOOKBACK)
+    return (since.isoformat(), 0)
+
+
+def save_sync_cursor(supabase, tenant_id: str, entity: str, cursor_value, cursor_id, records: int):
+    """Avança o cursor da entidade (chamado só depois que a página foi gravada)."""
+    if not isinstance(cursor_value, str):
+        cursor_value = cursor_value.isoformat()
+    supabase.table("sync_state").upsert({
+        "tenant_id": tenant_id,
+        "entity_type": entity,
+        "cursor_value": cursor_value,
+        "cursor_id": cursor_id,
+        "records_synced": records,
+        "updated_at": datetime.utcnow().isoformat(),
+    }, on_conflict="tenant_id,entity_type").execute()
+
+
+def fetch_keyset_page(cursor, query: str, params: list, order_column: str, id_column: str,
+                      after: Optional[tuple], limit: int) -> list:
+    """Lê a próxima página em ordem crescente de (order_column, id_column) após o cursor."""
+    params = list(params)
+    if after:
+        query += f" AND ({order_column}, {id_column}) > (%s, %s)"
+        params.extend(after)
+    query += f" ORDER BY {order_column}, {id_column} LIMIT %s"
+    params.append(limit)
+    
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def advance_cursor(supabase, tenant_id: str, entity: str, rows: list, order_column: str, records: int,
+                   after: Optional[tuple]) -> Optional[tuple]:
+    """Salva como cursor a última linha da página (ordem crescente) e o retorna."""
+    if not rows:
+        return after
+    last = rows[-1]
+    save_sync_cursor(supabase, tenant_id, entity, last[order_column], last["id"], records)
+    return (last[order_column], last["id"])
+
+
+def keyset_columns(entity: str) -> tuple:
+    """(coluna de ordenação, coluna id) da entidade, com o alias da tabela."""
+    order_column = NEON_SOURCES[entity][2]
+    alias = order_column.rsplit(".", 1)[0] + "." if "." in order_column else ""
+    return order_column, alias + "id"
+
+
+def drain_entity(cursor, supabase, tenant_id: str, entity: str, query: str, params: list,
+                 last_sync: Optional[datetime], transform, deadline: Optional[float] = None,
+                 lag: Optional[dict] = None, fingerprints=None) -> int:
+    """
+    Lê páginas keyset da entidade, grava cada uma e avança o cursor página a página.
+    
+    Sem deadline lê uma única página; com deadline (drain) continua até a página
+    vir incompleta (Neon alcançado) ou até o orçamento de tempo acabar.
+    """
+    order_column, id_column = keyset_columns(entity)
+    row_column = order_column.rsplit(".", 1)[-1]
+    page_size = PAGE_SIZES[entity]
+    
+    after = get_sync_cursor(supabase, tenant_id, entity, last_sync)
+    total = 0
+    pages = 0
+    while True:
+        rows = fetch_keyset_page(cursor, query, params, order_column, id_column, after, page_size)
+        count = upsert_changed(supabase, tenant_id, entity, transform(rows), fingerprints)
+        after = advance_cursor(supabase, tenant_id, entity, rows, row_column, count, after)
+        total += count
+        pages += 1
+        
+        caught_up = len(rows) < page_size
+        if caught_up or deadline is None or time.monotonic() >= deadline:
+            break
+    
+    if lag is not None:
+        lag[entity] = {"caught_up": caught_up, "pages": pages, "cursor": after}
+    return total
+
+
+def report_lag(cursor, lag: dict, neon_tenant_id: int) -> dict:
+    """Imprime e retorna quanto ficou pendente no Neon por entidade."""
+    report = {}
+    for entity, state in lag.items():
+        after = state["cursor"]
+        pending = 0
+        if not state["caught_up"]:
+            table, where, _ = NEON_SOURCES[entity]
+            order_column, id_column = keyset_columns(entity)
+            query = f"SELECT 1 FROM {table} WHERE {where}"
+            params = [neon_tenant_id] * where.count("%s")
+            if after:
+                query += f" AND ({order_column}, {id_column}) > (%s, %s)"
+                params.extend(after)
+            cursor.execute(f"SELECT COUNT(*) AS pending FROM ({query} LIMIT %s) t", params + [LAG_COUNT_CAP])
+            pending = cursor.fetchone()["pending"]
+        
+        cursor_value = after[0] if after else None
+        if cursor_value is not None and not isinstance(cursor_value, str):
+            cursor_value = cursor_value.isoformat()
+        report[entity] = {"pending": pending, "pages": state["pages"], "cursor": cursor_value}
+        
+        if pending:
+            more = "+" if pending >= LAG_COUNT_CAP else ""
+            print(f"   ⏳ {entity}: {pending:,}{more} pendentes (cursor {cursor_value}, {state['pages']} páginas)")
+        else:
+            print(f"   ✅ {entity}: em dia (cursor {cursor_value}, {state['pages']} páginas)")
+    return report
+
+
 def update_last_sync(supabase, tenant_id: str, stats: dict):
-    """Registra o sync atual."""
+    """
+    Registra o sync atual: atualiza a linha 'all' de sync_state (lida pelo
+    próximo run) e acrescenta o histórico em sync_logs (compactado pelo rollup).
+    """
     try:
         total_records = stats.get("agents", 0) + stats.get("contacts", 0) + \
                        stats.get("conversations", 0) + stats.get("messages", 0)
+        completed_at = datetime.utcnow().isoformat() + "+00:00"
+        
+        supabase.table("sync_state").upsert({
+            "tenant_id": tenant_id,
+            "entity_type": "all",
+            "cursor_value": completed_at,
+            "records_synced": total_records,
+            "updated_at": completed_at,
+        }, on_conflict="tenant_id,entity_type").execute()
         
         supabase.table("sync_logs").insert({
             "tenant_id": tenant_id,
             "entity_type": "all",
             "records_synced": total_records,
             "status": "success",
-            "completed_at": datetime.utcnow().isoformat()
+            "completed_at": completed_at
         }).execute()
     except Exception as e:
         print(f"   ⚠️  Erro ao salvar sync log: {e}")
 
 
-def sync_agents(cursor, supabase, tenant_id: str, last_sync: Optional[datetime]) -> int:
+def sync_agents(cursor, supabase, tenant_id: str, last_sync: Optional[datetime],
+                deadline: Optional[float] = None, lag: Optional[dict] = None, fingerprints=None) -> int:
     """Sincroniza atendentes (users do Chatwoot → agents no Supabase)."""
     
-    query = """
-        SELECT id, name, email, role, active, created_at, updated_at
-        FROM users
-        WHERE active = true
-    """
-    params = []
-    if last_sync:
-        query += " AND updated_at > %s"
-        params.append(last_sync)
-    
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    
-    count = 0
+    count = drain_entity(cursor, supabase, tenant_id, "agents", NEON_QUERIES["agents"], [], last_sync,
+                         lambda rows: transform_agents(rows, tenant_id), deadline, lag, fingerprints)
+    print(f"   👥 Agents sincronizados: {count}")
+    return count
+
+
+def transform_agents(rows: list, tenant_id: str) -> list:
+    """users (Neon) → linhas de agents (Supabase)."""
+    synced_at = datetime.utcnow().isoformat()
+    data = []
     for row in rows:
         external_id = row['id']  # integer no Neon
         name = row.get('name')
@@ -182,41 +506,32 @@ def sync_agents(cursor, supabase, tenant_id: str, last_sync: Optional[datetime])
         role = row.get('role', 'agent')
         active = row.get('active', True)
         
-        # Upsert no Supabase
-        supabase.table("agents").upsert({
+        data.append({
             "tenant_id": tenant_id,
             "external_id": external_id,
             "name": name,
             "email": email,
             "role": role,
             "active": active if active is not None else True,
-            "synced_at": datetime.utcnow().isoformat(),
-        }, on_conflict="tenant_id,external_id").execute()
-        count += 1
-    
-    print(f"   👥 Agents sincronizados: {count}")
-    return count
+            "synced_at": synced_at,
+        })
+    return data
 
 
-def sync_contacts(cursor, supabase, tenant_id: str, last_sync: Optional[datetime], neon_tenant_id: int = 1) -> int:
+def sync_contacts(cursor, supabase, tenant_id: str, last_sync: Optional[datetime], neon_tenant_id: int = 1,
+                  deadline: Optional[float] = None, lag: Optional[dict] = None, fingerprints=None) -> int:
     """Sincroniza contatos/leads (tabela 'leads' no Neon)."""
     
-    query = """
-        SELECT id, external_id, identifier, name, email, phone_number, 
-               additional_attributes, custom_attributes, created_at, updated_at
-        FROM leads
-        WHERE tenant_id = %s
-    """
-    params = [neon_tenant_id]
-    if last_sync:
-        query += " AND updated_at > %s"
-        params.append(last_sync)
-    query += " ORDER BY updated_at DESC LIMIT 1000"
-    
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    
-    count = 0
+    count = drain_entity(cursor, supabase, tenant_id, "contacts", NEON_QUERIES["contacts"], [neon_tenant_id], last_sync,
+                         lambda rows: transform_contacts(rows, tenant_id), deadline, lag, fingerprints)
+    print(f"   📇 Contacts sincronizados: {count}")
+    return count
+
+
+def transform_contacts(rows: list, tenant_id: str) -> list:
+    """leads (Neon) → linhas de contacts (Supabase)."""
+    synced_at = datetime.utcnow().isoformat()
+    data = []
     for row in rows:
         # Usar external_id se existir, senão usar id
         external_id = row.get('external_id') or row['id']
@@ -245,7 +560,7 @@ def sync_contacts(cursor, supabase, tenant_id: str, last_sync: Optional[datetime
         # Mesclar atributos
         merged_attrs = {**additional_attrs, **custom_attrs}
         
-        supabase.table("contacts").upsert({
+        data.append({
             "tenant_id": tenant_id,
             "external_id": external_id,
             "name": name,
@@ -253,34 +568,31 @@ def sync_contacts(cursor, supabase, tenant_id: str, last_sync: Optional[datetime
             "phone": phone,
             "identifier": identifier,
             "custom_attributes": merged_attrs,
-            "synced_at": datetime.utcnow().isoformat(),
-        }, on_conflict="tenant_id,external_id").execute()
-        count += 1
-    
-    print(f"   📇 Contacts sincronizados: {count}")
-    return count
+            "synced_at": synced_at,
+        })
+    return data
 
 
-def sync_conversations(cursor, supabase, tenant_id: str, last_sync: Optional[datetime], neon_tenant_id: int = 1) -> int:
+def sync_conversations(cursor, supabase, tenant_id: str, last_sync: Optional[datetime], neon_tenant_id: int = 1,
+                       resolver: Optional["IdResolver"] = None,
+                       deadline: Optional[float] = None, lag: Optional[dict] = None, fingerprints=None) -> int:
     """Sincroniza conversas (usa lead_id e user_id no Neon)."""
     
-    query = """
-        SELECT c.id, c.lead_id, c.user_id, c.status, 
-               c.created_at, c.updated_at, c.last_message_at,
-               c.last_message, c.platform
-        FROM conversations c
-        WHERE c.tenant_id = %s
-    """
-    params = [neon_tenant_id]
-    if last_sync:
-        query += " AND c.updated_at > %s"
-        params.append(last_sync)
-    query += " ORDER BY c.updated_at DESC LIMIT 500"
-    
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
+    resolver = resolver or IdResolver(supabase, tenant_id)
+    count = drain_entity(cursor, supabase, tenant_id, "conversations", NEON_QUERIES["conversations"], [neon_tenant_id], last_sync,
+                         lambda rows: transform_conversations(rows, tenant_id, resolver), deadline, lag, fingerprints)
+    print(f"   💬 Conversations sincronizadas: {count}")
+    return count
+
+
+def transform_conversations(rows: list, tenant_id: str, resolver: "IdResolver") -> list:
+    """conversations (Neon) → linhas de conversations (Supabase)."""
+    # Resolver todos os IDs do lote de uma vez
+    resolver.prefetch("contacts", [row.get('lead_id') for row in rows])
+    resolver.prefetch("agents", [row.get('user_id') for row in rows])
     
-    count = 0
+    synced_at = datetime.utcnow().isoformat()
+    data = []
     for row in rows:
         external_id = row['id']  # integer
         lead_ext_id = row.get('lead_id')  # integer (FK para leads)
@@ -292,9 +604,9 @@ def sync_conversations(cursor, supabase, tenant_id: str, last_sync: Optional[dat
         
         # Buscar IDs internos
         # lead_id → contact_id no Supabase
-        contact_id = get_internal_id(supabase, "contacts", tenant_id, lead_ext_id) if lead_ext_id else None
+        contact_id = resolver.get("contacts", lead_ext_id)
         # user_id → agent_id no Supabase
-        agent_id = get_internal_id(supabase, "agents", tenant_id, user_ext_id) if user_ext_id else None
+        agent_id = resolver.get("agents", user_ext_id)
         
         # Preparar metadata
         metadata = {
@@ -314,7 +626,7 @@ def sync_conversations(cursor, supabase, tenant_id: str, last_sync: Optional[dat
         if last_message and len(last_message) > 500:
             last_message = last_message[:500]
         
-        supabase.table("conversations").upsert({
+        data.append({
             "tenant_id": tenant_id,
             "external_id": external_id,
             "contact_id": contact_id,
@@ -323,58 +635,79 @@ def sync_conversations(cursor, supabase, tenant_id: str, last_sync: Optional[dat
             "last_message": last_message,
             "last_message_at": last_message_at_iso,
             "metadata": metadata,
-            "synced_at": datetime.utcnow().isoformat(),
-        }, on_conflict="tenant_id,external_id").execute()
-        count += 1
-    
-    print(f"   💬 Conversations sincronizadas: {count}")
-    return count
+            "synced_at": synced_at,
+        })
+    return data
 
 
-def sync_messages(cursor, supabase, tenant_id: str, last_sync: Optional[datetime], neon_tenant_id: int = 1) -> int:
+def sync_messages(cursor, supabase, tenant_id: str, last_sync: Optional[datetime], neon_tenant_id: int = 1,
+                  resolver: Optional["IdResolver"] = None,
+                  deadline: Optional[float] = None, lag: Optional[dict] = None) -> int:
     """Sincroniza mensagens (usa from_me, user_id, lead_id no Neon)."""
     
-    # Buscar apenas mensagens recentes (últimas 24h ou desde último sync)
-    if last_sync:
-        since = last_sync
-    else:
-        since = datetime.utcnow() - timedelta(hours=24)
+    resolver = resolver or IdResolver(supabase, tenant_id)
     
-    query = """
-        SELECT m.id, m.external_id, m.conversation_id, m.lead_id, m.user_id, 
-               m.content, m.content_type, m.from_me, m.sent_at,
-               m.is_private, m.transcricao, m.platform
-        FROM messages m
-        WHERE m.tenant_id = %s AND m.sent_at > %s
-        ORDER BY m.sent_at DESC
-        LIMIT 2000
+    def transform(rows):
+        # Conversas que ainda não chegaram ao Supabase são gravadas antes das mensagens
+        ensure_message_parents(cursor, supabase, tenant_id, neon_tenant_id, resolver, rows)
+        return transform_messages(rows, tenant_id, resolver)
+    
+    count = drain_entity(cursor, supabase, tenant_id, "messages", NEON_QUERIES["messages"], [neon_tenant_id], last_sync,
+                         transform, deadline, lag)
+    print(f"   📨 Messages sincronizadas: {count}")
+    return count
+
+
+def ensure_message_parents(cursor, supabase, tenant_id: str, neon_tenant_id: int, resolver: "IdResolver",
+                           rows: list) -> dict:
     """
+    Pais que faltam para um lote de mensagens: conversas ainda não gravadas no
+    Supabase (e os leads/atendentes delas e das mensagens) são lidos do Neon com
+    uma query por tabela e gravados antes, pais primeiro. Sem isso, as mensagens
+    seriam puladas e o cursor passaria delas para sempre.
+    """
+    resolver.prefetch("conversations", [row.get("conversation_id") for row in rows])
+    missing = sorted({row["conversation_id"] for row in rows
+                      if row.get("conversation_id") and not resolver.get("conversations", row["conversation_id"])})
+    if not missing:
+        return {}
+    
+    conversations = fetch_rows_by_id(cursor, "conversations", missing, neon_tenant_id)
+    parents = conversations + rows
+    resolver.prefetch("contacts", [r.get("lead_id") for r in parents])
+    resolver.prefetch("agents", [r.get("user_id") for r in parents])
+    lead_ids = sorted({r["lead_id"] for r in parents if r.get("lead_id") and not resolver.get("contacts", r["lead_id"])})
+    user_ids = sorted({r["user_id"] for r in parents if r.get("user_id") and not resolver.get("agents", r["user_id"])})
+    
+    written = {}
+    for entity, ids in (("agents", user_ids), ("contacts", lead_ids)):
+        parent_rows = fetch_rows_by_id(cursor, entity, ids, neon_tenant_id)
+        if parent_rows:
+            written[entity], _ = bulk_upsert(supabase, entity, transform_rows(entity, parent_rows, tenant_id, resolver))
+    if conversations:
+        written["conversations"], _ = bulk_upsert(supabase, "conversations",
+                                                  transform_conversations(conversations, tenant_id, resolver))
+    # Os UUIDs novos entram no resolver (prefetch só busca o que ainda falta)
+    resolver.prefetch("conversations", missing)
+    
+    print(f"   🧩 Pais buscados no Neon para {len(missing)} conversas ausentes: {written}")
+    return written
+
+
+def transform_messages(rows: list, tenant_id: str, resolver: "IdResolver") -> list:
+    """messages (Neon) → linhas de messages (Supabase). Pula mensagens sem conversa."""
+    from utils.attachments import parse_message_content
+    from utils.keys import message_key
     
-    cursor.execute(query, (neon_tenant_id, since))
-    rows = cursor.fetchall()
-    
-    # Buscar mapas de IDs
-    def fetch_all(table):
-        all_data = []
-        offset = 0
-        while True:
-            result = supabase.table(table).select('id,external_id').eq('tenant_id', tenant_id).range(offset, offset + 999).execute()
-            if not result.data:
-                break
-            all_data.extend(result.data)
-            if len(result.data) < 1000:
-                break
-            offset += 1000
-        return {item['external_id']: item['id'] for item in all_data}
-    
-    conv_map = fetch_all('conversations')
-    contact_map = fetch_all('contacts')
-    agent_map = fetch_all('agents')
-    
-    count = 0
+    # Resolver apenas os IDs referenciados pelo lote
+    resolver.prefetch("conversations", [row.get('conversation_id') for row in rows])
+    resolver.prefetch("contacts", [row.get('lead_id') for row in rows])
+    resolver.prefetch("agents", [row.get('user_id') for row in rows if row.get('from_me')])
+    
+    synced_at = datetime.utcnow().isoformat()
+    data = []
     for row in rows:
-        # Usar external_id se existir, senão usar id
-        external_id = row.get('external_id') or str(row['id'])
+        external_id = message_key(row)  # Chave canônica: id do Neon (utils/keys.py)
         conv_ext_id = row.get('conversation_id')
         lead_ext_id = row.get('lead_id')
         user_ext_id = row.get('user_id')
@@ -387,21 +720,22 @@ def sync_messages(cursor, supabase, tenant_id: str, last_sync: Optional[datetime
         platform = row.get('platform', 'whatsapp')
         
         # Buscar conversation_id interno
-        conv_id = conv_map.get(conv_ext_id) if conv_ext_id else None
+        conv_id = resolver.get("conversations", conv_ext_id)
         if not conv_id:
             continue  # Pula se conversa não existe
         
         # Determinar sender_type baseado em from_me e user_id
         sender_type = determine_sender_type(from_me, user_ext_id, content)
         
-        # Extrair audio_url se for áudio
-        audio_url = extract_audio_url(content) if content_type == "audio" else None
+        # JSON do Chatwoot lido uma vez: texto + anexo principal em colunas próprias
+        parsed = parse_message_content(content)
+        audio_url = parsed["attachment_url"] if parsed["attachment_type"] == "audio" else None
         
         # Buscar contact_id do lead_id
-        contact_id = contact_map.get(lead_ext_id) if lead_ext_id else None
+        contact_id = resolver.get("contacts", lead_ext_id)
         
         # Buscar agent_id do user_id (se from_me = true)
-        agent_id = agent_map.get(user_ext_id) if (from_me and user_ext_id) else None
+        agent_id = resolver.get("agents", user_ext_id) if from_me else None
         
         # Converter sent_at para ISO se necessário
         if sent_at:
@@ -412,53 +746,232 @@ def sync_messages(cursor, supabase, tenant_id: str, last_sync: Optional[datetime
         else:
             sent_at_iso = None
         
-        supabase.table("messages").upsert({
+        data.append({
             "tenant_id": tenant_id,
             "external_id": external_id,
             "conversation_id": conv_id,
             "contact_id": contact_id,
             "agent_id": agent_id,
-            "content": clean_content(content),
+            "content": clean_content(parsed),
             "content_type": content_type or "text",
             "sender_type": sender_type,
             "audio_url": audio_url,
+            **parsed,
             "sent_at": sent_at_iso,
-            "synced_at": datetime.utcnow().isoformat(),
-        }, on_conflict="tenant_id,external_id").execute()
-        count += 1
+            "synced_at": synced_at,
+        })
+    return data
+
+
+def transform_rows(entity: str, rows: list, tenant_id: str, resolver: "IdResolver") -> list:
+    """Aplica o transform da entidade (mesmo caminho do polling e do CDC)."""
+    if entity == "agents":
+        return transform_agents(rows, tenant_id)
+    if entity == "contacts":
+        return transform_contacts(rows, tenant_id)
+    if entity == "conversations":
+        return transform_conversations(rows, tenant_id, resolver)
+    return transform_messages(rows, tenant_id, resolver)
+
+
+def fetch_rows_by_id(cursor, entity: str, ids: list, neon_tenant_id: int) -> list:
+    """Relê do Neon as linhas alteradas (estado atual, com os mesmos filtros do polling)."""
+    if not ids:
+        return []
+    _, where, _ = NEON_SOURCES[entity]
+    _, id_column = keyset_columns(entity)
+    params = [neon_tenant_id] * where.count("%s")
+    cursor.execute(NEON_QUERIES[entity] + f" AND {id_column} = ANY(%s)", params + [list(ids)])
+    return cursor.fetchall()
+
+
+def apply_change_batch(cursor, supabase, tenant_id: str, neon_tenant_id: int, resolver: "IdResolver",
+                       changes: dict, fingerprints=None) -> dict:
+    """
+    Aplica um micro-batch do CDC ({tabela_neon: [ids]}): pais antes de filhos,
+    relendo as linhas no Neon para usar exatamente o transform do polling.
+    """
+    counts = {}
+    for table, entity in CDC_ENTITIES.items():
+        rows = fetch_rows_by_id(cursor, entity, changes.get(table, []), neon_tenant_id)
+        if rows and entity == "messages":
+            ensure_message_parents(cursor, supabase, tenant_id, neon_tenant_id, resolver, rows)
+        if rows:
+            counts[entity] = upsert_changed(supabase, tenant_id, entity,
+                                            transform_rows(entity, rows, tenant_id, resolver), fingerprints)
+    return counts
+
+
+def upsert_changed(supabase, tenant_id: str, entity: str, rows: list, fingerprints=None) -> int:
+    """
+    bulk_upsert só das linhas cujo fingerprint mudou desde a última escrita.
+    Os fingerprints novos só são registrados depois que o upsert deu certo, e
+    nunca para linhas que foram para dead letter: depois de corrigida a causa,
+    o próximo sync as envia de novo mesmo sem mudança no Neon.
+    """
+    if fingerprints is None or entity not in FINGERPRINT_ENTITIES or not rows:
+        written, _ = bulk_upsert(supabase, entity, rows)
+        return written
     
-    print(f"   📨 Messages sincronizadas: {count}")
-    return count
+    changed, pending = fingerprints.filter_changed(tenant_id, entity, rows)
+    unchanged = len(rows) - len(changed)
+    if unchanged:
+        print(f"   ⏭️  {entity}: {unchanged} linhas sem mudança (não reenviadas)")
+    
+    written, dead = bulk_upsert(supabase, entity, changed)
+    parked = {str(row['external_id']) for row in dead}
+    fingerprints.commit(tenant_id, entity, [(key, h) for key, h in pending if key not in parked])
+    return written
 
 
-def get_internal_id(supabase, table: str, tenant_id: str, external_id) -> Optional[str]:
-    """Busca ID interno (UUID) pelo external_id (pode ser integer ou string)."""
-    if not external_id:
-        return None
-    try:
-        # Tenta buscar como integer primeiro (tipo mais comum no Neon)
-        result = supabase.table(table)\
-            .select("id")\
-            .eq("tenant_id", tenant_id)\
-            .eq("external_id", external_id)\
-            .limit(1)\
-            .execute()
-        if result.data and len(result.data) > 0:
-            return result.data[0]["id"]
-    except Exception as e:
-        # Se falhar, tenta como string
+_write_rate = None
+
+
+def get_write_rate():
+    """Controle adaptativo compartilhado por todas as escritas do container."""
+    global _write_rate
+    if _write_rate is None:
+        from utils.rate import AimdController
+        _write_rate = AimdController(
+            "sync",
+            batch_size=UPSERT_BATCH_SIZE,
+            concurrency=UPSERT_MAX_IN_FLIGHT,
+            max_concurrency=UPSERT_MAX_IN_FLIGHT,
+            pause=0.0,
+        )
+    return _write_rate
+
+
+_writer = None
+
+
+def get_writer(supabase):
+    """Writer assíncrono (HTTP/2, keep-alive) compartilhado pelo container."""
+    global _writer
+    if _writer is None:
+        from utils.writer import PostgrestWriter
+        _writer = PostgrestWriter(supabase.supabase_url, supabase.supabase_key, get_write_rate())
+    return _writer
+
+
+def close_writer():
+    """Fecha o writer do container (conexões HTTP e event loop)."""
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+
+def bulk_upsert(supabase, table: str, rows: list, on_conflict: str = "tenant_id,external_id") -> tuple:
+    """
+    Upsert em lotes, com vários lotes em voo pelo writer assíncrono.
+    
+    Linhas repetidas na chave de conflito são colapsadas (vale a última), pois o
+    Postgres rejeita um lote que atualiza a mesma linha duas vezes. Tamanho dos
+    lotes e concorrência vêm do controle adaptativo; 429/5xx/timeout são
+    tentados de novo mais devagar, e lotes de tabelas filhas esperam as escritas
+    pendentes das tabelas pais. Um lote recusado por erro de dados é dividido
+    até isolar as linhas ruins, que vão para sync_dead_letters
+    (utils/dead_letter.py). Se algum lote falhar de vez (sobrecarga ou lote
+    inteiro recusado), levanta erro no final para que o último sync não avance.
+    Retorna (gravadas, linhas que foram para dead letter).
+    """
+    if not rows:
+        return 0, []
+    
+    from utils import dead_letter
+    
+    key_columns = on_conflict.split(",")
+    unique_rows = {}
+    for row in rows:
+        unique_rows[tuple(row.get(col) for col in key_columns)] = row
+    rows = list(unique_rows.values())
+    
+    writer = get_writer(supabase)
+    
+    def write(batch):
+        _, batch_failures = writer.upsert(table, batch, on_conflict)
+        if batch_failures:
+            raise batch_failures[0][2]
+    
+    written, failures = writer.upsert(table, rows, on_conflict)
+    failed, dead = [], []
+    for start, size, error in failures:
         try:
-            result = supabase.table(table)\
-                .select("id")\
-                .eq("tenant_id", tenant_id)\
-                .eq("external_id", str(external_id))\
-                .limit(1)\
+            recovered, parked = dead_letter.settle(supabase, write, table, rows[start:start + size], error, on_conflict)
+            written += recovered
+            dead += parked
+        except Exception as e:
+            failed.append(e)
+            print(f"   ❌ {table}: lote com linhas {start}-{start + size - 1} falhou: {str(e)[:200]}")
+    
+    if failed:
+        raise RuntimeError(f"{table}: {len(failed)} lotes falharam ({written} linhas gravadas)")
+    
+    return written, dead
+
+
+class IdResolver:
+    """
+    Resolve external_id (Neon) → UUID (Supabase) em lote.
+    
+    Os IDs de um lote são buscados com uma única query `external_id=in.(...)`
+    por tabela e memoizados durante o run. As chaves são normalizadas como
+    string, então tanto integer quanto texto resolvem para o mesmo UUID.
+    
+    Com um IdMapCache, os mapas quentes são carregados do disco (com refresh
+    incremental) e só os IDs ausentes vão ao Supabase; mapas frios são
+    reconstruídos em background enquanto o run segue com as queries em lote.
+    """
+    
+    def __init__(self, supabase, tenant_id: str, chunk_size: int = RESOLVER_CHUNK_SIZE, cache=None):
+        self.supabase = supabase
+        self.tenant_id = tenant_id
+        self.chunk_size = chunk_size
+        self._maps = {}  # table → {str(external_id): uuid}
+        self.cache = cache
+        self._rebuild = None
+        if cache is not None:
+            self._load_cache()
+    
+    def _load_cache(self):
+        cold = []
+        for table in CACHED_ID_TABLES:
+            if self.cache.is_warm(self.tenant_id, table):
+                refreshed = self.cache.refresh(self.supabase, self.tenant_id, table)
+                self._maps[table] = self.cache.load(self.tenant_id, table)
+                print(f"   🗺️  {table}: {len(self._maps[table]):,} IDs em cache ({refreshed} atualizados)")
+            else:
+                cold.append(table)
+        if cold:
+            print(f"   🗺️  Cache frio ({', '.join(cold)}), reconstruindo em background")
+            self._rebuild = self.cache.start_background_rebuild(self.supabase, self.tenant_id, cold)
+    
+    def wait_for_cache(self, timeout: Optional[float] = None):
+        """Espera a reconstrução em background terminar (antes de persistir o Volume)."""
+        if self._rebuild is not None:
+            self._rebuild.join(timeout)
+    
+    def prefetch(self, table: str, external_ids) -> None:
+        """Carrega de uma vez os external_ids ainda não resolvidos."""
+        known = self._maps.setdefault(table, {})
+        pending = sorted({str(ext_id) for ext_id in external_ids if ext_id} - known.keys())
+        
+        for i in range(0, len(pending), self.chunk_size):
+            chunk = pending[i:i + self.chunk_size]
+            result = self.supabase.table(table)\
+                .select("id,external_id")\
+                .eq("tenant_id", self.tenant_id)\
+                .in_("external_id", chunk)\
                 .execute()
-            if result.data and len(result.data) > 0:
-                return result.data[0]["id"]
-        except:
-            pass
-    return None
+            for item in result.data or []:
+                known[str(item["external_id"])] = item["id"]
+    
+    def get(self, table: str, external_id) -> Optional[str]:
+        """Retorna o UUID já carregado (ou None se não existir no Supabase)."""
+        if not external_id:
+            return None
+        return self._maps.get(table, {}).get(str(external_id))
 
 
 def determine_sender_type(from_me: bool, user_id: Optional[int], content: Optional[str]) -> str:
@@ -477,42 +990,110 @@ def determine_sender_type(from_me: bool, user_id: Optional[int], content: Option
     return "agent"
 
 
-def extract_audio_url(content: str) -> Optional[str]:
-    """Extrai URL do áudio do campo content JSON."""
-    if not content:
-        return None
+def clean_content(parsed: dict) -> str:
+    """Texto da mensagem (JSON de anexo sem texto vira "[Anexo]")."""
+    text = parsed["text_content"]
+    return text if text is not None else "[Anexo]"
+
+
+# Sync alternativo por replicação lógica (CDC). Exige logical replication
+# habilitado no projeto Neon e conexão direta (sem pooler).
+# Para rodar continuamente, descomente o schedule: cada execução consome o slot
+# por ~55 min e a próxima continua do último LSN confirmado.
+@app.function(
+    image=image,
+    secrets=[secrets],
+    # schedule=modal.Cron("0 * * * *"),
+    timeout=3600,
+    volumes={"/cache": id_cache_volume},
+)
+def stream_neon_changes(max_seconds: float = CDC_RUN_SECONDS):
+    """Consome o slot wal2json do Neon e aplica as mudanças em micro-batches."""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from supabase import create_client
+    from utils.cdc import ChangeStream
+    from utils.id_cache import IdMapCache
+    from utils.fingerprints import FingerprintStore
+    from utils.tenants import load_tenants, tenant_cache_path
+    
+    print("🔄 Iniciando CDC Neon → Supabase...")
+    
+    NEON_HOST = os.environ.get("NEON_HOST")
+    # Replicação não passa pelo pooler (PgBouncer)
+    replication_host = os.environ.get("NEON_REPLICATION_HOST") or NEON_HOST.replace("-pooler", "")
+    
+    neon_conn = psycopg2.connect(
+        host=NEON_HOST,
+        database=os.environ.get("NEON_DATABASE"),
+        user=os.environ.get("NEON_USER"),
+        password=os.environ.get("NEON_PASSWORD"),
+        sslmode='require',
+        cursor_factory=RealDictCursor
+    )
+    neon_conn.autocommit = True
+    neon_cursor = neon_conn.cursor()
+    
+    supabase = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+    
+    # Um slot para o banco inteiro: cada batch é aplicado a todos os tenants do
+    # registro (fetch_rows_by_id relê as linhas filtrando pelo tenant do Neon)
+    tenants = [
+        (tenant, IdResolver(supabase, tenant.id, cache=IdMapCache(tenant_cache_path(CACHE_DIR, tenant))),
+         FingerprintStore(tenant_cache_path(CACHE_DIR, tenant)))
+        for tenant in load_tenants(supabase)
+    ]
+    totals = {}
+    
+    def apply_batch(changes):
+        for tenant, resolver, fingerprints in tenants:
+            counts = apply_change_batch(neon_cursor, supabase, tenant.id, tenant.neon_tenant_id, resolver, changes, fingerprints)
+            tenant_totals = totals.setdefault(tenant.slug, {})
+            for entity, count in counts.items():
+                tenant_totals[entity] = tenant_totals.get(entity, 0) + count
+            print(f"   📦 Batch aplicado ({tenant.slug}): {counts}")
+    
+    dsn = (
+        f"host={replication_host} dbname={os.environ.get('NEON_DATABASE')} "
+        f"user={os.environ.get('NEON_USER')} password={os.environ.get('NEON_PASSWORD')} sslmode=require"
+    )
     try:
-        data = json.loads(content)
-        attachments = data.get("attachments", [])
-        for att in attachments:
-            if att.get("file_type") == "audio":
-                return att.get("data_url")
-    except:
-        pass
-    return None
+        stats = ChangeStream(dsn).run(apply_batch, max_seconds=max_seconds)
+        print(f"✅ CDC encerrado: {stats}, gravados: {totals}")
+        return {**stats, "synced": totals}
+    finally:
+        neon_cursor.close()
+        neon_conn.close()
+        for _, resolver, _ in tenants:
+            resolver.wait_for_cache()
+        id_cache_volume.commit()
 
 
-def clean_content(content: str) -> str:
-    """Limpa o conteúdo da mensagem."""
-    if not content:
-        return ""
+# Rollup diário do sync_logs (função rollup_sync_logs em sync_worker_setup.sql):
+# logs crus viram resumos por hora e depois por dia, dentro da retenção
+@app.function(image=image, secrets=[secrets], schedule=modal.Cron("30 3 * * *"), timeout=300)
+def rollup_sync_logs():
+    """Compacta o sync_logs (os cursores ficam em sync_state e não dependem dele)."""
+    from supabase import create_client
     
-    # Se for JSON (attachment), extrair texto se houver
-    if content.startswith("{"):
-        try:
-            data = json.loads(content)
-            # Retorna o content do attachment ou string vazia
-            return data.get("content", "[Anexo]")
-        except:
-            pass
+    supabase = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+    result = supabase.rpc("rollup_sync_logs", {
+        "raw_retention": f"{SYNC_LOGS_RAW_RETENTION_HOURS} hours",
+        "hourly_retention": f"{SYNC_LOGS_HOURLY_RETENTION_DAYS} days",
+        "daily_retention": f"{SYNC_LOGS_DAILY_RETENTION_DAYS} days",
+    }).execute()
     
-    return content
+    summary = result.data or {}
+    print(f"🗜️  sync_logs: {summary.get('raw_rolled', 0)} logs → resumos por hora, "
+          f"{summary.get('hourly_rolled', 0)} resumos por hora → por dia, "
+          f"{summary.get('daily_dropped', 0)} resumos diários expirados")
+    return summary
 
 
 # Função manual para sync (para testes)
-@app.function(image=image, secrets=[secrets], timeout=300)
+@app.function(image=image, secrets=[secrets], timeout=SYNC_TIMEOUT + 60)
 def manual_sync():
-    """Trigger manual do sync."""
+    """Trigger manual do sync (todos os tenants)."""
     return sync_neon_to_supabase.remote()
 
 
@@ -17,3 +17,296 @@ CREATE TABLE IF NOT EXISTS sync_logs (
 CREATE INDEX IF NOT EXISTS idx_sync_logs_tenant ON sync_logs(tenant_id);
 CREATE INDEX IF NOT EXISTS idx_sync_logs_status ON sync_logs(status);
 CREATE INDEX IF NOT EXISTS idx_sync_logs_entity_type ON sync_logs(entity_type);
+
+-- Estado compacto do sync: uma linha por (tenant, entidade), atualizada no lugar.
+-- Guarda o cursor keyset (valor de ordenação, id) da última página gravada.
+CREATE TABLE IF NOT EXISTS sync_state (
+    tenant_id UUID REFERENCES tenants(id) ON DELETE CASCADE,
+    entity_type TEXT NOT NULL,  -- 'agents', 'contacts', 'conversations', 'messages'
+    cursor_value TEXT,          -- updated_at/created_at da última linha (ISO, como veio do Neon)
+    cursor_id BIGINT,           -- id da última linha (desempate)
+    records_synced INTEGER,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (tenant_id, entity_type)
+);
+
+-- Anexos normalizados: o sync lê o JSON do Chatwoot uma vez e grava o anexo
+-- principal e o texto em colunas próprias (utils/attachments.py), no lugar de
+-- LIKE '%"file_type":"audio"%' no content (scan sequencial).
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS attachment_type TEXT;   -- 'audio', 'image', 'video', 'file'
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS attachment_url TEXT;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS attachment_count SMALLINT DEFAULT 0;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS text_content TEXT;
+
+-- Fila de áudios / filtros por tipo: só as mensagens com anexo entram no índice
+CREATE INDEX IF NOT EXISTS idx_messages_attachment_type
+    ON messages(tenant_id, attachment_type, sent_at DESC)
+    WHERE attachment_type IS NOT NULL;
+
+-- Backfill das mensagens já sincronizadas com content JSON (rodar uma vez;
+-- em tabelas grandes, repetir com um filtro de sent_at por faixa)
+CREATE OR REPLACE FUNCTION try_jsonb(value TEXT) RETURNS JSONB AS $$
+BEGIN
+    RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+WITH parsed AS (
+    SELECT id, try_jsonb(content) AS doc
+    FROM messages
+    WHERE content LIKE '{%' AND attachment_type IS NULL AND text_content IS NULL
+)
+UPDATE messages m
+SET text_content = parsed.doc->>'content',
+    attachment_count = COALESCE(jsonb_array_length(
+        CASE WHEN jsonb_typeof(parsed.doc->'attachments') = 'array' THEN parsed.doc->'attachments' END
+    ), 0),
+    attachment_type = main.file_type,
+    attachment_url = main.url
+FROM parsed
+LEFT JOIN LATERAL (
+    SELECT lower(COALESCE(att->>'file_type', 'file')) AS file_type,
+           COALESCE(att->>'data_url', att->>'file_url') AS url
+    FROM jsonb_array_elements(
+        CASE WHEN jsonb_typeof(parsed.doc->'attachments') = 'array' THEN parsed.doc->'attachments' ELSE '[]'::jsonb END
+    ) AS att
+    ORDER BY array_position(ARRAY['audio', 'image', 'video', 'file'], lower(COALESCE(att->>'file_type', 'file'))) NULLS LAST
+    LIMIT 1
+) main ON TRUE
+WHERE m.id = parsed.id AND jsonb_typeof(parsed.doc) = 'object';
+
+UPDATE messages
+SET text_content = content
+WHERE text_content IS NULL AND content IS NOT NULL AND content NOT LIKE '{%';
+
+-- Áudios antigos gravados quando o sync_worker ainda limpava o JSON do content:
+-- só sobraram content_type = 'audio' e audio_url. Sem isso eles ficam fora da
+-- fila de transcrição, que filtra por attachment_type (índice parcial)
+UPDATE messages
+SET attachment_type = 'audio',
+    attachment_url = COALESCE(attachment_url, audio_url),
+    attachment_count = GREATEST(COALESCE(attachment_count, 0), 1)
+WHERE content_type = 'audio' AND attachment_type IS NULL;
+
+-- Registro de tenants do sync: tenant_id (integer) de cada tenant no Neon.
+-- Todo tenant com neon_tenant_id preenchido ganha um worker próprio no sync.
+ALTER TABLE tenants ADD COLUMN IF NOT EXISTS neon_tenant_id INTEGER UNIQUE;
+UPDATE tenants SET neon_tenant_id = 1 WHERE slug = 'indaia' AND neon_tenant_id IS NULL;
+
+-- Dead letters: linhas recusadas pelo Supabase (content grande demais, FK
+-- inválida...). O sync divide o lote até isolá-las, grava o resto e guarda
+-- aqui a linha já transformada com o erro (utils/dead_letter.py).
+-- Replay: python sync/replay_dead_letters.py
+CREATE TABLE IF NOT EXISTS sync_dead_letters (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    tenant_id UUID REFERENCES tenants(id) ON DELETE CASCADE,
+    target_table TEXT NOT NULL,           -- 'messages', 'conversations', ...
+    row_key TEXT NOT NULL,                -- valores da chave de conflito (tenant_id|external_id)
+    on_conflict TEXT NOT NULL DEFAULT 'tenant_id,external_id',
+    payload JSONB NOT NULL,               -- linha como seria gravada
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    failed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    resolved_at TIMESTAMPTZ,              -- preenchido quando o replay grava a linha
+    UNIQUE (target_table, row_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sync_dead_letters_pending
+    ON sync_dead_letters(target_table, failed_at)
+    WHERE resolved_at IS NULL;
+
+-- Cursor do sync incremental de mensagens (modal_jobs): fica em sync_state
+-- como entity_type 'messages_by_id' (cursor_id = último id do Neon), lido pela
+-- PK em tempo constante. sync_logs vira só histórico.
+-- O último sync completo do sync_worker também fica em sync_state ('all').
+-- Migração: cursores atuais tirados do sync_logs (rodar antes do primeiro rollup)
+INSERT INTO sync_state (tenant_id, entity_type, cursor_id, records_synced, updated_at)
+SELECT tenant_id, 'messages_by_id', MAX(last_synced_id), 0, NOW()
+FROM sync_logs
+WHERE entity_type = 'messages' AND last_synced_id IS NOT NULL
+GROUP BY tenant_id
+ON CONFLICT (tenant_id, entity_type) DO NOTHING;
+
+INSERT INTO sync_state (tenant_id, entity_type, cursor_value, records_synced, updated_at)
+SELECT tenant_id, 'all', to_json(MAX(completed_at)) #>> '{}', 0, NOW()
+FROM sync_logs
+WHERE entity_type = 'all' AND status = 'success' AND completed_at IS NOT NULL
+GROUP BY tenant_id
+ON CONFLICT (tenant_id, entity_type) DO NOTHING;
+
+-- Rollup do sync_logs: logs crus viram resumos por hora e, mais tarde, por dia
+CREATE TABLE IF NOT EXISTS sync_logs_rollup (
+    tenant_id UUID REFERENCES tenants(id) ON DELETE CASCADE,
+    entity_type TEXT NOT NULL,
+    granularity TEXT NOT NULL,        -- 'hour' ou 'day'
+    bucket TIMESTAMPTZ NOT NULL,      -- início da hora/dia
+    runs INTEGER NOT NULL DEFAULT 0,
+    error_runs INTEGER NOT NULL DEFAULT 0,
+    records_synced BIGINT NOT NULL DEFAULT 0,
+    last_synced_id BIGINT,
+    last_completed_at TIMESTAMPTZ,
+    PRIMARY KEY (tenant_id, entity_type, granularity, bucket)
+);
+
+-- Retenção: logs crus por raw_retention, resumos por hora por hourly_retention,
+-- resumos diários por daily_retention. Mover e apagar acontecem no mesmo
+-- comando (DELETE ... RETURNING), então rodar de novo não conta duas vezes.
+CREATE OR REPLACE FUNCTION rollup_sync_logs(
+    raw_retention INTERVAL DEFAULT '48 hours',
+    hourly_retention INTERVAL DEFAULT '30 days',
+    daily_retention INTERVAL DEFAULT '365 days'
+) RETURNS JSONB AS $$
+DECLARE
+    raw_rolled INTEGER;
+    hourly_rolled INTEGER;
+    daily_dropped INTEGER;
+BEGIN
+    WITH moved AS (
+        DELETE FROM sync_logs
+        WHERE created_at < NOW() - raw_retention
+        RETURNING *
+    ), rolled AS (
+        INSERT INTO sync_logs_rollup AS r (tenant_id, entity_type, granularity, bucket, runs, error_runs,
+                                           records_synced, last_synced_id, last_completed_at)
+        SELECT tenant_id, entity_type, 'hour', date_trunc('hour', created_at),
+               COUNT(*), COUNT(*) FILTER (WHERE status = 'error'),
+               COALESCE(SUM(records_synced), 0), MAX(last_synced_id), MAX(completed_at)
+        FROM moved
+        GROUP BY tenant_id, entity_type, date_trunc('hour', created_at)
+        ON CONFLICT (tenant_id, entity_type, granularity, bucket) DO UPDATE SET
+            runs = r.runs + EXCLUDED.runs,
+            error_runs = r.error_runs + EXCLUDED.error_runs,
+            records_synced = r.records_synced + EXCLUDED.records_synced,
+            last_synced_id = GREATEST(r.last_synced_id, EXCLUDED.last_synced_id),
+            last_completed_at = GREATEST(r.last_completed_at, EXCLUDED.last_completed_at)
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO raw_rolled FROM moved;
+
+    WITH moved AS (
+        DELETE FROM sync_logs_rollup
+        WHERE granularity = 'hour' AND bucket < NOW() - hourly_retention
+        RETURNING *
+    ), rolled AS (
+        INSERT INTO sync_logs_rollup AS r (tenant_id, entity_type, granularity, bucket, runs, error_runs,
+                                           records_synced, last_synced_id, last_completed_at)
+        SELECT tenant_id, entity_type, 'day', date_trunc('day', bucket),
+               SUM(runs), SUM(error_runs), SUM(records_synced), MAX(last_synced_id), MAX(last_completed_at)
+        FROM moved
+        GROUP BY tenant_id, entity_type, date_trunc('day', bucket)
+        ON CONFLICT (tenant_id, entity_type, granularity, bucket) DO UPDATE SET
+            runs = r.runs + EXCLUDED.runs,
+            error_runs = r.error_runs + EXCLUDED.error_runs,
+            records_synced = r.records_synced + EXCLUDED.records_synced,
+            last_synced_id = GREATEST(r.last_synced_id, EXCLUDED.last_synced_id),
+            last_completed_at = GREATEST(r.last_completed_at, EXCLUDED.last_completed_at)
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO hourly_rolled FROM moved;
+
+    DELETE FROM sync_logs_rollup
+    WHERE granularity = 'day' AND bucket < NOW() - daily_retention;
+    GET DIAGNOSTICS daily_dropped = ROW_COUNT;
+
+    RETURN jsonb_build_object('raw_rolled', raw_rolled, 'hourly_rolled', hourly_rolled,
+                              'daily_dropped', daily_dropped);
+END;
+$$ LANGUAGE plpgsql;
+
+-- O rollup lê os logs antigos por created_at
+CREATE INDEX IF NOT EXISTS idx_sync_logs_created_at ON sync_logs(created_at);
+
+-- ============================================
+-- CHAVE CANÔNICA DAS MENSAGENS (utils/keys.py)
+-- ============================================
+-- messages.external_id = id da mensagem no Neon. O sync_worker gravava o
+-- external_id do Chatwoot quando existia, e a mesma mensagem entrava de novo
+-- pelo modal_jobs/backfill com o id do Neon. compact_message_keys recebe os
+-- pares (chave legada, chave canônica) vindos do Neon (compact_messages.py):
+--   - só a legada existe: a linha é rechaveada;
+--   - as duas existem: a transcrição da legada passa para a canônica (se a
+--     canônica ainda não tiver uma) e a legada é apagada.
+-- Chave legada que chega com mais de uma canônica é ambígua: fica como está
+-- e só é contada. Com apply = FALSE só conta (dry-run).
+CREATE OR REPLACE FUNCTION compact_message_keys(
+    p_tenant_id UUID,
+    p_legacy_keys TEXT[],
+    p_canonical_keys TEXT[],
+    p_apply BOOLEAN DEFAULT FALSE
+) RETURNS JSONB AS $$
+DECLARE
+    result JSONB;
+    moved INTEGER := 0;
+    dropped INTEGER := 0;
+    ambiguous INTEGER := 0;
+BEGIN
+    CREATE TEMP TABLE _message_key_input ON COMMIT DROP AS
+    SELECT legacy, MIN(canonical) AS canonical, COUNT(DISTINCT canonical) AS candidates
+    FROM unnest(p_legacy_keys, p_canonical_keys) AS p(legacy, canonical)
+    WHERE legacy IS DISTINCT FROM canonical
+    GROUP BY legacy;
+
+    SELECT COUNT(*) INTO ambiguous FROM _message_key_input WHERE candidates > 1;
+
+    -- (tenant_id, external_id) é único: cada linha legada casa com um par só;
+    -- o ORDER BY deixa a escolha determinística mesmo assim
+    CREATE TEMP TABLE _message_key_pairs ON COMMIT DROP AS
+    SELECT DISTINCT ON (l.id)
+        l.id AS legacy_id,
+        p.legacy AS legacy_key,
+        p.canonical AS canonical_key,
+        c.id AS canonical_id
+    FROM _message_key_input p
+    JOIN messages l ON l.tenant_id = p_tenant_id AND l.external_id = p.legacy
+    LEFT JOIN messages c ON c.tenant_id = p_tenant_id AND c.external_id = p.canonical
+    WHERE p.candidates = 1
+    ORDER BY l.id, p.canonical, c.id;
+
+    SELECT jsonb_build_object(
+        'ambiguous', ambiguous,
+        'legacy_rows', COUNT(*),
+        'duplicates', COUNT(canonical_id),
+        'rekeyed', COUNT(*) - COUNT(canonical_id),
+        'transcriptions', (
+            SELECT COUNT(*) FROM transcriptions t
+            JOIN _message_key_pairs k ON t.message_id = k.legacy_id
+            WHERE k.canonical_id IS NOT NULL
+        ),
+        'sample', (
+            SELECT COALESCE(jsonb_agg(jsonb_build_object(
+                'legacy', s.legacy_key, 'canonical', s.canonical_key, 'duplicate', s.canonical_id IS NOT NULL
+            )), '[]'::jsonb)
+            FROM (SELECT * FROM _message_key_pairs LIMIT 5) s
+        )
+    ) INTO result
+    FROM _message_key_pairs;
+
+    IF NOT p_apply THEN
+        DROP TABLE _message_key_pairs, _message_key_input;
+        RETURN result;
+    END IF;
+
+    -- Transcrição da duplicata vai para a canônica (se ela ainda não tiver)
+    UPDATE transcriptions t SET message_id = k.canonical_id
+    FROM _message_key_pairs k
+    WHERE t.message_id = k.legacy_id AND k.canonical_id IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM transcriptions c WHERE c.message_id = k.canonical_id);
+    GET DIAGNOSTICS moved = ROW_COUNT;
+
+    DELETE FROM transcriptions t USING _message_key_pairs k
+    WHERE t.message_id = k.legacy_id AND k.canonical_id IS NOT NULL;
+    GET DIAGNOSTICS dropped = ROW_COUNT;
+
+    DELETE FROM messages m USING _message_key_pairs k
+    WHERE m.id = k.legacy_id AND k.canonical_id IS NOT NULL;
+
+    UPDATE messages m SET external_id = k.canonical_key
+    FROM _message_key_pairs k
+    WHERE m.id = k.legacy_id AND k.canonical_id IS NULL;
+
+    DROP TABLE _message_key_pairs, _message_key_input;
+    RETURN result || jsonb_build_object('transcriptions_moved', moved, 'transcriptions_dropped', dropped);
+END;
+$$ LANGUAGE plpgsql;